@@ -1,3 +1,61 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
 
-# Create your tests here.
+from threads.testing import QueryBudgetTestCase
+
+
+class AuthQueryBudgetTest(QueryBudgetTestCase):
+    """
+    SQL queries per request of the auth_app.urls endpoints
+    """
+
+    urlconf = "auth_app.urls"
+    untested_urls = {
+        "login": "the view returns no response",
+        "accounts": "django-allauth URLs",
+    }
+
+    # HTML
+
+    def test_myProfile(self):
+        path = f"/profile/{self.author.id}/edit"
+        self.assertQueryBudget(5, path, user=self.author, status=200)
+        self.assertQueryBudget(
+            11,
+            path,
+            "post",
+            user=self.author,
+            status=302,
+            data={"user-username": "author", "profile-bio": "Bio"},
+        )
+
+    def test_logout(self):
+        self.assertQueryBudget(4, "/logout", user=self.viewer, status=302)
+
+    def test_profile_delete(self):
+        user = User.objects.create_user(username="deleted", password="pass")
+        self.assertQueryBudget(18, f"/profile/{user.id}/delete", "post", user=user, status=302)
+
+    def test_google_login(self):
+        self.assertQueryBudget(0, "/google-login/", status=302)
+
+    # API
+
+    def test_myProfileApi(self):
+        path = f"/api/profile/{self.author.id}/edit/"
+        self.assertQueryBudget(0, path, "put", status=401)
+        self.assertQueryBudget(
+            23,
+            path,
+            "put",
+            user=self.author,
+            status=200,
+            data={"user": {"username": "author"}, "profile": {"bio": "Bio"}},
+            format="json",
+        )
+
+    def test_myProfileApiImages(self):
+        path = f"/api/profile/{self.author.id}/edit/images/"
+        self.assertQueryBudget(1, path, "put", user=self.viewer, status=403)
+        self.assertQueryBudget(
+            20, path, "put", user=self.author, status=200, data={"bio": "Bio"}, format="multipart"
+        )
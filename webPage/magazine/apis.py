@@ -1,6 +1,7 @@
 from rest_framework import generics 
 from rest_framework.permissions import IsAuthenticated,AllowAny,IsAuthenticatedOrReadOnly
-from .models import Magazine, Subscription
+from .models import Magazine
+from .subscriptions import subscribe, unsubscribe
 from .serializers import MagazineSerializer,CreateMagazineSerializer,SubscriptionSerializer, UnsubscriptionSerializer
 from rest_framework.generics import ListCreateAPIView
 
@@ -14,8 +15,11 @@ from rest_framework.views import APIView
 from rest_framework.authentication import TokenAuthentication
 from threads.serializers import ThreadSerializer
 from threads.models import Thread
+from threads.ranking import PERIODS, order_by_period
+from threads.response_cache import AnonymousCacheMixin, magazine_scope
+from threads.conditional import ConditionalGetMixin
 
-class MagazineDetailView(generics.RetrieveAPIView):
+class MagazineDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     queryset = Magazine.objects.all()
     serializer_class = MagazineSerializer
     authentication_classes = [TokenAuthentication]
@@ -29,9 +33,12 @@ class MagazineDetailView(generics.RetrieveAPIView):
         context['user'] = self.request.user if self.request.user.is_authenticated else None
         return context
 
-class MagazineThreadsView(generics.ListAPIView):
+class MagazineThreadsView(AnonymousCacheMixin, ConditionalGetMixin, generics.ListAPIView):
     serializer_class = ThreadSerializer
     authentication_classes = [TokenAuthentication]
+
+    def get_cache_scopes(self, **kwargs):
+        return [magazine_scope(kwargs['magazine_id'])]
     
     @swagger_auto_schema(
         manual_parameters=[
@@ -45,10 +52,19 @@ class MagazineThreadsView(generics.ListAPIView):
             openapi.Parameter(
                 "order_by",
                 openapi.IN_QUERY,
-                description="Order threads by 'created_at', 'points', or 'num_comments'",
+                description="Order threads by 'created_at', 'points', 'num_comments' or 'hot'",
                 type=openapi.TYPE_STRING,
                 default="created_at",
             ),
+            openapi.Parameter(
+                "period",
+                openapi.IN_QUERY,
+                description=(
+                    "Top threads created in the last 'day', 'week', 'month' or of 'all' time, "
+                    "by likes minus dislikes plus boosts (replaces order_by)"
+                ),
+                type=openapi.TYPE_STRING,
+            ),
         ]
     )
     def get(self, request, *args, **kwargs):
@@ -60,19 +76,24 @@ class MagazineThreadsView(generics.ListAPIView):
         return self.get_filtered_queryset(magazine)
 
     def get_filtered_queryset(self, magazine):
-        queryset = Thread.objects.filter(magazine=magazine)
+        queryset = Thread.objects.filter(magazine=magazine).select_related("author", "magazine")
         filter_option = self.request.query_params.get('filter', 'all')
         order_by = self.request.query_params.get('order_by', 'created_at')
+        period = self.request.query_params.get('period')
 
         if filter_option == 'threads':
             queryset = queryset.filter(url__isnull=True)
         elif filter_option == 'links':
             queryset = queryset.exclude(url__isnull=True)
 
-        if order_by == 'points':
+        if period in PERIODS:
+            queryset = order_by_period(queryset, period, magazine_id=magazine.id)
+        elif order_by == 'points':
             queryset = queryset.order_by('-num_points')
         elif order_by == 'num_comments':
             queryset = queryset.order_by('-num_comments')
+        elif order_by == 'hot':
+            queryset = queryset.order_by('-hot_score')
         else:
             queryset = queryset.order_by('-created_at')
 
@@ -94,16 +115,13 @@ class MagazineSubscriptionView(APIView):
     def post(self, request, magazine_id):
         """Subscribe a user to a magazine."""
         magazine = get_object_or_404(Magazine, id=magazine_id)
-        subscription, created = Subscription.objects.get_or_create(user=request.user, magazine=magazine)
+        # Inserts the subscription and updates the subscription count atomically
+        subscription, created = subscribe(request.user, magazine)
 
         if not created:
             # The subscription already exists, so we inform the user
             return Response({'status': 'already subscribed', 'user_id': request.user.id, 'magazine_id': magazine_id}, status=status.HTTP_409_CONFLICT)
 
-        # Update the subscription count when a new subscription is created
-        magazine.subscriptions_count += 1
-        magazine.save()
-
         # Serialize the subscription data
         serializer = SubscriptionSerializer(subscription)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -111,21 +129,17 @@ class MagazineSubscriptionView(APIView):
     def delete(self, request, magazine_id):
         """Unsubscribe a user from a magazine."""
         magazine = get_object_or_404(Magazine, id=magazine_id)
-        subscription = Subscription.objects.filter(user=request.user, magazine=magazine).first()
+        subscription = unsubscribe(request.user, magazine)
         
         if not subscription:
             return Response({'status': 'not subscribed', 'user_id': request.user.id, 'magazine_id': magazine_id}, status=status.HTTP_404_NOT_FOUND)
 
-        subscription.delete()
-        magazine.subscriptions_count -= 1
-        magazine.save()
-
         # Return the unsubscribed status
         serializer = UnsubscriptionSerializer(subscription)
         return Response(serializer.data, status=status.HTTP_204_NO_CONTENT)
 
 
-class MagazineList(ListCreateAPIView):
+class MagazineList(ConditionalGetMixin, ListCreateAPIView):
     authentication_classes = [TokenAuthentication]
     
     def get_serializer_context(self):
@@ -154,7 +168,8 @@ class MagazineList(ListCreateAPIView):
         elif orderby == "comments":
             ordering = "-comments_count"
 
-        return Magazine.objects.all().order_by(ordering)
+        # The author and its avatar are shown in every row
+        return Magazine.objects.select_related("author__profile").order_by(ordering)
 
     @swagger_auto_schema(
         manual_parameters=[
@@ -37,7 +37,7 @@ class Magazine(models.Model):
 
     def count_comments(self):
         # Esto asume que cada Thread tiene un conjunto de Comments relacionados
-        return sum([thread.comments.count() for thread in self.threads.all()])
+        return self.threads.aggregate(total=models.Count("comments"))["total"]
 
     def count_subscriptions(self):
         return self.subscriptions.count()
@@ -51,3 +51,10 @@ class Subscription(models.Model):
         User, on_delete=models.CASCADE, related_name="subscriptions"
     )
     # Campos adicionales para tu modelo Subscription
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "magazine"], name="unique_subscription_user_magazine"
+            ),
+        ]
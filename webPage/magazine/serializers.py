@@ -2,6 +2,7 @@ from rest_framework import serializers
 from .models import Magazine
 from django.contrib.auth import get_user_model
 from .models import Subscription
+from threads.viewer_state import ViewerStateListSerializer, get_viewer_state
 User = get_user_model()
 
 
@@ -26,6 +27,7 @@ class MagazineSerializer(serializers.ModelSerializer):
     class Meta:
         model = Magazine
         fields = ['id','name', 'title', 'author', 'description', 'rules', 'publish_date', 'subscriptions_count', 'threads_count', 'comments_count','user_has_subscribed']
+        list_serializer_class = ViewerStateListSerializer
     
     def get_author(self, obj):
         return {
@@ -35,10 +37,10 @@ class MagazineSerializer(serializers.ModelSerializer):
         }
     
     def get_user_has_subscribed(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None  # Devuelve False si no hay usuario autenticado
-        return Subscription.objects.filter(user=user, magazine=obj).exists()
+        return state.has_subscribed(obj)
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
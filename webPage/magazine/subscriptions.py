@@ -0,0 +1,51 @@
+"""
+    This module contains the subscription service shared by the API and HTML views
+
+    Subscriptions are inserted or ignored against the unique (user, magazine)
+    constraint, and subscriptions_count moves with an atomic delta only when a
+    row was really inserted or deleted. The subscribed feed of the user
+    follows (threads.feed).
+"""
+
+from django.db import transaction
+from django.db.models import F
+from threads.feed import add_subscription, remove_subscription
+from threads.votes import insert_or_ignore
+from .models import Magazine, Subscription
+
+
+def subscribe(user, magazine):
+    """
+    Subscribe the user to the magazine, returns the (subscription, created) pair
+    """
+    with transaction.atomic():
+        subscription, created = insert_or_ignore(
+            Subscription, user=user, magazine=magazine
+        )
+        if created:
+            Magazine.objects.filter(pk=magazine.pk).update(
+                subscriptions_count=F("subscriptions_count") + 1
+            )
+            add_subscription(user, magazine)
+    return subscription, created
+
+
+def unsubscribe(user, magazine):
+    """
+    Unsubscribe the user from the magazine
+
+    Returns the deleted subscription, None if the user was not subscribed.
+    """
+    with transaction.atomic():
+        subscription = Subscription.objects.filter(user=user, magazine=magazine).first()
+        if subscription is None:
+            return None
+        deleted, _ = Subscription.objects.filter(pk=subscription.pk).delete()
+        if not deleted:
+            # Deleted by a concurrent request, which moved the counter
+            return None
+        Magazine.objects.filter(pk=magazine.pk).update(
+            subscriptions_count=F("subscriptions_count") - deleted
+        )
+        remove_subscription(user, magazine)
+    return subscription
@@ -1,3 +1,141 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
 
-# Create your tests here.
+from threads.testing import QueryBudgetTestCase
+
+from .models import Magazine
+from .subscriptions import subscribe
+
+
+class MagazineConditionalGetTest(TestCase):
+    """
+    The ETag of a magazine changes with its counters and the viewer
+    """
+
+    def test_subscription_changes_the_etag(self):
+        user = User.objects.create_user(username="author", password="pass")
+        token = Token.objects.create(user=user)
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=user)
+        url = f"/api/magazines/{magazine.id}/"
+        auth = {"HTTP_AUTHORIZATION": f"Token {token.key}"}
+
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(self.client.get(url, **auth)["ETag"], etag)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        subscribe(user, magazine)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["subscriptions_count"], 1)
+
+
+class MagazineViewerStateTest(TestCase):
+    """
+    user_has_subscribed shows the subscriptions of the viewer, loaded once per list
+    """
+
+    def test_subscriptions_of_the_viewer(self):
+        viewer = User.objects.create_user(username="viewer", password="pass")
+        other = User.objects.create_user(username="other", password="pass")
+        token = Token.objects.create(user=viewer)
+        magazines = [
+            Magazine.objects.create(name=f"magazine{i}", title=f"Magazine {i}", author=other)
+            for i in range(3)
+        ]
+        subscribe(viewer, magazines[0])
+        for magazine in magazines:
+            subscribe(other, magazine)
+
+        anonymous = self.client.get("/api/magazines/").json()
+        self.assertEqual({magazine["user_has_subscribed"] for magazine in anonymous}, {None})
+
+        # The token, the list and the subscriptions
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/magazines/", HTTP_AUTHORIZATION=f"Token {token.key}")
+        self.assertEqual(
+            {magazine["id"]: magazine["user_has_subscribed"] for magazine in response.json()},
+            {magazines[0].id: True, magazines[1].id: False, magazines[2].id: False},
+        )
+
+
+class MagazineQueryBudgetTest(QueryBudgetTestCase):
+    """
+    SQL queries per request of the magazine.urls endpoints
+    """
+
+    urlconf = "magazine.urls"
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # The magazine lists are not paginated, a per-row query shows with 30
+        Magazine.objects.bulk_create(
+            [Magazine(name=f"extra{i}", title=f"Extra {i}", author=cls.author) for i in range(30)]
+        )
+
+    # HTML
+
+    def test_newMagazine(self):
+        self.assertQueryBudget(0, "/newMagazine/", status=302)
+        self.assertQueryBudget(2, "/newMagazine/", user=self.viewer, status=200)
+        self.assertQueryBudget(
+            4,
+            "/newMagazine/",
+            "post",
+            user=self.viewer,
+            status=302,
+            data={"name": "new", "title": "New", "description": "", "rules": ""},
+        )
+
+    def test_magazines(self):
+        for query in ("", "?orderby=threads", "?orderby=comments"):
+            self.assertQueryBudget(3, f"/magazines/{query}", status=200)
+            self.assertQueryBudget(4, f"/magazines/{query}", user=self.viewer, status=200)
+
+    def test_subscribe_to_magazine(self):
+        path = f"/subscribe/{self.magazine.id}/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        self.assertQueryBudget(10, path, "post", user=self.author, status=302)
+        self.assertQueryBudget(10, path, "post", user=self.author, status=302)
+
+    def test_unsubscribe_from_magazine(self):
+        path = f"/unsubscribe/{self.magazine.id}/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        self.assertQueryBudget(9, path, "post", user=self.viewer, status=302)
+        self.assertQueryBudget(6, path, "post", user=self.viewer, status=302)
+
+    # API
+
+    def test_api_magazines(self):
+        for query in ("", "?orderby=threads", "?orderby=comments"):
+            self.assertQueryBudget(1, f"/api/magazines/{query}", status=200)
+            self.assertQueryBudget(3, f"/api/magazines/{query}", user=self.viewer, status=200)
+        self.assertQueryBudget(
+            3,
+            "/api/magazines/",
+            "post",
+            user=self.viewer,
+            status=201,
+            data={"name": "new", "title": "New"},
+        )
+
+    def test_magazine_subscriptions(self):
+        path = f"/api/magazines/{self.magazine.id}/subscriptions/"
+        self.assertQueryBudget(0, path, "post", status=401)
+        self.assertQueryBudget(9, path, "post", user=self.viewer, status=409)
+        self.assertQueryBudget(10, path, "delete", user=self.viewer, status=204)
+        self.assertQueryBudget(5, path, "delete", user=self.viewer, status=404)
+        self.assertQueryBudget(9, path, "post", user=self.viewer, status=201)
+
+    def test_magazine_detail(self):
+        path = f"/api/magazines/{self.magazine.id}/"
+        self.assertQueryBudget(3, path, status=200)
+        self.assertQueryBudget(5, path, user=self.viewer, status=200)
+
+    def test_magazine_threads(self):
+        for query in ("", "?order_by=points", "?order_by=num_comments&filter=links"):
+            path = f"/api/magazines/{self.magazine.id}/threads/{query}"
+            self.assertQueryBudget(7, path, status=200)
+            self.assertQueryBudget(9, path, user=self.viewer, status=200)
@@ -6,9 +6,11 @@ from django.shortcuts import render, get_object_or_404, redirect
 from .models import Magazine
 from .forms import CreateMagazineForm
 from threads.models import Thread
+from threads.ranking import PERIODS, order_by_period
 from django.contrib.auth.decorators import login_required
 # Views handle HTTP requests and return appropriate responses
 from .models import Subscription
+from .subscriptions import subscribe, unsubscribe
 
 # View for displaying the list of magazines
 def magazines(request):
@@ -62,17 +64,8 @@ def subscribe_to_magazine(request, magazine_id):
     # Obtener la revista correspondiente según el ID proporcionado
     magazine = get_object_or_404(Magazine, id=magazine_id)
     
-    # Verificar si el usuario ya está suscrito a la revista
-    subscription_exists = Subscription.objects.filter(user=request.user, magazine=magazine).exists()
-    
-    # Si el usuario no está suscrito a la revista, crear una suscripción
-    if not subscription_exists:
-        subscription = Subscription(user=request.user, magazine=magazine)
-        subscription.save()
-        
-        # Incrementar el contador de suscripciones de la revista y guardarlo
-        magazine.subscriptions_count += 1
-        magazine.save()
+    # Crear la suscripción si no existe e incrementar el contador de la revista
+    subscribe(request.user, magazine)
     
     # Obtener la URL actual desde el formulario de suscripción
     current_url = request.POST.get("current_url", "/")
@@ -86,16 +79,9 @@ def unsubscribe_from_magazine(request, magazine_id):
     # Get the corresponding magazine based on the provided ID
     magazine = get_object_or_404(Magazine, id=magazine_id)
     
-    # Buscar la suscripción del usuario a esta revista
-    
-    subscription = Subscription.objects.filter(user=request.user, magazine=magazine).first()
-    
     # Si el usuario está suscrito a la revista, eliminar la suscripción
-    if subscription:
-        subscription.delete()
-        # Decrementar el contador de suscripciones de la revista y guardarlo
-        magazine.subscriptions_count = magazine.subscriptions_count - 1
-        magazine.save()
+    # y decrementar el contador de la revista
+    unsubscribe(request.user, magazine)
     
     # Obtener la URL actual del formulario de desuscripción
     current_url = request.POST.get("current_url", "/")
@@ -104,20 +90,25 @@ def unsubscribe_from_magazine(request, magazine_id):
     return redirect(current_url)
 
 def get_filtered_queryset(request, magazine):
-    queryset = Thread.objects.filter(magazine=magazine)
+    queryset = Thread.objects.filter(magazine=magazine).select_related("author", "magazine")
 
     filter_option = request.GET.get("filter", "all")
     order_by = request.GET.get("order_by", "created_at")
+    period = request.GET.get("period")
 
     if filter_option == "threads":
         queryset = queryset.filter(url__isnull=True)
     elif filter_option == "links":
         queryset = queryset.exclude(url__isnull=True)
 
-    if order_by == "points":
+    if period in PERIODS:
+        queryset = order_by_period(queryset, period, magazine_id=magazine.id)
+    elif order_by == "points":
         queryset = queryset.order_by("-num_points")
     elif order_by == "num_comments":
         queryset = queryset.order_by("-num_comments")
+    elif order_by == "hot":
+        queryset = queryset.order_by("-hot_score")
     else:
         queryset = queryset.order_by("-created_at")
 
@@ -140,4 +131,4 @@ def magazine_threads(request,magazine_id):
     filter_option = request.session.get("filter", "all")
     order_by = request.session.get("order_by", "created_at")
     
-    return render(request, "magazine_threads.html", {"magazine": magazine, 'threads': threads, 'active_filter': filter_option, 'active_order': order_by, "user_subscriptions": user_subscriptions})
\ No newline at end of file
+    return render(request, "magazine_threads.html", {"magazine": magazine, 'threads': threads, 'active_filter': filter_option, 'active_order': order_by, 'active_period': request.GET.get("period"), 'periods': list(PERIODS), "user_subscriptions": user_subscriptions})
\ No newline at end of file
@@ -1,15 +1,15 @@
 from rest_framework import generics
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.models import User  # Importar el modelo User
-from threads.models import Thread, Comment,Boost, CommentReply
+from threads.models import Thread, Boost
 from threads.serializers import ThreadSerializer, CommentSerializer
+from threads.activity import ActivityCursorPagination
 from .serializers import ProfileInfoSerializer
+from .views import get_filtered_queryset_comments
 from rest_framework.authentication import TokenAuthentication
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
-from itertools import chain
-from django.db.models import Q, Case, When
 
 class UserInfoView(generics.RetrieveAPIView):
     serializer_class = ProfileInfoSerializer
@@ -62,7 +62,7 @@ class UserThreadsView(generics.ListAPIView):
         return context
     
 def get_filtered_queryset(request, profile_user):
-    queryset = Thread.objects.filter(author=profile_user)
+    queryset = Thread.objects.filter(author=profile_user).select_related("author", "magazine")
     filter_option = request.GET.get("filter", "all")
     order_by = request.GET.get("order_by", "created_at")
 
@@ -87,7 +87,12 @@ def get_filtered_queryset(request, profile_user):
 class UserCommentsView(generics.ListAPIView):
     serializer_class = CommentSerializer
     #permission_classes = [IsAuthenticated]
+    # Public for reading, like the default permission: the UserActivity
+    # queryset has no model for DjangoModelPermissions
+    permission_classes = [AllowAny]
     authentication_classes = [TokenAuthentication]
+    # Comments and replies merged and paginated by the database
+    pagination_class = ActivityCursorPagination
 
     @swagger_auto_schema(
         operation_description="Get comments and replies for a thread",
@@ -99,6 +104,12 @@ class UserCommentsView(generics.ListAPIView):
                 type=openapi.TYPE_STRING,
                 default="newest",
             ),
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                description="Position of the page, from the next and previous links",
+                type=openapi.TYPE_STRING,
+            ),
         ]
     )
     def get(self, request, *args, **kwargs):
@@ -107,55 +118,12 @@ class UserCommentsView(generics.ListAPIView):
     def get_queryset(self):
         user_id = self.kwargs.get('user_id')
         user = get_object_or_404(User, id=user_id)
-        ids = get_filtered_queryset_comments(self.request, user)
-
-        # Convertir la lista de IDs en un QuerySet
-        comments_queryset = Comment.objects.filter(id__in=ids)
-        replies_queryset = CommentReply.objects.filter(id__in=ids)
-
-        # Usar Q para combinar ambos QuerySets en uno
-        combined_queryset = Comment.objects.filter(
-            Q(id__in=comments_queryset) | Q(id__in=replies_queryset)
-        ).distinct()
-
-        # Mantener el orden original de la lista
-        preserved = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(ids)])
-        combined_queryset = combined_queryset.order_by(preserved)
-
-        return combined_queryset
+        return get_filtered_queryset_comments(self.request, user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['user'] = self.request.user if self.request.user.is_authenticated else None
         return context
-from django.db.models import Q
-
-
-from django.db.models import Q
-
-def get_filtered_queryset_comments(request, profile_user):
-    comments = Comment.objects.filter(author=profile_user)
-    replies = CommentReply.objects.filter(author=profile_user)
-
-    # Combinar los QuerySets en una lista
-    combined_list = list(chain(comments, replies))
-
-    # Obtener el parámetro de ordenación
-    order_by = request.GET.get("order_by", "created_at")
-
-    # Ordenar la lista combinada en Python basándose en el criterio seleccionado
-    if order_by == "likes":
-        sorted_list = sorted(combined_list, key=lambda x: (x.num_likes, -x.created_at.timestamp()), reverse=True)
-    elif order_by == "newest":
-        sorted_list = sorted(combined_list, key=lambda x: -x.created_at.timestamp())
-    else:
-        sorted_list = sorted(combined_list, key=lambda x: x.created_at.timestamp())
-
-    # Guardar el criterio de ordenación en la sesión
-    request.session["order_by"] = order_by
-
-    # Devolver solo los IDs para convertir luego a QuerySet
-    return [obj.id for obj in sorted_list]
 
 
 class UserBoostsView(generics.ListAPIView):
@@ -167,7 +135,7 @@ class UserBoostsView(generics.ListAPIView):
         user_id = self.kwargs.get('user_id')
         user = get_object_or_404(User, id=user_id)
         boosts_user = Boost.objects.filter(user=user)
-        return Thread.objects.filter(boost__in=boosts_user).distinct()
+        return Thread.objects.filter(boost__in=boosts_user).select_related("author", "magazine").distinct()
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
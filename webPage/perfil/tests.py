@@ -1,3 +1,71 @@
-from django.test import TestCase
+from threads.testing import QueryBudgetTestCase
 
-# Create your tests here.
+
+class PerfilQueryBudgetTest(QueryBudgetTestCase):
+    """
+    SQL queries per request of the perfil.urls endpoints
+
+    The author of the dataset owns every thread, half of the comments and
+    replies and a third of the boosts.
+    """
+
+    urlconf = "perfil.urls"
+
+    # HTML
+
+    def test_profile_detail(self):
+        path = f"/profile/{self.author.id}/"
+        self.assertQueryBudget(14, path, status=200)
+        self.assertQueryBudget(14, path, user=self.viewer, status=200)
+        self.assertQueryBudget(15, path, user=self.author, status=200)
+
+    def test_profile_threads(self):
+        for query in ("", "?filter=links&order_by=points"):
+            path = f"/profile/{self.author.id}/threads{query}"
+            self.assertQueryBudget(14, path, status=200)
+            self.assertQueryBudget(14, path, user=self.viewer, status=200)
+
+    def test_profile_comments(self):
+        for query in ("", "?order_by=points"):
+            path = f"/profile/{self.author.id}/comments{query}"
+            self.assertQueryBudget(16, path, status=200)
+            self.assertQueryBudget(16, path, user=self.viewer, status=200)
+
+    def test_profile_boosts(self):
+        path = f"/profile/{self.author.id}/boosts"
+        self.assertQueryBudget(15, path, status=200)
+        self.assertQueryBudget(14, path, user=self.viewer, status=200)
+
+    # API
+
+    def test_profile_detail_api(self):
+        path = f"/api/profile/{self.author.id}/"
+        self.assertQueryBudget(16, path, status=200)
+        self.assertQueryBudget(17, path, user=self.viewer, status=200)
+
+    def test_my_profile_api(self):
+        self.assertQueryBudget(0, "/api/profile/myprofile/", status=401)
+        # Redirects to the profile of the user
+        self.assertQueryBudget(1, "/api/profile/myprofile/", user=self.author, status=302)
+
+    def test_user_threads_api(self):
+        for query in ("", "?filter=links&order_by=points"):
+            path = f"/api/profile/{self.author.id}/threads/{query}"
+            self.assertQueryBudget(7, path, status=200)
+            self.assertQueryBudget(10, path, user=self.viewer, status=200)
+
+    def test_user_comments_api(self):
+        for query in ("", "?order_by=points"):
+            path = f"/api/profile/{self.author.id}/comments/{query}"
+            self.assertQueryBudget(12, path, status=200)
+            self.assertQueryBudget(14, path, user=self.viewer, status=200)
+
+    def test_user_boosts_api(self):
+        path = f"/api/profile/{self.author.id}/boosts/"
+        self.assertQueryBudget(3, path, status=200)
+        self.assertQueryBudget(6, path, user=self.viewer, status=200)
+
+    def test_user_info_api(self):
+        path = f"/api/profile/{self.author.id}/info/"
+        self.assertQueryBudget(0, path, status=401)
+        self.assertQueryBudget(4, path, user=self.viewer, status=200)
@@ -1,13 +1,15 @@
 from django.shortcuts import render
 from django.shortcuts import get_object_or_404, render, redirect
 #from .models import ProfileUser
-from threads.models import Thread, Comment,Boost, CommentReply
+from threads.models import Thread, Boost
+from threads.activity import UserActivity
+from threads.pagination import InvalidCursor
 
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.models import User  # Importar el modelo User
 
 from django.db.models import Q
-from itertools import chain
+from django.http import Http404
 
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated
@@ -24,9 +26,10 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import authentication_classes
 from rest_framework.authentication import TokenAuthentication
 
+PROFILE_COMMENTS_PAGE_SIZE = 25
 
 def get_filtered_queryset(request, profile_user):
-    queryset = Thread.objects.filter(author=profile_user)
+    queryset = Thread.objects.filter(author=profile_user).select_related("author", "magazine")
 
     filter_option = request.GET.get("filter", "all")
     order_by = request.GET.get("order_by", "created_at")
@@ -50,27 +53,16 @@ def get_filtered_queryset(request, profile_user):
     return queryset
 
 def get_filtered_queryset_comments(request, profile_user):
-    comments = Comment.objects.filter(author=profile_user)
-    replies = CommentReply.objects.filter(author=profile_user)
-
-    # Combinar los QuerySets en una lista
-    combined_list = list(chain(comments, replies))
-
-    # Obtener el parámetro de ordenación
+    """
+    Return the comments and replies of the user in the order of the request,
+    ordered and paginated by the database (threads.activity)
+    """
     order_by = request.GET.get("order_by", "created_at")
 
-    # Ordenar la lista combinada en Python basándose en el criterio seleccionado
-    if order_by == "points":
-        sorted_list = sorted(combined_list, key=lambda x: (x.num_likes, -x.created_at.timestamp()), reverse=True)
-    elif order_by == "newest":
-        sorted_list = sorted(combined_list, key=lambda x: -x.created_at.timestamp())
-    else:
-        sorted_list = sorted(combined_list, key=lambda x: x.created_at.timestamp())
-
     # Guardar el criterio de ordenación en la sesión
     request.session["order_by"] = order_by
 
-    return sorted_list
+    return UserActivity(profile_user, order_by)
 
 # Create your views here.
 def profile_detail(request, user_id):
@@ -81,7 +73,17 @@ def profile_detail(request, user_id):
 
     threads = get_filtered_queryset(request, user)
 
-    comments = get_filtered_queryset_comments(request, user)
+    activity = get_filtered_queryset_comments(request, user)
+    comments = []
+    next_cursor = prev_cursor = None
+    if request.resolver_match.url_name == "profile_comments":
+        # Only the comments tab shows them, a page at a time
+        try:
+            page = activity.page(request.GET.get("cursor"), PROFILE_COMMENTS_PAGE_SIZE)
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        comments = page.object_list
+        next_cursor, prev_cursor = page.next_cursor, page.previous_cursor
 
     key = Token.objects.get_or_create(user=user)
     key = key[0]
@@ -93,7 +95,7 @@ def profile_detail(request, user_id):
     #<a href="{% url 'thread_detail' pk=comment.thread.id %}" class="user-inline">{{ comment.thread }}</a>,
     boosts_user = Boost.objects.filter(user=user)
 
-    boosts = Thread.objects.filter(Q(boost__in=boosts_user)).distinct()
+    boosts = Thread.objects.filter(Q(boost__in=boosts_user)).select_related("author", "magazine").distinct()
     # Get all the threads 
 
     filter_option = request.session.get("filter", "all")
@@ -111,7 +113,7 @@ def profile_detail(request, user_id):
              #   return Response("200, Ok")
           #  else:
            #     return Response("AAAAAA")
-    return render(request, 'profile_detail.html', {'profile_user': profile_user, 'threads': threads, 'comments':comments, 'comments_count': len(comments), 'boosts': boosts, 'active_filter': filter_option, 'active_order': order_by, 'key':key})
+    return render(request, 'profile_detail.html', {'profile_user': profile_user, 'threads': threads, 'comments':comments, 'comments_count': activity.count(), 'next_cursor': next_cursor, 'prev_cursor': prev_cursor, 'boosts': boosts, 'active_filter': filter_option, 'active_order': order_by, 'key':key})
 
 def get_details(request, user_id):
     user = get_object_or_404(User, id=user_id)
@@ -120,14 +122,16 @@ def get_details(request, user_id):
 
     threads = get_filtered_queryset(request, user)
 
-    comments = get_filtered_queryset_comments(request, user)
+    activity = get_filtered_queryset_comments(request, user)
+    # The first page, /api/profile/<id>/comments/ has the others
+    comments = activity.page(page_size=PROFILE_COMMENTS_PAGE_SIZE).object_list
 
     key = Token.objects.get_or_create(user=user)
     key = key[0]
 
     boosts_user = Boost.objects.filter(user=user)
 
-    boosts = Thread.objects.filter(boost__in=boosts_user).distinct()
+    boosts = Thread.objects.filter(boost__in=boosts_user).select_related("author", "magazine").distinct()
 
     filter_option = request.session.get("filter", "all")
     order_by = request.session.get("order_by", "created_at")
@@ -144,7 +148,7 @@ def get_details(request, user_id):
         'key': key.key,
         'threads_count': len(threads_serializer.data),
         'threads': threads_serializer.data,
-        'comments_count': len(comments_serializer.data),
+        'comments_count': activity.count(),
         'comments': comments_serializer.data,
         'boosts_count': len(ThreadSerializer(boosts, many=True).data,),
         'boosts': ThreadSerializer(boosts, many=True).data,
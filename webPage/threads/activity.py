@@ -0,0 +1,180 @@
+"""
+    This module contains the comment activity of a profile: the comments and
+    replies of a user in one list
+
+    Comments and replies share a table: the list walks its (author,
+    created_at) or (author, num_likes, created_at) index, ordered and
+    paginated in the database, so a page costs page_size rows whatever the
+    number of comments of the user.
+
+    The rows are ordered by the columns of the order, then the id as the
+    tie-breaker. A cursor stores the position of the boundary row of its
+    page, like the cursors of threads.pagination.
+"""
+
+from django.db.models import Q
+
+from .comment_tree import attach_replies
+from .models import Comment
+from .pagination import (
+    InvalidCursor,
+    KeysetCursorPagination,
+    KeysetPage,
+    decode_cursor,
+    decode_cursor_value,
+    encode_cursor,
+)
+
+# Columns of each order, every one in the same direction
+ACTIVITY_ORDERINGS = {
+    "oldest": ("created_at",),
+    "newest": ("-created_at",),
+    "likes": ("-num_likes", "-created_at"),
+}
+# The HTML profile calls the likes order "points"
+ACTIVITY_ORDERINGS["points"] = ACTIVITY_ORDERINGS["likes"]
+
+
+def get_activity_ordering(order_by):
+    """
+    Return the ordering of an order_by parameter, newest first when it is
+    missing or unknown
+    """
+    return ACTIVITY_ORDERINGS.get(order_by, ACTIVITY_ORDERINGS["newest"])
+
+
+def after_position(fields, values, pk, descending):
+    """
+    Return the condition of the rows after a position, in the order of the scan
+    """
+    lookup = "lt" if descending else "gt"
+    condition = Q(**{f"id__{lookup}": pk})
+    for field, value in reversed(list(zip(fields, values))):
+        condition = Q(**{f"{field}__{lookup}": value}) | (Q(**{field: value}) & condition)
+    # The first condition alone is a range of the index, the database seeks
+    # to the cursor instead of walking the previous rows
+    return Q(**{f"{fields[0]}__{lookup}e": values[0]}) & condition
+
+
+class CommentKeyset:
+    """
+    Keyset pages of the comments of get_queryset(), in one of the
+    ACTIVITY_ORDERINGS
+    """
+
+    def __init__(self, order_by="newest"):
+        self.ordering = get_activity_ordering(order_by)
+        self.fields = [term.lstrip("-") for term in self.ordering]
+        self.descending = self.ordering[0].startswith("-")
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    def load(self, rows):
+        """
+        Return the objects of the rows of a page, in their order
+        """
+        return load_rows(rows)
+
+    def rows(self, position=None, reverse=False):
+        """
+        Return the (fields..., id) rows after the position, in the order
+        they are read
+        """
+        descending = self.descending != reverse
+        rows = self.get_queryset()
+        if position is not None:
+            rows = rows.filter(after_position(self.fields, *position, descending))
+        prefix = "-" if descending else ""
+        return rows.values(*self.fields, "id").order_by(
+            *(f"{prefix}{field}" for field in [*self.fields, "id"])
+        )
+
+    def encode_cursor(self, row, reverse=False):
+        values = [row[field] for field in self.fields]
+        return encode_cursor(
+            [value.isoformat() if hasattr(value, "isoformat") else value for value in values],
+            row["id"],
+            reverse,
+        )
+
+    def decode_cursor(self, cursor):
+        """
+        Return the (values, id) position and the direction of a cursor
+        """
+        values, pk, reverse = decode_cursor(cursor)
+        if not isinstance(values, list) or len(values) != len(self.fields):
+            raise InvalidCursor(cursor)
+        values = [
+            decode_cursor_value(Comment._meta.get_field(field), value, cursor)
+            for field, value in zip(self.fields, values)
+        ]
+        return (values, pk), reverse
+
+    def page(self, cursor=None, page_size=25):
+        """
+        Return the KeysetPage of comments and replies that starts after the cursor
+
+        The objects come with what the comment serializers and the HTML
+        list show, see load().
+        """
+        position, reverse = self.decode_cursor(cursor) if cursor else (None, False)
+        rows = list(self.rows(position, reverse)[: page_size + 1])
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if reverse:
+            rows.reverse()
+        if not rows:
+            return KeysetPage(rows)
+
+        has_next = has_more if not reverse else True
+        has_previous = has_more if reverse else position is not None
+        return KeysetPage(
+            self.load(rows),
+            next_cursor=self.encode_cursor(rows[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], reverse=True) if has_previous else None,
+        )
+
+
+class UserActivity(CommentKeyset):
+    """
+    The comments and replies of a user, in one of the ACTIVITY_ORDERINGS
+    """
+
+    def __init__(self, user, order_by="newest"):
+        super().__init__(order_by)
+        self.user = user
+
+    def get_queryset(self):
+        return Comment.objects.filter(author=self.user)  # pylint: disable=no-member
+
+    def count(self):
+        """
+        Return the number of comments and replies, from the author index
+        """
+        return self.get_queryset().count()
+
+
+def load_rows(rows):
+    """
+    Return the comments and replies of the activity rows, in their order
+
+    One query plus the replies of each object (attach_replies()), the
+    replies come with their parent comment.
+    """
+    objects = Comment.objects.filter(id__in=[row["id"] for row in rows]).select_related(  # pylint: disable=no-member
+        "author", "thread__magazine", "parent_comment"
+    ).in_bulk()
+    attach_replies(list(objects.values()))
+    # A row deleted between the two queries is skipped
+    return [objects[row["id"]] for row in rows if row["id"] in objects]
+
+
+class ActivityCursorPagination(KeysetCursorPagination):
+    """
+    KeysetCursorPagination of the CommentKeyset (UserActivity, ThreadComments)
+    a view returns as its queryset
+    """
+
+    def get_page(self, queryset, cursor, page_size):
+        return queryset.page(cursor, page_size)
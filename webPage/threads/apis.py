@@ -1,11 +1,13 @@
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, ListAPIView, CreateAPIView
 from rest_framework.views import APIView
-from .models import Thread, Boost, Vote, Comment, CommentReply
+from .models import Thread, Comment, CommentReply
 from .serializers import (
     ThreadSerializer,
     CreateThreadSerializer,
     EditThreadSerializer,
     CommentSerializer,
+    CommentTreeSerializer,
+    ReplySubtreeSerializer,
     CreateCommentSerializer,
     EditCommentSerializer,
     CommentReplySerializer,
@@ -26,14 +28,25 @@ from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.shortcuts import get_object_or_404
 from django.http import Http404
-from django.db.models import F
+from .pagination import KeysetCursorPagination
+from .feed import subscribed_threads
+from .ranking import PERIODS, order_by_period
+from .activity import ActivityCursorPagination
+from .comment_pages import NodeReplies, ThreadComments
+from .comment_tree import delete_subtree, prefetch_replies
+from .conditional import ConditionalGetMixin
+from .tree_cache import CommentTreeCacheMixin
+from .search import search_threads
+from .response_cache import AnonymousCacheMixin
+from .votes import cast_vote, remove_vote, get_vote_field, add_boost, remove_boost
 
 
 
 
-class ThreadsAPIView(ListCreateAPIView):
+class ThreadsAPIView(AnonymousCacheMixin, ConditionalGetMixin, ListCreateAPIView):
     serializer_class = ThreadSerializer
     authentication_classes = [TokenAuthentication]
+    pagination_class = KeysetCursorPagination
 
     def get_permissions(self):
         if self.request.method == "POST":
@@ -47,17 +60,42 @@ class ThreadsAPIView(ListCreateAPIView):
             openapi.Parameter(
                 "filter",
                 openapi.IN_QUERY,
-                description="Filter threads by 'all', 'threads', or 'links'",
+                description=(
+                    "Filter threads by 'all', 'threads', 'links' or 'subscribed' "
+                    "(the magazines of the token user)"
+                ),
                 type=openapi.TYPE_STRING,
                 default="all",
             ),
             openapi.Parameter(
                 "order_by",
                 openapi.IN_QUERY,
-                description="Order threads by 'created_at', 'points', or 'num_comments'",
+                description="Order threads by 'created_at', 'points', 'num_comments' or 'hot'",
                 type=openapi.TYPE_STRING,
                 default="created_at",
             ),
+            openapi.Parameter(
+                "period",
+                openapi.IN_QUERY,
+                description=(
+                    "Top threads created in the last 'day', 'week', 'month' or of 'all' time, "
+                    "by likes minus dislikes plus boosts (replaces order_by)"
+                ),
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                description="Opaque cursor taken from the 'next' or 'previous' link",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "page_size",
+                openapi.IN_QUERY,
+                description="Number of threads per page (max 100)",
+                type=openapi.TYPE_INTEGER,
+                default=25,
+            ),
         ]
     )
     def get(self, request, *args, **kwargs):
@@ -69,7 +107,7 @@ class ThreadsAPIView(ListCreateAPIView):
         return ThreadSerializer
 
     def get_queryset(self):
-        queryset = Thread.objects.all()
+        queryset = Thread.objects.select_related("author", "magazine")
 
         # Get the query param "filter" from the HTTP request
         # If no query param, the default value is "all"
@@ -83,14 +121,29 @@ class ThreadsAPIView(ListCreateAPIView):
 
         # Query param
         order_by = self.request.query_params.get("order_by", "created_at")
+        period = self.request.query_params.get("period")
 
         # Order the queryset based on the query param
-        if order_by == "points":
-            queryset = queryset.order_by("-num_points")
+        # "id" is the tie-breaker that keeps the cursor pagination stable
+        if period in PERIODS:
+            queryset = order_by_period(queryset, period)
+        elif order_by == "points":
+            queryset = queryset.order_by("-num_points", "-id")
         elif order_by == "num_comments":
-            queryset = queryset.order_by("-num_comments")
+            queryset = queryset.order_by("-num_comments", "-id")
+        elif order_by == "hot":
+            queryset = queryset.order_by("-hot_score", "-id")
         else:
-            queryset = queryset.order_by("-created_at")  # Order by most recent
+            queryset = queryset.order_by("-created_at", "-id")  # Order by most recent
+
+        # After the ordering: the most recent first is read from the feed
+        if filter_option == "subscribed":
+            queryset = subscribed_threads(
+                queryset,
+                self.request.user,
+                cursor=self.request.query_params.get("cursor"),
+                page_size=self.paginator.get_page_size(self.request),
+            )
 
         return queryset
 
@@ -99,7 +152,7 @@ class ThreadsAPIView(ListCreateAPIView):
         context['user'] = self.request.user if self.request.user.is_authenticated else None
         return context
 
-class ThreadDetailAPIView(RetrieveUpdateDestroyAPIView):
+class ThreadDetailAPIView(ConditionalGetMixin, RetrieveUpdateDestroyAPIView):
     queryset = Thread.objects.all()
     serializer_class = ThreadSerializer
     lookup_field = "id"  # No se utiliza, se ha sobreescrito el método get_object
@@ -162,12 +215,9 @@ class BoostAPIView(APIView):
             )
         user = request.user
 
-        # Check if the user has already boosted this thread
-        boost, created = Boost.objects.get_or_create(user=user, thread=thread)
+        boost, created = add_boost(user, thread)
 
         if created:
-            # Update the thread with the num_likes without updating the updated_at field
-            Thread.objects.filter(id=thread_id).update(num_points=thread.num_points + 1)
             # Serialize the boost data
             boost_data = BoostSerializer(boost).data
             return Response(boost_data, status=status.HTTP_201_CREATED)
@@ -187,183 +237,110 @@ class BoostAPIView(APIView):
             )
         user = request.user
 
-        # Check if the user has already boosted this thread
-        try:
-            boost = Boost.objects.get(user=user, thread=thread)
-        except Boost.DoesNotExist:
+        if not remove_boost(user, thread):
             return Response(
                 {"message": "The user has not boosted this thread"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-        if boost:
-            # If the user has already boosted the thread, delete the Boost
-            boost.delete()
-            # Update the thread with the num_likes without updating the updated_at field
-            Thread.objects.filter(id=thread_id).update(num_points=thread.num_points - 1)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+class VoteAPIView(APIView):
+    """
+    Base view to like (POST) or unlike (DELETE) a thread, comment or reply
 
+    Subclasses set the voted model, the URL kwarg of its id, the vote type
+    and the name used in the messages. The writes go through threads.votes.
+    """
 
-class LikeAPIView(APIView):
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    model = None
+    lookup_url_kwarg = None
+    vote_type = None
+    target_name = None
+    # Key of the target id in the response, the Vote field by default
+    target_field = None
 
-    def post(self, request, *args, **kwargs):
-        thread_id = self.kwargs.get("thread_id")
-        try:
-            thread = Thread.objects.get(id=thread_id)
-        except Thread.DoesNotExist:
-            return Response(
-                {"message": "Thread does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
-
-        # Check if the user has already liked this thread
-        vote, created = Vote.objects.get_or_create(
-            user=user, thread=thread, vote_type="like"
-        )
-
-        if not created:
-            # If the user had already liked the thread, return a 409 Conflict response
-            return Response(
-                {"message": "The user has already liked this thread"},
-                status=status.HTTP_409_CONFLICT,
-            )
-
-        # If the user had previously disliked this thread, delete the dislike
-        existing_dislike = Vote.objects.filter(
-            user=user, thread=thread, vote_type="dislike"
-        ).first()
-        if existing_dislike:
-            existing_dislike.delete()
-
-        # Update the thread with the num_likes without updating the updated_at field
-        likes = Vote.objects.filter(thread=thread, vote_type="like").count()
-        dislikes = Vote.objects.filter(thread=thread, vote_type="dislike").count()
-        Thread.objects.filter(id=thread_id).update(
-            num_likes=likes, num_dislikes=dislikes
-        )
-
-        # Serialize the like data
-        like_data = {
-            "id": vote.id,
-            "user": vote.user.id,
-            "thread": vote.thread.id,
-            "vote_type": vote.vote_type,
-        }
-        return Response(like_data, status=status.HTTP_201_CREATED)
-
-    def delete(self, request, *args, **kwargs):
-        thread_id = self.kwargs.get("thread_id")
-        try:
-            thread = Thread.objects.get(id=thread_id)
-        except Thread.DoesNotExist:
-            return Response(
-                {"message": "Thread does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
+    def get_queryset(self):
+        return self.model.objects.filter(id=self.kwargs.get(self.lookup_url_kwarg))
 
-        # Check if the user has already liked this thread
+    def get_target(self):
         try:
-            like = Vote.objects.get(user=user, thread=thread, vote_type="like")
-        except Vote.DoesNotExist:
-            return Response(
-                {"message": "The user has not liked this thread"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-
-        if like:
-            # If the user has already liked the thread, delete the Like
-            like.delete()
-            # Update the thread with the num_likes without updating the updated_at field
-            likes = Vote.objects.filter(thread=thread, vote_type="like").count()
-            Thread.objects.filter(id=thread_id).update(num_likes=likes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class DislikeAPIView(APIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
+            return self.get_queryset().get()
+        except self.model.DoesNotExist:
+            return None
+
+    def target_not_found(self):
+        return Response(
+            {"message": f"{self.target_name.capitalize()} does not exist"},
+            status=status.HTTP_404_NOT_FOUND,
+        )
 
     def post(self, request, *args, **kwargs):
-        thread_id = self.kwargs.get("thread_id")
-        try:
-            thread = Thread.objects.get(id=thread_id)
-        except Thread.DoesNotExist:
-            return Response(
-                {"message": "Thread does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
+        target = self.get_target()
+        if target is None:
+            return self.target_not_found()
 
-        # Check if the user has already disliked this thread
-        vote, created = Vote.objects.get_or_create(
-            user=user, thread=thread, vote_type="dislike"
-        )
+        # Creates the vote, or switches the opposite one in place
+        vote, changed = cast_vote(request.user, target, self.vote_type)
 
-        if not created:
-            # If the user had already disliked the thread, return a 409 Conflict response
+        if not changed:
+            # If the user had already voted the same, return a 409 Conflict response
             return Response(
-                {"message": "The user has already disliked this thread"},
+                {"message": f"The user has already {self.vote_type}d this {self.target_name}"},
                 status=status.HTTP_409_CONFLICT,
             )
 
-        # If the user had previously liked this thread, delete the like
-        existing_like = Vote.objects.filter(
-            user=user, thread=thread, vote_type="like"
-        ).first()
-        if existing_like:
-            existing_like.delete()
-
-        # Update the thread with the num_likes without updating the updated_at field
-        dislikes = Vote.objects.filter(thread=thread, vote_type="dislike").count()
-        likes = Vote.objects.filter(thread=thread, vote_type="like").count()
-        Thread.objects.filter(id=thread_id).update(
-            num_dislikes=dislikes, num_likes=likes
-        )
-
-        # Serialize the dislike data
-        dislike_data = {
+        # Serialize the vote data
+        vote_data = {
             "id": vote.id,
-            "user": vote.user.id,
-            "thread": vote.thread.id,
+            "user": vote.user_id,
+            self.target_field or get_vote_field(target): target.id,
             "vote_type": vote.vote_type,
         }
-        return Response(dislike_data, status=status.HTTP_201_CREATED)
+        return Response(vote_data, status=status.HTTP_201_CREATED)
 
     def delete(self, request, *args, **kwargs):
-        thread_id = self.kwargs.get("thread_id")
-        try:
-            thread = Thread.objects.get(id=thread_id)
-        except Thread.DoesNotExist:
-            return Response(
-                {"message": "Thread does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
+        target = self.get_target()
+        if target is None:
+            return self.target_not_found()
 
-        # Check if the user has already disliked this thread
-        try:
-            dislike = Vote.objects.get(user=user, thread=thread, vote_type="dislike")
-        except Vote.DoesNotExist:
+        if not remove_vote(request.user, target, self.vote_type):
             return Response(
-                {"message": "The user has not disliked this thread"},
+                {"message": f"The user has not {self.vote_type}d this {self.target_name}"},
                 status=status.HTTP_404_NOT_FOUND,
             )
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
 
-        if dislike:
-            # If the user has already disliked the thread, delete the Dislike
-            dislike.delete()
-            # Update the thread with the num_likes without updating the updated_at field
-            dislikes = Vote.objects.filter(thread=thread, vote_type="dislike").count()
-            Thread.objects.filter(id=thread_id).update(num_dislikes=dislikes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+class LikeAPIView(VoteAPIView):
+    model = Thread
+    lookup_url_kwarg = "thread_id"
+    vote_type = "like"
+    target_name = "thread"
 
 
-class CommentDetailAPIView(RetrieveUpdateDestroyAPIView):
-    queryset = Comment.objects.all()
+class DislikeAPIView(VoteAPIView):
+    model = Thread
+    lookup_url_kwarg = "thread_id"
+    vote_type = "dislike"
+    target_name = "thread"
+
+
+class CommentDetailAPIView(ConditionalGetMixin, RetrieveUpdateDestroyAPIView):
+    queryset = Comment.objects.top_level()
     serializer_class = CommentSerializer
     lookup_field = "comment_id"
     authentication_classes = [TokenAuthentication]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == "GET":
+            # The replies are in the response and in its ETag
+            queryset = prefetch_replies(queryset)
+        return queryset
+
     def get_permissions(self):
         if self.request.method == "GET":
             self.permission_classes = [AllowAny]
@@ -391,6 +368,10 @@ class CommentDetailAPIView(RetrieveUpdateDestroyAPIView):
             )
         return super().delete(request, *args, **kwargs)
 
+    def perform_destroy(self, instance):
+        # With its replies, in one statement
+        delete_subtree(instance)
+
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         # Check if the user requesting the action is the same as the user object being retrieved
@@ -408,9 +389,11 @@ class CommentDetailAPIView(RetrieveUpdateDestroyAPIView):
     
 
 
-class CommentsAPIView(ListCreateAPIView):
-    serializer_class = CommentSerializer
+class CommentsAPIView(CommentTreeCacheMixin, ConditionalGetMixin, ListCreateAPIView):
+    serializer_class = CommentTreeSerializer
     authentication_classes = [TokenAuthentication]
+    # A page of comments, each one with its window of replies
+    pagination_class = ActivityCursorPagination
 
     def get_permissions(self):
         if self.request.method == "POST":
@@ -436,12 +419,27 @@ class CommentsAPIView(ListCreateAPIView):
                 type=openapi.TYPE_INTEGER,
                 required=True,
             ),
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                description="Opaque cursor taken from the 'next' or 'previous' link",
+                type=openapi.TYPE_STRING,
+            ),
+            openapi.Parameter(
+                "page_size",
+                openapi.IN_QUERY,
+                description=(
+                    "Number of comments per page (max 100). Every comment and reply "
+                    "shows its first replies, 'more_replies' is the cursor of the "
+                    "others for /api/comments/replies/"
+                ),
+                type=openapi.TYPE_INTEGER,
+                default=25,
+            ),
         ]
     )
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        return self.list(request, *args, **kwargs)
     
     @swagger_auto_schema(
         operation_description="Create a comment or a reply of a comment for a thread",
@@ -450,7 +448,7 @@ class CommentsAPIView(ListCreateAPIView):
     def get_serializer_class(self):
         if self.request.method == "POST":
             return CreateCommentSerializer
-        return CommentSerializer
+        return CommentTreeSerializer
     
     @swagger_auto_schema(
         operation_description="Create a comment for a thread",
@@ -459,187 +457,86 @@ class CommentsAPIView(ListCreateAPIView):
     def post(self, request, *args, **kwargs):
         return super().post(request, *args, **kwargs)
     
-    def get_queryset(self):
-        try:
-            thread = Thread.objects.get(id=self.request.query_params.get("thread_id"))
-        except Thread.DoesNotExist:
-            raise Http404("Thread does not exist")
+    def get_thread(self):
+        if not hasattr(self, "thread"):
+            try:
+                self.thread = Thread.objects.select_related("magazine").get(
+                    id=self.request.query_params.get("thread_id")
+                )
+            except (Thread.DoesNotExist, ValueError):
+                raise Http404("Thread does not exist")
+        return self.thread
 
-        queryset = Comment.objects.filter(thread=thread)
+    def get_queryset(self):
         # Query param
-         # Query param
-        order_by = self.request.query_params.get("order_by", "created_at")
-        # Order the queryset based on the query param
-        if order_by == "likes":
-            queryset = queryset.annotate(
-            net_likes=F('num_likes') - F('num_dislikes')
-            ).order_by('-net_likes', '-created_at')
-        elif order_by == "newest":
-            queryset = queryset.order_by("-created_at")
-        else:
-            queryset = queryset.order_by("created_at")  # Order by most recent
-
-        for comment in queryset:
-            comment.replies = CommentReply.objects.filter(parent_comment=comment.id, thread=comment.thread.id)
-        return queryset
+        order_by = self.request.query_params.get("order_by", "newest")
+        # Comments paginated by the query param, see threads.comment_pages
+        return ThreadComments(self.get_thread(), order_by)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context['user'] = self.request.user if self.request.user.is_authenticated else None
         return context
 
-class DislikeCommentAPIView(APIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, *args, **kwargs):
-        comment_id = self.kwargs.get("comment_id")
-        try:
-            comment = Comment.objects.get(id=comment_id)
-        except Comment.DoesNotExist:
-            return Response(
-                {"message": "Comment does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
-
-        # Check if the user has already disliked this comment
-        vote, created = Vote.objects.get_or_create(
-            user=user, comment=comment, vote_type="dislike"
-        )
-
-        if not created:
-            # If the user had already disliked the comment, return a 409 Conflict response
-            return Response(
-                {"message": "The user has already disliked this comment"},
-                status=status.HTTP_409_CONFLICT,
-            )
-
-        # If the user had previously liked this comment, delete the like
-        existing_like = Vote.objects.filter(
-            user=user, comment=comment, vote_type="like"
-        ).first()
-        if existing_like:
-            existing_like.delete()
-
-        # Update the comment with the num_likes without updating the updated_at field
-        dislikes = Vote.objects.filter(comment=comment, vote_type="dislike").count()
-        likes = Vote.objects.filter(comment=comment, vote_type="like").count()
-        Comment.objects.filter(id=comment_id).update(
-            num_dislikes=dislikes, num_likes=likes
-        )
-
-        # Serialize the dislike data
-        dislike_data = {
-            "id": vote.id,
-            "user": vote.user.id,
-            "comment": vote.comment.id,
-            "vote_type": vote.vote_type,
-        }
-        return Response(dislike_data, status=status.HTTP_201_CREATED)
-
-    def delete(self, request, *args, **kwargs):
-        comment_id = self.kwargs.get("comment_id")
-        try:
-            comment = Comment.objects.get(id=comment_id)
-        except Comment.DoesNotExist:
-            return Response(
-                {"message": "Comment does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
 
-        # Check if the user has already disliked this comment
-        try:
-            dislike = Vote.objects.get(user=user, comment=comment, vote_type="dislike")
-        except Vote.DoesNotExist:
-            return Response(
-                {"message": "The user has not disliked this comment"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
+class CommentRepliesAPIView(ConditionalGetMixin, ListAPIView):
+    """
+    The replies a comment tree does not show, from a more_replies cursor
+    """
 
-        if dislike:
-            # If the user has already disliked the comment, delete the Dislike
-            dislike.delete()
-            # Update the comment with the num_likes without updating the updated_at field
-            dislikes = Vote.objects.filter(comment=comment, vote_type="dislike").count()
-            Comment.objects.filter(id=comment_id).update(num_dislikes=dislikes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        
-        
-class LikeCommentAPIView(APIView):
+    serializer_class = ReplySubtreeSerializer
     authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
+    # NodeReplies has no model for DjangoModelPermissions
+    permission_classes = [AllowAny]
+    pagination_class = ActivityCursorPagination
 
-    def post(self, request, *args, **kwargs):
-        comment_id = self.kwargs.get("comment_id")
-        try:
-            comment = Comment.objects.get(id=comment_id)
-        except Comment.DoesNotExist:
-            return Response(
-                {"message": "Comment does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
+    @swagger_auto_schema(
+        operation_description=(
+            "Get the next replies of a comment or reply, each one with its first replies"
+        ),
+        manual_parameters=[
+            openapi.Parameter(
+                "cursor",
+                openapi.IN_QUERY,
+                description="The 'more_replies' of the comment or reply, or the 'next' link",
+                type=openapi.TYPE_STRING,
+                required=True,
+            ),
+            openapi.Parameter(
+                "page_size",
+                openapi.IN_QUERY,
+                description="Number of replies per page (max 100)",
+                type=openapi.TYPE_INTEGER,
+                default=25,
+            ),
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        return self.list(request, *args, **kwargs)
 
-        # Check if the user has already liked this comment
-        vote, created = Vote.objects.get_or_create(
-            user=user, comment=comment, vote_type="like"
-        )
+    def get_queryset(self):
+        return NodeReplies()
 
-        if not created:
-            # If the user had already liked the comment, return a 409 Conflict response
-            return Response(
-                {"message": "The user has already liked this comment"},
-                status=status.HTTP_409_CONFLICT,
-            )
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['user'] = self.request.user if self.request.user.is_authenticated else None
+        return context
 
-        # If the user had previously disliked this comment, delete the dislike
-        existing_dislike = Vote.objects.filter(
-            user=user, comment=comment, vote_type="dislike"
-        ).first()
-        if existing_dislike:
-            existing_dislike.delete()
-
-        # Update the comment with the num_likes without updating the updated_at field
-        likes = Vote.objects.filter(comment=comment, vote_type="like").count()
-        dislikes = Vote.objects.filter(comment=comment, vote_type="dislike").count()
-        Comment.objects.filter(id=comment_id).update(
-            num_likes=likes, num_dislikes=dislikes
-        )
+class CommentVoteAPIView(VoteAPIView):
+    model = Comment
+    lookup_url_kwarg = "comment_id"
+    target_name = "comment"
 
-        # Serialize the like data
-        like_data = {
-            "id": vote.id,
-            "user": vote.user.id,
-            "comment": vote.comment.id,
-            "vote_type": vote.vote_type,
-        }
-        return Response(like_data, status=status.HTTP_201_CREATED)
+    def get_queryset(self):
+        return super().get_queryset().top_level()
 
-    def delete(self, request, *args, **kwargs):
-        comment_id = self.kwargs.get("comment_id")
-        try:
-            comment = Comment.objects.get(id=comment_id)
-        except Comment.DoesNotExist:
-            return Response(
-                {"message": "Comment does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
 
-        # Check if the user has already liked this comment
-        try:
-            like = Vote.objects.get(user=user, comment=comment, vote_type="like")
-        except Vote.DoesNotExist:
-            return Response(
-                {"message": "The user has not liked this comment"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
+class DislikeCommentAPIView(CommentVoteAPIView):
+    vote_type = "dislike"
 
-        if like:
-            # If the user has already liked the comment, delete the Like
-            like.delete()
-            # Update the comment with the num_likes without updating the updated_at field
-            likes = Vote.objects.filter(comment=comment, vote_type="like").count()
-            Comment.objects.filter(id=comment_id).update(num_likes=likes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+
+class LikeCommentAPIView(CommentVoteAPIView):
+    vote_type = "like"
 
 
 class CommentReplyDetailAPIView(RetrieveUpdateDestroyAPIView):
@@ -664,7 +561,7 @@ class CommentReplyDetailAPIView(RetrieveUpdateDestroyAPIView):
     
     def get_object(self):
         queryset = self.get_queryset()
-        obj = get_object_or_404(queryset, id=self.kwargs["commentreply_id"])
+        obj = get_object_or_404(queryset.with_reply_id(self.kwargs["commentreply_id"]))
         return obj
     
     def delete(self, request, *args, **kwargs):
@@ -676,6 +573,10 @@ class CommentReplyDetailAPIView(RetrieveUpdateDestroyAPIView):
                 status=status.HTTP_403_FORBIDDEN,
             )
         return super().delete(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        # With its replies, in one statement
+        delete_subtree(instance)
     
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
@@ -688,161 +589,25 @@ class CommentReplyDetailAPIView(RetrieveUpdateDestroyAPIView):
         return super().update(request, *args, **kwargs)
 
 
-class LikeCommentReplyAPIView(APIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, *args, **kwargs):
-        commentreply_id = self.kwargs.get("commentreply_id")
-        try:
-            commentreply = CommentReply.objects.get(id=commentreply_id)
-        except CommentReply.DoesNotExist:
-            return Response(
-                {"message": "Comment reply does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
-
-        # Check if the user has already liked this comment reply
-        vote, created = Vote.objects.get_or_create(
-            user=user, reply=commentreply, vote_type="like"
-        )
-
-        if not created:
-            # If the user had already liked the comment reply, return a 409 Conflict response
-            return Response(
-                {"message": "The user has already liked this comment reply"},
-                status=status.HTTP_409_CONFLICT,
-            )
-
-        # If the user had previously disliked this comment reply, delete the dislike
-        existing_dislike = Vote.objects.filter(
-            user=user, reply=commentreply, vote_type="dislike"
-        ).first()
-        if existing_dislike:
-            existing_dislike.delete()
-
-        # Update the comment reply with the num_likes without updating the updated_at field
-        likes = Vote.objects.filter(reply=commentreply, vote_type="like").count()
-        dislikes = Vote.objects.filter(reply=commentreply, vote_type="dislike").count()
-        CommentReply.objects.filter(id=commentreply_id).update(
-            num_likes=likes, num_dislikes=dislikes
-        )
-
-        # Serialize the like data
-        like_data = {
-            "id": vote.id,
-            "user": vote.user.id,
-            "reply": vote.reply.id,
-            "vote_type": vote.vote_type,
-        }
-        return Response(like_data, status=status.HTTP_201_CREATED)
-
-    def delete(self, request, *args, **kwargs):
-        commentreply_id = self.kwargs.get("commentreply_id")
-        try:
-            commentreply = CommentReply.objects.get(id=commentreply_id)
-        except CommentReply.DoesNotExist:
-            return Response(
-                {"message": "Comment reply does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
-
-        # Check if the user has already liked this comment reply
-        try:
-            like = Vote.objects.get(user=user, reply=commentreply, vote_type="like")
-        except Vote.DoesNotExist:
-            return Response(
-                {"message": "The user has not liked this comment reply"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-        
-        if like:
-            # If the user has already liked the comment reply, delete the Like
-            like.delete()
-            # Update the comment reply with the num_likes without updating the updated_at field
-            likes = Vote.objects.filter(reply=commentreply, vote_type="like").count()
-            CommentReply.objects.filter(id=commentreply_id).update(num_likes=likes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-class DislikeCommentReplyAPIView(APIView):
-    authentication_classes = [TokenAuthentication]
-    permission_classes = [IsAuthenticated]
-
-    def post(self, request, *args, **kwargs):
-        commentreply_id = self.kwargs.get("commentreply_id")
-        try:
-            commentreply = CommentReply.objects.get(id=commentreply_id)
-        except CommentReply.DoesNotExist:
-            return Response(
-                {"message": "Comment reply does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
-
-        # Check if the user has already disliked this comment reply
-        vote, created = Vote.objects.get_or_create(
-            user=user, reply=commentreply, vote_type="dislike"
-        )
+class CommentReplyVoteAPIView(VoteAPIView):
+    model = CommentReply
+    lookup_url_kwarg = "commentreply_id"
+    target_name = "comment reply"
+    target_field = "reply"
 
-        if not created:
-            # If the user had already disliked the comment reply, return a 409 Conflict response
-            return Response(
-                {"message": "The user has already disliked this comment reply"},
-                status=status.HTTP_409_CONFLICT,
-            )
+    def get_queryset(self):
+        return self.model.objects.with_reply_id(self.kwargs.get(self.lookup_url_kwarg))
 
-        # If the user had previously liked this comment reply, delete the like
-        existing_like = Vote.objects.filter(
-            user=user, reply=commentreply, vote_type="like"
-        ).first()
-        if existing_like:
-            existing_like.delete()
-
-        # Update the comment reply with the num_likes without updating the updated_at field
-        dislikes = Vote.objects.filter(reply=commentreply, vote_type="dislike").count()
-        likes = Vote.objects.filter(reply=commentreply, vote_type="like").count()
-        CommentReply.objects.filter(id=commentreply_id).update(
-            num_dislikes=dislikes, num_likes=likes
-        )
 
-        # Serialize the dislike data
-        dislike_data = {
-            "id": vote.id,
-            "user": vote.user.id,
-            "reply": vote.reply.id,
-            "vote_type": vote.vote_type,
-        }
-        return Response(dislike_data, status=status.HTTP_201_CREATED)
+class LikeCommentReplyAPIView(CommentReplyVoteAPIView):
+    vote_type = "like"
 
-    def delete(self, request, *args, **kwargs):
-        commentreply_id = self.kwargs.get("commentreply_id")
-        try:
-            commentreply = CommentReply.objects.get(id=commentreply_id)
-        except CommentReply.DoesNotExist:
-            return Response(
-                {"message": "Comment reply does not exist"}, status=status.HTTP_404_NOT_FOUND
-            )
-        user = request.user
 
-        # Check if the user has already disliked this comment reply
-        try:
-            dislike = Vote.objects.get(user=user, reply=commentreply, vote_type="dislike")
-        except Vote.DoesNotExist:
-            return Response(
-                {"message": "The user has not disliked this comment reply"},
-                status=status.HTTP_404_NOT_FOUND,
-            )
-        
-        if dislike:
-            # If the user has already disliked the comment reply, delete the Dislike
-            dislike.delete()
-            # Update the comment reply with the num_likes without updating the updated_at field
-            dislikes = Vote.objects.filter(reply=commentreply, vote_type="dislike").count()
-            CommentReply.objects.filter(id=commentreply_id).update(num_dislikes=dislikes)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+class DislikeCommentReplyAPIView(CommentReplyVoteAPIView):
+    vote_type = "dislike"
 
 
-class SearchResultsAPIView(ListAPIView):
+class SearchResultsAPIView(AnonymousCacheMixin, ConditionalGetMixin, ListAPIView):
     serializer_class = SearchSerializer
     authentication_classes = [TokenAuthentication]
 
@@ -852,13 +617,16 @@ class SearchResultsAPIView(ListAPIView):
                 name="query",
                 in_=openapi.IN_QUERY,
                 type=openapi.TYPE_STRING,
-                description="Search threads and links by title and body",
+                description=(
+                    "Search threads and links by title and body. All the words "
+                    "must appear, 'word*' searches a prefix and '\"some words\"' a phrase"
+                ),
                 required=True
             ),
             openapi.Parameter(
                 "order_by",
                 openapi.IN_QUERY,
-                description="Order threads by 'created_at', 'points', or 'num_comments'",
+                description="Order threads by 'created_at', 'points', 'num_comments' or 'relevance'",
                 type=openapi.TYPE_STRING,
                 default="created_at",
             )
@@ -875,21 +643,11 @@ class SearchResultsAPIView(ListAPIView):
         if not query:
             return Thread.objects.none()
         
-        # Realiza la búsqueda
-        threads = Thread.objects.filter(
-            title__icontains=query
-        ) | Thread.objects.filter(body__icontains=query)
-        
         # Obtén la opción de ordenación de los parámetros de la solicitud
         order_by = self.request.query_params.get("order_by", "created_at")
-        
-        # Aplica la ordenación basada en el parámetro order_by
-        if order_by == "points":
-            threads = threads.order_by("-num_points")
-        elif order_by == "num_comments":
-            threads = threads.order_by("-num_comments")
-        else:
-            threads = threads.order_by("-created_at")  # Ordenar por lo más reciente por defecto
+
+        # Busca en el índice de texto completo y aplica la ordenación
+        threads = search_threads(query, order_by).select_related("author", "magazine")
         
         return threads
     
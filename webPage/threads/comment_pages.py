@@ -0,0 +1,200 @@
+"""
+    This module contains the paginated comment trees of a thread
+
+    A page holds page_size comments of the thread in the chosen order (a
+    keyset page, like the comment activity of a profile) and a window of the
+    replies of each one: COMMENT_TREE_BREADTH replies per node, oldest
+    first, down to COMMENT_TREE_DEPTH levels under the comment. A node with
+    more replies than the window shows gets a more_replies cursor, the rest
+    of its subtree is read later with it (NodeReplies), in windows of the
+    same size.
+
+    The window is read one level at a time: the replies of the nodes kept
+    at the previous level, numbered per node by a window function over the
+    (parent, path) index and cut in the database. A page costs the same
+    number of queries whatever the size of the trees, and its size is
+    bounded by the window.
+"""
+
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from .activity import CommentKeyset
+from .models import Comment
+from .pagination import InvalidCursor, KeysetPage, decode_cursor, encode_cursor
+
+
+def get_tree_breadth():
+    return getattr(settings, "COMMENT_TREE_BREADTH", 10)
+
+
+def get_tree_depth():
+    return getattr(settings, "COMMENT_TREE_DEPTH", 5)
+
+
+def encode_replies_cursor(node, after=""):
+    """
+    Return the cursor of the replies of a node after the one with the path ``after``
+    """
+    return encode_cursor(after, node.id)
+
+
+def decode_replies_cursor(cursor):
+    """
+    Return the (node id, path) position stored in a replies cursor
+    """
+    after, pk, _ = decode_cursor(cursor)
+    if not isinstance(after, str):
+        raise InvalidCursor(cursor)
+    return pk, after
+
+
+def get_level_queryset(parent_ids, limit):
+    """
+    Return the query of the first ``limit`` replies of each parent,
+    numbered in sibling_rank
+    """
+    ranked = Comment.objects.filter(parent_id__in=parent_ids).annotate(  # pylint: disable=no-member
+        sibling_rank=Window(RowNumber(), partition_by=F("parent_id"), order_by=F("path").asc())
+    )
+    # No ORDER BY, the database would sort the rows again
+    return ranked.filter(sibling_rank__lte=limit).select_related("author").order_by()
+
+
+def get_level(parent_ids, limit):
+    return sorted(get_level_queryset(parent_ids, limit), key=lambda reply: reply.path)
+
+
+def attach_reply_window(roots, breadth=None, depth=None):
+    """
+    Attach to every root its replies down to ``depth`` levels, ``breadth``
+    per node, in the ``replies`` attribute (every level, in display order,
+    like prefetch_replies())
+
+    The roots and the replies shown get a ``more_replies`` cursor, None
+    when every reply of the node is shown. The rows read to find the hidden
+    replies go to ``hidden_replies``. The roots should have their thread
+    (with its magazine) and their parent comment cached.
+    """
+    breadth = get_tree_breadth() if breadth is None else breadth
+    depth = get_tree_depth() if depth is None else depth
+    root_of = {}
+    for root in roots:
+        root.replies = []
+        root.hidden_replies = []
+        root.more_replies = None
+        root_of[root.id] = root
+
+    parents = {root.id: root for root in roots}
+    for level in range(depth + 1):
+        if not parents:
+            break
+        # Past the last level one row tells whether a node has replies
+        last_level = level == depth
+        kept = {}
+        last_path = {}
+        for reply in get_level(parents, 1 if last_level else breadth + 1):
+            parent = parents[reply.parent_id]
+            root = root_of[parent.id]
+            if last_level or reply.sibling_rank > breadth:
+                parent.more_replies = encode_replies_cursor(parent, last_path.get(parent.id, ""))
+                root.hidden_replies.append(reply)
+                continue
+            # Fill the foreign key caches so the serializers and templates do not query them
+            reply.thread = root.thread
+            reply.parent = parent
+            reply.parent_comment = root if not root.depth else root.parent_comment
+            reply.more_replies = None
+            root.replies.append(reply)
+            root_of[reply.id] = root
+            last_path[parent.id] = reply.path
+            kept[reply.id] = reply
+        parents = kept
+
+    for root in roots:
+        root.replies.sort(key=lambda reply: reply.path)
+    return roots
+
+
+class ThreadComments(CommentKeyset):
+    """
+    The comments of a thread in one of the ACTIVITY_ORDERINGS, each one with
+    its window of replies (attach_reply_window())
+
+    The thread should come with its magazine already selected, it is shared
+    by every node of the page.
+    """
+
+    def __init__(self, thread, order_by="newest", breadth=None, depth=None):
+        super().__init__(order_by)
+        self.thread = thread
+        self.breadth = breadth
+        self.depth = depth
+
+    def get_queryset(self):
+        return Comment.objects.top_level().filter(thread=self.thread)  # pylint: disable=no-member
+
+    def load(self, rows):
+        comments = self.get_queryset().filter(id__in=[row["id"] for row in rows]).select_related(
+            "author"
+        ).in_bulk()
+        for comment in comments.values():
+            comment.thread = self.thread
+            comment.parent_comment = None
+        attach_reply_window(list(comments.values()), self.breadth, self.depth)
+        # A comment deleted between the two queries is skipped
+        return [comments[row["id"]] for row in rows if row["id"] in comments]
+
+
+class NodeReplies:
+    """
+    The replies of a node past a more_replies cursor, each one with its
+    window of the levels left under the node
+
+    Pages like a CommentKeyset (ActivityCursorPagination), forward only: the
+    cursor of the next page is a more_replies cursor of the same node.
+    """
+
+    def __init__(self, breadth=None, depth=None):
+        self.breadth = get_tree_breadth() if breadth is None else breadth
+        self.depth = get_tree_depth() if depth is None else depth
+        # The node of the last page read
+        self.node = None
+
+    def get_node(self, pk):
+        nodes = Comment.objects.select_related("thread__magazine", "parent_comment")  # pylint: disable=no-member
+        return nodes.filter(pk=pk).first()
+
+    def page(self, cursor=None, page_size=None):
+        """
+        Return the KeysetPage of the next page_size (breadth by default)
+        replies of the node of the cursor
+
+        Raises InvalidCursor when there is no cursor, it can not be decoded
+        or its node no longer exists.
+        """
+        if not cursor:
+            raise InvalidCursor(cursor)
+        pk, after = decode_replies_cursor(cursor)
+        node = self.node = self.get_node(pk)
+        if node is None:
+            raise InvalidCursor(cursor)
+
+        page_size = page_size or self.breadth
+        replies = list(
+            Comment.objects.filter(parent_id=node.id, path__gt=after)  # pylint: disable=no-member
+            .select_related("author")
+            .order_by("path")[: page_size + 1]
+        )
+        has_next = len(replies) > page_size
+        replies = replies[:page_size]
+        for reply in replies:
+            reply.thread = node.thread
+            reply.parent = node
+            reply.parent_comment = node if not node.depth else node.parent_comment
+        attach_reply_window(replies, self.breadth, max(self.depth - 1, 0))
+        return KeysetPage(
+            replies,
+            next_cursor=encode_replies_cursor(node, replies[-1].path) if has_next else None,
+        )
@@ -0,0 +1,88 @@
+"""
+    This module contains the comment tree loaders for the Threads app
+
+    Comments and replies are rows of the same table: the replies of a list
+    of comments are fetched in display order with one query of the path
+    indexes, instead of one replies query per comment. A subtree is deleted
+    with one DELETE of its range of paths. The paginated trees of a thread
+    are in threads.comment_pages.
+"""
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import CharField, OuterRef, Prefetch, Subquery, Value, prefetch_related_objects
+from django.db.models.functions import Cast, Concat, LPad
+from .models import PATH_STEP, Comment, CommentReply, Vote
+from .signals import update_thread_comment_count
+
+
+def get_replies_prefetch(relation):
+    # The replies of a tree or the children of a reply, in display order
+    replies = CommentReply.objects.select_related("author", "thread__magazine").order_by("path")
+    return Prefetch(relation, queryset=replies, to_attr="replies")
+
+
+def prefetch_replies(queryset):
+    """
+    Select what the comment serializers show and fetch the replies of every
+    row with one query, in the ``replies`` attribute
+
+    Comments get every reply of their tree, in display order, and replies
+    their direct replies.
+    """
+    relation = "children" if queryset.model is CommentReply else "comment_replies"
+    return queryset.select_related("author", "thread__magazine").prefetch_related(
+        get_replies_prefetch(relation)
+    )
+
+
+def attach_replies(nodes):
+    """
+    prefetch_replies() for a list that mixes comments and replies: one
+    query per kind present
+    """
+    prefetch_related_objects(
+        [node for node in nodes if not node.depth], get_replies_prefetch("comment_replies")
+    )
+    prefetch_related_objects(
+        [node for node in nodes if node.depth], get_replies_prefetch("children")
+    )
+    return nodes
+
+
+def delete_subtree(comment):
+    """
+    Delete a comment or reply with its replies at every level, returns the
+    number of comments deleted
+
+    One DELETE for the votes of the subtree and one for its comments,
+    without loading the rows: no post_delete signal, the comment count of
+    the thread moves here.
+    """
+    using = comment._state.db or DEFAULT_DB_ALIAS  # pylint: disable=protected-access
+    with transaction.atomic(using=using):
+        subtree = Comment.objects.using(using).subtree(comment)  # pylint: disable=no-member
+        Vote.objects.using(using).filter(comment__in=subtree.values("id"))._raw_delete(using)  # pylint: disable=no-member,protected-access
+        deleted = subtree._raw_delete(using)  # pylint: disable=protected-access
+        update_thread_comment_count(comment, -deleted)
+    return deleted
+
+
+def rebuild_paths(using=None):
+    """
+    Write the path of every comment from the ids and the parents, one UPDATE
+    per level, returns the number of rows written
+    """
+    comments = Comment.objects.using(using or DEFAULT_DB_ALIAS)  # pylint: disable=no-member
+    step = LPad(Cast("id", CharField()), PATH_STEP, Value("0"))
+    written = comments.filter(depth=0).update(path=step)
+    depth = 1
+    while True:
+        parent_path = comments.filter(pk=OuterRef("parent_id")).values("path")[:1]
+        level = comments.filter(depth=depth).update(
+            path=Concat(Subquery(parent_path), step, output_field=CharField())
+        )
+        if not level:
+            return written
+        written += level
+        depth += 1
+
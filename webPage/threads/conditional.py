@@ -0,0 +1,111 @@
+"""
+    This module contains the conditional GET of the API (ETag, Last-Modified)
+
+    The ETag of a response is computed from the rows it is built from (their
+    ids, updated_at and counters) and the viewer, whose votes, boosts and
+    subscriptions are in the user_has_* fields. A client that sends it back
+    in If-None-Match gets a 304 as soon as the rows are loaded, before any
+    serialization: polling a thread costs the lookup of its row.
+
+    Votes, boosts and subscriptions move the counters with update(), which
+    does not touch updated_at. Last-Modified is sent but If-Modified-Since
+    alone is not enough for a 304, only the ETag is.
+"""
+
+import hashlib
+from itertools import chain
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from magazine.models import Magazine
+from .models import Thread, Comment, CommentReply
+
+# Fields of a row that change its serialized form
+VERSION_FIELDS = {
+    Thread: ("updated_at", "magazine_id", "num_likes", "num_dislikes", "num_points", "num_comments"),
+    Comment: ("updated_at", "num_likes", "num_dislikes", "num_replies"),
+    CommentReply: ("updated_at", "num_likes", "num_dislikes", "num_replies"),
+    # No updated_at, the editable fields instead
+    Magazine: ("title", "description", "rules", "subscriptions_count", "threads_count", "comments_count"),
+}
+
+
+def get_etag(request, objects):
+    """
+    Return the strong ETag of a response built from the objects for this viewer
+    """
+    parts = [request.user.pk if request.user.is_authenticated else None]
+    for obj in objects:
+        model = type(obj)
+        parts.append((model.__name__, obj.pk, *(getattr(obj, field) for field in VERSION_FIELDS[model])))
+    return '"%s"' % hashlib.sha1(repr(parts).encode()).hexdigest()[:32]
+
+
+def get_last_modified(objects):
+    timestamps = [obj.updated_at.timestamp() for obj in objects if hasattr(obj, "updated_at")]
+    return max(timestamps) if timestamps else None
+
+
+def check_conditional(request, objects):
+    """
+    Return the validators of the objects and the 304 response for them if
+    the client already has it, None otherwise
+    """
+    etag = get_etag(request, objects)
+    last_modified = get_last_modified(objects)
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        set_validators(not_modified, etag, last_modified)
+    return etag, last_modified, not_modified
+
+
+def set_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    # The user_has_* fields depend on the token
+    patch_vary_headers(response, ["Authorization"])
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    retrieve() and list() of the generic views with ETag and Last-Modified
+    """
+
+    def get_version_objects(self, obj):
+        """
+        Return the rows the representation of obj is built from: the row,
+        the replies attached by prefetch_replies() or a comment window, and
+        the hidden replies behind the more_replies cursors of the window
+        (threads.comment_pages)
+        """
+        return [obj, *getattr(obj, "replies", ()), *getattr(obj, "hidden_replies", ())]
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified, not_modified = check_conditional(
+            request, self.get_version_objects(instance)
+        )
+        if not_modified is not None:
+            return not_modified
+        serializer = self.get_serializer(instance)
+        return set_validators(Response(serializer.data), etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+        etag, last_modified, not_modified = check_conditional(
+            request, list(chain.from_iterable(map(self.get_version_objects, objects)))
+        )
+        if not_modified is not None:
+            return not_modified
+        serializer = self.get_serializer(objects, many=True)
+        if page is None:
+            response = Response(serializer.data)
+        else:
+            response = self.get_paginated_response(serializer.data)
+        return set_validators(response, etag, last_modified)
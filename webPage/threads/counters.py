@@ -0,0 +1,132 @@
+"""
+    This module contains the coalesced counter updates for the denormalized
+    num_* / *_count columns
+
+    Deltas are accumulated per transaction (savepoint) and written with one
+    atomic ``F()`` update per row when the transaction commits, so a bulk
+    import of N replies issues one UPDATE per thread instead of N recounts.
+    Outside of a transaction the update is applied immediately.
+
+    The database backend (webPage.db) writes the buffers inside the
+    transaction, right before its COMMIT, so the counters commit with the
+    rows they count. The buffers are also on_commit callbacks, which do
+    nothing once written: they write the deltas with another backend, or
+    in the tests that capture the callbacks of a TestCase.
+"""
+
+from collections import defaultdict
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+
+
+class CounterBuffer:
+    """
+    Pending deltas of one transaction: {(model, pk): {field: delta}}
+    """
+
+    def __init__(self, using):
+        self.using = using
+        self.deltas = defaultdict(lambda: defaultdict(int))
+        # Called once before writing, they may derive more deltas in bulk
+        self.hooks = {}
+        # Called once after writing, they may read the new values
+        self.after_hooks = {}
+        self.written = False
+
+    def add(self, model, pk, field, delta):
+        self.deltas[(model, pk)][field] += delta
+
+    def get_deltas(self, model, field):
+        """
+        Return {pk: delta} of the pending deltas of model.field
+        """
+        return {
+            pk: fields[field]
+            for (delta_model, pk), fields in self.deltas.items()
+            if delta_model is model and fields.get(field)
+        }
+
+    def __call__(self):
+        if self.written:
+            return
+        self.written = True
+        for hook in list(self.hooks):
+            hook(self)
+        for (model, pk), fields in self.deltas.items():
+            changes = {
+                field: F(field) + delta for field, delta in fields.items() if delta
+            }
+            if changes:
+                model._default_manager.using(self.using).filter(pk=pk).update(
+                    **changes
+                )
+        for hook in list(self.after_hooks):
+            hook(self)
+
+
+def flush_pending_buffers(connection):
+    """
+    Write the buffers of the transaction that is about to commit
+
+    Called by the database backend before COMMIT, the on_commit callbacks
+    of the rolled back savepoints are already discarded. The hooks run in
+    an atomic block of the transaction, they may register on_commit
+    callbacks and more deltas.
+    """
+    buffers = _get_unwritten_buffers(connection)
+    if not buffers:
+        return
+    with transaction.atomic(using=connection.alias, savepoint=False):
+        while buffers:
+            for buffer in buffers:
+                buffer()
+            buffers = _get_unwritten_buffers(connection)
+
+
+def _get_unwritten_buffers(connection):
+    return [
+        func
+        for _, func, *_ in connection.run_on_commit
+        if isinstance(func, CounterBuffer) and not func.written
+    ]
+
+
+def _get_pending_buffer(connection):
+    """
+    Return the CounterBuffer registered in the current savepoint, if any
+
+    A buffer is bound to the savepoint it was registered in, so a rolled back
+    savepoint discards its deltas along with its on_commit callbacks.
+    """
+    if not connection.in_atomic_block:
+        return None
+    savepoint_ids = set(connection.savepoint_ids)
+    for sids, func, *_ in connection.run_on_commit:
+        if isinstance(func, CounterBuffer) and sids == savepoint_ids:
+            return func
+    return None
+
+
+def increment(model, pk, field, delta=1, hook=None, after=None, using=None):
+    """
+    Add delta to model.field of the row pk when the transaction commits
+    (before its COMMIT with the webPage.db backend)
+
+    ``hook(buffer)`` is called once per buffer right before the write and
+    ``after(buffer)`` right after it.
+    """
+    if pk is None or not delta:
+        return
+    using = using or DEFAULT_DB_ALIAS
+    buffer = _get_pending_buffer(transaction.get_connection(using))
+    pending = buffer is not None
+    if not pending:
+        buffer = CounterBuffer(using)
+    buffer.add(model, pk, field, delta)
+    if hook is not None:
+        buffer.hooks[hook] = None
+    if after is not None:
+        buffer.after_hooks[after] = None
+    if not pending:
+        # Runs immediately when not in a transaction
+        transaction.on_commit(buffer, using=using)
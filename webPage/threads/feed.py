@@ -0,0 +1,210 @@
+"""
+    This module contains the subscribed feed of the thread lists (filter=subscribed)
+
+    Users subscribed to up to FEED_FANOUT_MAX_SUBSCRIPTIONS magazines have a
+    materialized feed: a FeedEntry row per thread of their magazines, written
+    when the thread is created (fan-out on write) and read newest first from
+    the (user, -created_at, -thread) index, like the list of one magazine.
+    Users subscribed to more magazines read the newest threads of the site
+    in the order of thread_created_idx and keep the ones of their magazines
+    (merge on read): with that many magazines the scan soon fills a page,
+    and a new thread is not copied to that many feeds.
+
+    A feed is built on the first read of its user with the newest
+    FEED_BACKFILL threads of the magazines, so it is only complete from its
+    horizon on. The pages past the horizon are read merged. Subscribing adds
+    the threads of the magazine after the horizon (FEED_BACKFILL at most,
+    moving the horizon up), unsubscribing deletes its entries and passing
+    FEED_FANOUT_MAX_SUBSCRIPTIONS drops the feed.
+
+    Only the newest first order is read from the entries, the other orders
+    of the lists filter the threads by the subscribed magazines.
+"""
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Exists, F, OuterRef, Q
+
+from magazine.models import Subscription
+from .models import Thread, Feed, FeedEntry
+from .pagination import InvalidCursor, decode_cursor, decode_cursor_value
+from .votes import insert_or_ignore
+
+# Ordering of the newest first lists, the one a feed is read in
+FEED_ORDERING = ("-created_at", "-id")
+
+
+def get_fanout_limit():
+    return getattr(settings, "FEED_FANOUT_MAX_SUBSCRIPTIONS", 100)
+
+
+def get_backfill_size():
+    return getattr(settings, "FEED_BACKFILL", 500)
+
+
+def subscribed_magazines(user):
+    return Subscription.objects.filter(user=user).values("magazine_id")
+
+
+def in_subscribed_magazine(user):
+    """
+    Return the condition of the threads in the magazines of the user
+
+    A correlated EXISTS and not an IN list: the database walks the index of
+    the ordering and checks each thread, instead of reading every thread
+    of the magazines to sort them.
+    """
+    return Exists(Subscription.objects.filter(user=user, magazine_id=OuterRef("magazine_id")))
+
+
+def after_position(created_at, thread_id):
+    """
+    Return the condition of the threads at or after (newer than) a position
+    """
+    return Q(created_at__gt=created_at) | Q(created_at=created_at, id__gte=thread_id)
+
+
+def backfill(feed, magazine_ids):
+    """
+    Add the newest threads of the magazines to the feed, after its horizon
+
+    When more than FEED_BACKFILL threads are left, the horizon moves up to
+    the oldest one added: the feed stays complete from its horizon on.
+    """
+    threads = Thread.objects.filter(magazine_id__in=magazine_ids).order_by(*FEED_ORDERING)  # pylint: disable=no-member
+    if feed.horizon_created_at is not None:
+        threads = threads.filter(after_position(feed.horizon_created_at, feed.horizon_thread_id))
+    size = get_backfill_size()
+    rows = list(threads.values_list("id", "magazine_id", "created_at")[: size + 1])
+    if len(rows) > size:
+        rows = rows[:size]
+        feed.horizon_thread_id, _, feed.horizon_created_at = rows[-1]
+        feed.save(update_fields=["horizon_created_at", "horizon_thread_id"])
+    FeedEntry.objects.bulk_create(  # pylint: disable=no-member
+        [
+            FeedEntry(user_id=feed.user_id, thread_id=thread_id, magazine_id=magazine_id, created_at=created_at)
+            for thread_id, magazine_id, created_at in rows
+        ],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+
+
+def get_feed(user):
+    """
+    Return the materialized feed of the user, built on its first read
+
+    Returns None when the user is subscribed to more than
+    FEED_FANOUT_MAX_SUBSCRIPTIONS magazines.
+    """
+    feed = Feed.objects.filter(user=user).first()  # pylint: disable=no-member
+    if feed is not None:
+        return feed
+    magazine_ids = list(subscribed_magazines(user).values_list("magazine_id", flat=True))
+    if len(magazine_ids) > get_fanout_limit():
+        return None
+    with transaction.atomic():
+        feed, created = insert_or_ignore(Feed, user=user)
+        if created:
+            backfill(feed, magazine_ids)
+    return feed
+
+
+def drop_feed(user):
+    FeedEntry.objects.filter(user=user).delete()  # pylint: disable=no-member
+    Feed.objects.filter(user=user).delete()  # pylint: disable=no-member
+
+
+def fan_out(thread, using=None):
+    """
+    Add a new (or moved) thread to the feeds of the subscribers of its magazine
+    """
+    if thread.magazine_id is None:
+        return
+    using = using or DEFAULT_DB_ALIAS
+    user_ids = Subscription.objects.using(using).filter(
+        magazine_id=thread.magazine_id, user__feed__isnull=False
+    ).values_list("user_id", flat=True)
+    FeedEntry.objects.using(using).bulk_create(  # pylint: disable=no-member
+        [
+            FeedEntry(
+                user_id=user_id,
+                thread_id=thread.id,
+                magazine_id=thread.magazine_id,
+                created_at=thread.created_at,
+            )
+            for user_id in user_ids
+        ],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+
+
+def add_subscription(user, magazine):
+    """
+    Subscription service hook: add the threads of the magazine to the feed
+    """
+    feed = Feed.objects.filter(user=user).first()  # pylint: disable=no-member
+    if feed is None:
+        # Built on the next read
+        return
+    if Subscription.objects.filter(user=user).count() > get_fanout_limit():
+        drop_feed(user)
+        return
+    backfill(feed, [magazine.id])
+
+
+def remove_subscription(user, magazine):
+    """
+    Subscription service hook: delete the threads of the magazine from the feed
+    """
+    FeedEntry.objects.filter(user=user, magazine=magazine).delete()  # pylint: disable=no-member
+
+
+def feed_covers(feed, cursor, page_size):
+    """
+    Return whether the page after the cursor is all after the horizon of the feed
+    """
+    if feed.horizon_created_at is None:
+        return True
+    horizon = (feed.horizon_created_at, feed.horizon_thread_id)
+    entries = FeedEntry.objects.filter(user_id=feed.user_id).filter(  # pylint: disable=no-member
+        Q(created_at__gt=horizon[0]) | Q(created_at=horizon[0], thread_id__gte=horizon[1])
+    )
+    if cursor:
+        try:
+            value, pk, reverse = decode_cursor(cursor)
+            created_at = decode_cursor_value(FeedEntry._meta.get_field("created_at"), value, cursor)
+        except InvalidCursor:
+            # Not a cursor of this list, the paginator rejects it
+            return True
+        if reverse:
+            # The rows before the cursor, up to the newest
+            return (created_at, pk) >= horizon
+        entries = entries.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, thread_id__lt=pk))
+    return entries.order_by("-created_at", "-thread")[page_size : page_size + 1].exists()
+
+
+def subscribed_threads(queryset, user, cursor=None, page_size=25):
+    """
+    Return the threads of the queryset in the magazines the user is subscribed to
+
+    A newest first queryset is read from the feed of the user, when it has
+    one and the page after the cursor is in it; the others are filtered by
+    the subscribed magazines and keep their order.
+    """
+    if not user.is_authenticated:
+        return queryset.none()
+    if tuple(queryset.query.order_by) == FEED_ORDERING:
+        feed = get_feed(user)
+        if feed is not None and feed_covers(feed, cursor, page_size):
+            # The ordering columns are read from the feed index
+            return (
+                queryset.filter(feed_entries__user=user)
+                .annotate(
+                    feed_created_at=F("feed_entries__created_at"),
+                    feed_thread=F("feed_entries__thread_id"),
+                )
+                .order_by("-feed_created_at", "-feed_thread")
+            )
+    return queryset.filter(in_subscribed_magazine(user))
@@ -0,0 +1,392 @@
+"""
+    This module is a script to load test the API with a realistic mix of
+    requests
+
+    Front page reads, thread opens, comment lists, searches, votes and
+    comment posts are sent by concurrent workers, in process through the
+    WSGI handler (default) or to a running server (--url). The latency
+    percentiles, requests per second and SQL queries per request (in process
+    only) are printed and can be saved as JSON to diff runs across commits.
+
+    Writes go to the configured database: run it on seeded data
+    (manage.py seed_data), never on production.
+"""
+
+import json
+import logging
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from threads.models import Thread, Comment
+
+# Scenario -> share of the requests
+DEFAULT_MIX = {
+    "front_page": 40,
+    "open_thread": 20,
+    "comments": 15,
+    "search": 10,
+    "vote": 10,
+    "post_comment": 5,
+}
+
+SEARCH_TERMS = ["python", "django", "linux", "open source", "rust*", "web api"]
+
+# Most requests go to the popular threads
+HOT_THREADS = 1000
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile of sorted values
+    """
+    if not values:
+        return None
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def parse_mix(text):
+    """
+    'front_page=40,vote=10' -> {'front_page': 40, 'vote': 10}
+    """
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise CommandError(
+                f"Unknown scenario '{name}', use: {', '.join(DEFAULT_MIX)}"
+            )
+        try:
+            mix[name] = float(weight)
+        except ValueError as error:
+            raise CommandError(f"Wrong weight in '{item}'") from error
+    return mix
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class InProcessTransport:
+    """
+    Send the requests through the Django handler of this process, one client
+    and database connection per worker thread
+    """
+
+    counts_queries = True
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def request(self, method, path, token=None, data=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client(
+                SERVER_NAME="127.0.0.1", raise_request_exception=False
+            )
+        kwargs = {"headers": {"Authorization": f"Token {token}"} if token else {}}
+        if data is not None:
+            kwargs.update(data=json.dumps(data), content_type="application/json")
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            response = getattr(client, method.lower())(path, **kwargs)
+        return response.status_code, len(response.content), len(queries)
+
+    def close(self):
+        connections.close_all()
+
+
+class HTTPTransport:
+    """
+    Send the requests to a running server with a keep-alive connection per
+    worker thread
+    """
+
+    counts_queries = False
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise CommandError(f"Wrong --url: {url}")
+        self.connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.local = threading.local()
+
+    def request(self, method, path, token=None, data=None):
+        headers = {"Authorization": f"Token {token}"} if token else {}
+        body = None
+        if data is not None:
+            body = json.dumps(data)
+            headers["Content-Type"] = "application/json"
+        # One retry when the server closed the kept alive connection
+        for attempt in range(2):
+            http = getattr(self.local, "http", None)
+            if http is None:
+                http = self.local.http = self.connection_class(self.netloc, timeout=60)
+            try:
+                http.request(method, self.prefix + path, body=body, headers=headers)
+                response = http.getresponse()
+                content = response.read()
+                return response.status, len(content), None
+            except (ConnectionError, OSError):
+                http.close()
+                self.local.http = None
+                if attempt:
+                    raise
+        return None
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    """
+    Load test the API and report latency percentiles
+    """
+
+    help = "Send a read/write mix of API requests and report the latencies"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server, the requests are sent in process by default",
+        )
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument(
+            "--warmup", type=int, default=50, help="Requests sent before measuring"
+        )
+        parser.add_argument(
+            "--mix",
+            type=parse_mix,
+            default=DEFAULT_MIX,
+            help="Share of every scenario, default: "
+            + ",".join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()),
+        )
+        parser.add_argument(
+            "--authenticated",
+            type=float,
+            default=0.5,
+            help="Share of the reads sent with a token",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results to this JSON file")
+        parser.add_argument(
+            "--compare", help="JSON file of a previous run to compare with"
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.tokens = list(Token.objects.order_by("user_id").values_list("key", flat=True)[:1000])
+        self.thread_ids = list(
+            Thread.objects.order_by("-num_comments", "id").values_list("id", flat=True)[:HOT_THREADS]
+        )
+        if not self.tokens or not self.thread_ids:
+            raise CommandError("There are no users or threads, run seed_data first.")
+        self.comment_ids = list(
+            Comment.objects.top_level().filter(thread_id__in=self.thread_ids[:100])
+            .order_by("id")
+            .values_list("id", flat=True)[:HOT_THREADS]
+        )
+        self.hot_weights = [1 / rank for rank in range(1, len(self.thread_ids) + 1)]
+        self.authenticated = options["authenticated"]
+        if settings.DEBUG and not options["url"]:
+            self.stderr.write(
+                "DEBUG is on: every query is kept in memory, the latencies are higher"
+            )
+
+        transport = HTTPTransport(options["url"]) if options["url"] else InProcessTransport()
+        names = list(options["mix"])
+        weights = [options["mix"][name] for name in names]
+        plan = [
+            self.build_request(name)
+            for name in self.rng.choices(names, weights, k=options["warmup"] + options["requests"])
+        ]
+
+        # The 409 of repeated votes would be logged as warnings
+        request_logger = logging.getLogger("django.request")
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            self.run(transport, plan[: options["warmup"]], options["concurrency"])
+            started = time.perf_counter()
+            samples = self.run(transport, plan[options["warmup"] :], options["concurrency"])
+            elapsed = time.perf_counter() - started
+        finally:
+            request_logger.setLevel(level)
+
+        results = self.summarize(samples, elapsed, transport.counts_queries)
+        results["run"] = {
+            "commit": git_commit(),
+            "date": timezone.now().isoformat(timespec="seconds"),
+            "target": options["url"] or "in-process",
+            "requests": options["requests"],
+            "concurrency": options["concurrency"],
+            "mix": options["mix"],
+            "seed": options["seed"],
+        }
+        self.print_results(results)
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                self.print_comparison(json.load(file), results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+                file.write("\n")
+            self.stdout.write(f"Results written to {options['output']}")
+
+    def hot_thread(self):
+        return self.rng.choices(self.thread_ids, self.hot_weights)[0]
+
+    def reader_token(self):
+        if self.rng.random() < self.authenticated:
+            return self.rng.choice(self.tokens)
+        return None
+
+    def build_request(self, name):
+        """
+        Return the (scenario, method, path, token, data) of one request
+        """
+        rng = self.rng
+        if name == "front_page":
+            order_by = rng.choice(["created_at", "created_at", "points", "num_comments"])
+            path = f"/api/threads/?order_by={order_by}"
+            if rng.random() < 0.2:
+                path += "&filter=links"
+            return name, "GET", path, self.reader_token(), None
+        if name == "open_thread":
+            return name, "GET", f"/api/threads/{self.hot_thread()}/", self.reader_token(), None
+        if name == "comments":
+            path = f"/api/comments/?thread_id={self.hot_thread()}"
+            return name, "GET", path, self.reader_token(), None
+        if name == "search":
+            query = rng.choice(SEARCH_TERMS).replace(" ", "+")
+            order_by = rng.choice(["relevance", "created_at", "points"])
+            return name, "GET", f"/api/search/?query={query}&order_by={order_by}", self.reader_token(), None
+        if name == "vote":
+            vote_type = "likes" if rng.random() < 0.8 else "dislikes"
+            if self.comment_ids and rng.random() < 0.3:
+                path = f"/api/comments/{rng.choice(self.comment_ids)}/{vote_type}/"
+            else:
+                path = f"/api/threads/{self.hot_thread()}/{vote_type}/"
+            return name, "POST", path, rng.choice(self.tokens), None
+        data = {"thread": self.hot_thread(), "body": f"Benchmark comment {rng.getrandbits(32)}"}
+        return name, "POST", "/api/comments/", rng.choice(self.tokens), data
+
+    def run(self, transport, plan, concurrency):
+        """
+        Send the plan with concurrent workers, returns the samples
+        """
+
+        def send(item):
+            name, method, path, token, data = item
+            started = time.perf_counter()
+            try:
+                status, size, queries = transport.request(method, path, token, data)
+            except (ConnectionError, OSError):
+                status, size, queries = None, 0, None
+            return name, status, time.perf_counter() - started, size, queries
+
+        def worker(items):
+            try:
+                return [send(item) for item in items]
+            finally:
+                transport.close()
+
+        # Every worker sends an interleaved slice of the plan
+        slices = [plan[index::concurrency] for index in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return [sample for samples in executor.map(worker, slices) for sample in samples]
+
+    def summarize(self, samples, elapsed, counts_queries):
+        groups = defaultdict(list)
+        for sample in samples:
+            groups[sample[0]].append(sample)
+            groups["total"].append(sample)
+
+        def stats(group):
+            latencies = sorted(sample[2] * 1000 for sample in group)
+            statuses = defaultdict(int)
+            for sample in group:
+                statuses[str(sample[1])] += 1
+            queries = [sample[4] for sample in group if sample[4] is not None]
+            return {
+                "requests": len(group),
+                "errors": sum(1 for sample in group if sample[1] is None or sample[1] >= 500),
+                "statuses": dict(statuses),
+                "requests_per_second": round(len(group) / elapsed, 1),
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies), 2),
+                    "p50": round(percentile(latencies, 50), 2),
+                    "p95": round(percentile(latencies, 95), 2),
+                    "p99": round(percentile(latencies, 99), 2),
+                    "max": round(latencies[-1], 2),
+                },
+                "queries_per_request": (
+                    round(sum(queries) / len(queries), 1) if counts_queries and queries else None
+                ),
+                "bytes_per_response": round(sum(sample[3] for sample in group) / len(group)),
+            }
+
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "scenarios": {name: stats(group) for name, group in sorted(groups.items())},
+        }
+
+    def print_results(self, results):
+        self.stdout.write(
+            f"{'scenario':<14}{'reqs':>7}{'err':>5}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}"
+        )
+        for name, stats in results["scenarios"].items():
+            latency = stats["latency_ms"]
+            queries = stats["queries_per_request"]
+            self.stdout.write(
+                f"{name:<14}{stats['requests']:>7}{stats['errors']:>5}"
+                f"{stats['requests_per_second']:>9}{latency['p50']:>9}"
+                f"{latency['p95']:>9}{latency['p99']:>9}"
+                f"{'-' if queries is None else queries:>9}"
+            )
+
+    def print_comparison(self, previous, results):
+        commit = previous.get("run", {}).get("commit")
+        self.stdout.write(f"\nCompared with {commit or 'the previous run'}:")
+        for name, stats in results["scenarios"].items():
+            old = previous.get("scenarios", {}).get(name)
+            if old is None:
+                continue
+            changes = []
+            for key in ("p50", "p95", "p99"):
+                before, after = old["latency_ms"][key], stats["latency_ms"][key]
+                change = (after - before) / before * 100 if before else 0
+                changes.append(f"{key} {before}->{after} ({change:+.0f}%)")
+            self.stdout.write(f"{name:<14}" + "  ".join(changes))
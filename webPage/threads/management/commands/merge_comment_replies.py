@@ -0,0 +1,95 @@
+"""
+    This module is a script to move the replies of an existing database from
+    the old replies table to the comments table
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from threads.comment_tree import rebuild_paths
+from threads.models import Comment, Vote
+
+OLD_TABLE = "threads_commentreply"
+# Columns of the replies written by manage.py sync_schema
+MERGE_COLUMNS = {"parent_id", "parent_comment_id", "depth", "legacy_reply_id", "path"}
+
+
+class Command(BaseCommand):
+    """
+    Comments and replies share the comments table. The comments keep their
+    ids, the replies are renumbered above every old id (the old id + the
+    largest id of both tables) and keep their old id in legacy_reply_id,
+    the reply endpoints of the API still find them by it. Their votes move
+    to the comment column.
+
+    Run ``manage.py sync_schema`` first, for the new columns. The paths of
+    the comments are rebuilt after the merge. The old table is emptied and
+    left in place, running the command again does nothing.
+    """
+
+    help = "Move the replies of the old replies table to the comments table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        comments = Comment._meta.db_table  # pylint: disable=protected-access
+        votes = Vote._meta.db_table  # pylint: disable=protected-access
+        with connection.cursor() as cursor:
+            if OLD_TABLE not in connection.introspection.table_names(cursor):
+                self.stdout.write("There is no replies table, nothing to merge.")
+                return
+            missing = MERGE_COLUMNS - self.get_columns(cursor, connection, comments)
+            if missing:
+                raise CommandError(
+                    f"The comments table has no {', '.join(sorted(missing))} column, "
+                    "run manage.py sync_schema first."
+                )
+            move_votes = "reply_id" in self.get_columns(cursor, connection, votes)
+
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT MAX(id) FROM {comments} UNION ALL SELECT MAX(id) FROM {OLD_TABLE}"
+            )
+            offset = max(row[0] or 0 for row in cursor.fetchall())
+            cursor.execute(
+                f"""
+                INSERT INTO {comments} (
+                    id, thread_id, author_id, parent_id, parent_comment_id, body,
+                    magazine_id, created_at, updated_at, num_likes, num_dislikes,
+                    num_replies, depth, legacy_reply_id, path
+                )
+                SELECT
+                    id + %s, thread_id, author_id,
+                    COALESCE(parent_reply_id + %s, parent_comment_id), parent_comment_id, body,
+                    magazine_id, created_at, updated_at, num_likes, num_dislikes,
+                    num_replies, reply_level, id, ''
+                FROM {OLD_TABLE}
+                """,
+                [offset, offset],
+            )
+            merged = cursor.rowcount
+            if move_votes:
+                cursor.execute(
+                    f"UPDATE {votes} SET comment_id = reply_id + %s, reply_id = NULL "
+                    "WHERE reply_id IS NOT NULL",
+                    [offset],
+                )
+            cursor.execute(f"DELETE FROM {OLD_TABLE}")
+            # The next comments are numbered after the merged replies
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Comment]):
+                cursor.execute(sql)
+        rebuild_paths(using=connection.alias)
+
+        self.stdout.write(
+            self.style.SUCCESS(  # pylint: disable=no-member
+                f"{merged} replies merged, their ids moved by {offset}."
+            )
+        )
+
+    def get_columns(self, cursor, connection, table):
+        return {
+            column.name for column in connection.introspection.get_table_description(cursor, table)
+        }
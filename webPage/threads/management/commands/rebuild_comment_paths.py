@@ -0,0 +1,24 @@
+"""
+    This module is a script to recompute the materialized path of every comment
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from threads.comment_tree import rebuild_paths
+
+
+class Command(BaseCommand):
+    """
+    Recompute Comment.path from the ids and the parents (see threads.models),
+    for the rows written before the column existed or without save()
+    """
+
+    help = "Recompute the materialized path of the comments and replies"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        written = rebuild_paths(using=options["database"])
+        self.stdout.write(f"{written} paths written.")
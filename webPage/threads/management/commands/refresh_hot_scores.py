@@ -0,0 +1,28 @@
+"""
+    This module is a script to recompute the "hot" score of every thread
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from threads.ranking import refresh_hot_scores
+
+
+class Command(BaseCommand):
+    """
+    Recompute Thread.hot_score from the counters (see threads.ranking)
+    """
+
+    help = "Recompute the hot score of the threads from their counters"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Threads read and written per query"
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        changed = refresh_hot_scores(using=options["database"], batch_size=options["batch_size"])
+        self.stdout.write(f"{changed} hot scores updated.")
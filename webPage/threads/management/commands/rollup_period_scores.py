@@ -0,0 +1,39 @@
+"""
+    This module is a script to roll the top of the period rankings forward
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from threads.ranking import PERIODS, rollup_period_scores
+
+
+class Command(BaseCommand):
+    """
+    Drop the threads that aged out of the periods and repair the scores
+    from the counters (see threads.ranking), to run every few minutes
+    """
+
+    help = "Roll the top of the period rankings forward and repair their scores"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--period",
+            action="append",
+            choices=list(PERIODS),
+            help="Period to roll up, repeatable (default: day, week and month)",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Threads read and written per query"
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        periods = options["period"] or [period for period, length in PERIODS.items() if length]
+        with transaction.atomic(using=options["database"]):
+            deleted, written = rollup_period_scores(
+                periods, using=options["database"], batch_size=options["batch_size"]
+            )
+        self.stdout.write(f"{deleted} expired and {written} updated period scores.")
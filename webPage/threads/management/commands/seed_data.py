@@ -0,0 +1,447 @@
+"""
+    This module is a script to insert a large synthetic dataset in the database
+
+    Users, magazines, threads, comments, nested reply chains, votes, boosts
+    and subscriptions are generated from a seeded random generator and
+    written with batched bulk_create(), so the same options always produce
+    the same rows. bulk_create() does not send signals, the denormalized
+    counters are computed while generating and written with the rows.
+"""
+
+import bisect
+import hashlib
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from auth_app.models import Profile
+from magazine.models import Magazine, Subscription
+from threads.models import Thread, Comment, CommentReply, Vote, Boost, PeriodScore, get_path_step
+from threads.ranking import get_period_scores, hot_score
+from threads.response_cache import GLOBAL_SCOPE, bump_versions, magazine_scope
+
+WORDS = (
+    "python django kbin thread magazine open source linux rust web api "
+    "database index cache query server client privacy federation music "
+    "games science books movies news sports art photo travel food"
+).split()
+
+
+def zipf_weights(count, skew, rng):
+    """
+    Popularity weights 1/rank^skew, the ranks shuffled so the popular
+    objects are not the first ids
+    """
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    return [1 / rank**skew for rank in ranks]
+
+
+def skewed_counts(weights, mean, rng, cap=None):
+    """
+    Split mean * len(weights) items proportionally to the weights
+
+    The fractions are rounded randomly so the total stays close to the mean.
+    """
+    total = sum(weights)
+    counts = []
+    for weight in weights:
+        expected = mean * len(weights) * weight / total
+        count = int(expected) + (rng.random() < expected % 1)
+        counts.append(min(count, cap) if cap is not None else count)
+    return counts
+
+
+def geometric(mean, rng):
+    """
+    Random count with the given mean and a long tail
+    """
+    if mean <= 0:
+        return 0
+    success = 1 / (mean + 1)
+    count = 0
+    while rng.random() >= success:
+        count += 1
+    return count
+
+
+def weighted_sample(cum_weights, k, rng):
+    """
+    k distinct indexes chosen by the cumulative weights
+    """
+    k = min(k, len(cum_weights))
+    chosen = set()
+    while len(chosen) < k:
+        chosen.add(bisect.bisect(cum_weights, rng.random() * cum_weights[-1]))
+    return sorted(chosen)
+
+
+def random_text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    """
+    Let bulk_create() write the created_at/updated_at set on the objects
+
+    auto_now and auto_now_add would replace them with the current time.
+    """
+    fields = [
+        field
+        for model in models
+        for field in model._meta.concrete_fields
+        if getattr(field, "auto_now", False) or getattr(field, "auto_now_add", False)
+    ]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    try:
+        for field in fields:
+            field.auto_now = field.auto_now_add = False
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+class Command(BaseCommand):
+    """
+    Insert a deterministic synthetic dataset in the database
+    """
+
+    help = (
+        "Insert a large synthetic dataset: the same --seed and options "
+        "always generate the same rows (the dates are relative to now)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--magazines", type=int, default=50)
+        parser.add_argument("--threads", type=int, default=10000)
+        parser.add_argument(
+            "--comments", type=float, default=10, help="Comments per thread (mean)"
+        )
+        parser.add_argument(
+            "--replies", type=float, default=2, help="Replies per comment (mean)"
+        )
+        parser.add_argument(
+            "--max-depth", type=int, default=8, help="Deepest reply_level"
+        )
+        parser.add_argument(
+            "--thread-votes", type=float, default=20, help="Votes per thread (mean)"
+        )
+        parser.add_argument(
+            "--comment-votes",
+            type=float,
+            default=1,
+            help="Votes per comment or reply (mean)",
+        )
+        parser.add_argument(
+            "--boosts", type=float, default=2, help="Boosts per thread (mean)"
+        )
+        parser.add_argument(
+            "--subscriptions",
+            type=float,
+            default=5,
+            help="Subscriptions per user (mean)",
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.1,
+            help="Zipf exponent of the thread and magazine popularity",
+        )
+        parser.add_argument("--like-ratio", type=float, default=0.8)
+        parser.add_argument(
+            "--days", type=int, default=365, help="Age of the oldest thread"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--prefix", default="seed", help="Prefix of the user and magazine names"
+        )
+        parser.add_argument(
+            "--password", default="password", help="Password of every user"
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["magazines"] < 1:
+            raise CommandError("At least one user and one magazine are needed.")
+        prefix = options["prefix"]
+        if (
+            User.objects.filter(username__startswith=prefix).exists()
+            or Magazine.objects.filter(name__startswith=prefix).exists()
+        ):
+            raise CommandError(
+                f"There is already seeded data with the prefix '{prefix}', "
+                "use another --prefix."
+            )
+
+        self.options = options
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        self.inserted = {}
+        started = time.monotonic()
+
+        with transaction.atomic(), explicit_timestamps(Thread, Comment):
+            self.create_users()
+            self.create_magazines()
+            self.create_threads()
+            # bulk_create sends no signals
+            bump_versions(GLOBAL_SCOPE, *map(magazine_scope, self.magazine_ids))
+
+        elapsed = time.monotonic() - started
+        for model, count in self.inserted.items():
+            self.stdout.write(f"{model.__name__:<15}{count:>12}")
+        self.stdout.write(
+            self.style.SUCCESS(  # pylint: disable=no-member
+                f"{sum(self.inserted.values())} rows inserted in {elapsed:.1f}s."
+            )
+        )
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+        self.inserted[model] = self.inserted.get(model, 0) + len(objects)
+
+    def create_users(self):
+        # Hashing is slow on purpose, every user shares the same hash
+        password = make_password(self.options["password"])
+        first_id = next_id(User)
+        self.user_ids = list(range(first_id, first_id + self.options["users"]))
+        for start in range(0, len(self.user_ids), self.batch_size):
+            chunk = self.user_ids[start:start + self.batch_size]
+            # bulk_create() skips the post_save signal that creates the profile
+            self.bulk_create(
+                User,
+                [
+                    User(
+                        id=user_id,
+                        username=f"{self.options['prefix']}{user_id}",
+                        email=f"{self.options['prefix']}{user_id}@example.com",
+                        password=password,
+                    )
+                    for user_id in chunk
+                ],
+            )
+            self.bulk_create(Profile, [Profile(user_id=user_id) for user_id in chunk])
+            self.bulk_create(
+                Token,
+                [
+                    Token(key=self.token_key(user_id), user_id=user_id)
+                    for user_id in chunk
+                ],
+            )
+
+    def token_key(self, user_id):
+        """
+        API token of a seeded user, derived from the seed and the username so
+        the load tests can compute it (never use seeded data in production)
+        """
+        username = f"{self.options['prefix']}{user_id}"
+        return hashlib.sha1(f"{self.options['seed']}:{username}".encode()).hexdigest()
+
+    def create_magazines(self):
+        rng = self.rng
+        first_id = next_id(Magazine)
+        self.magazine_ids = list(
+            range(first_id, first_id + self.options["magazines"])
+        )
+        weights = zipf_weights(len(self.magazine_ids), self.options["skew"], rng)
+        self.magazine_cum_weights = list(itertools.accumulate(weights))
+
+        subscriptions = [
+            Subscription(user_id=user_id, magazine_id=self.magazine_ids[index])
+            for user_id in self.user_ids
+            for index in weighted_sample(
+                self.magazine_cum_weights,
+                geometric(self.options["subscriptions"], rng),
+                rng,
+            )
+        ]
+        # Magazine of every thread, known upfront for threads_count
+        self.thread_magazines = rng.choices(
+            self.magazine_ids,
+            cum_weights=self.magazine_cum_weights,
+            k=self.options["threads"],
+        )
+        subscriptions_count = {magazine_id: 0 for magazine_id in self.magazine_ids}
+        for subscription in subscriptions:
+            subscriptions_count[subscription.magazine_id] += 1
+        threads_count = {magazine_id: 0 for magazine_id in self.magazine_ids}
+        for magazine_id in self.thread_magazines:
+            threads_count[magazine_id] += 1
+        # Filled in by the threads
+        self.comments_count = {magazine_id: 0 for magazine_id in self.magazine_ids}
+
+        self.bulk_create(
+            Magazine,
+            [
+                Magazine(
+                    id=magazine_id,
+                    name=f"{self.options['prefix']}{magazine_id}",
+                    title=random_text(rng, 3).title(),
+                    description=random_text(rng, 20),
+                    rules=random_text(rng, 10),
+                    author_id=rng.choice(self.user_ids),
+                    subscriptions_count=subscriptions_count[magazine_id],
+                    threads_count=threads_count[magazine_id],
+                )
+                for magazine_id in self.magazine_ids
+            ],
+        )
+        self.bulk_create(Subscription, subscriptions)
+
+    def create_threads(self):
+        rng = self.rng
+        options = self.options
+        count = options["threads"]
+        weights = zipf_weights(count, options["skew"], rng)
+        users = len(self.user_ids)
+        # A user votes or boosts a thread once
+        plan = list(
+            zip(
+                skewed_counts(weights, options["comments"], rng),
+                skewed_counts(weights, options["thread_votes"], rng, cap=users),
+                skewed_counts(weights, options["boosts"], rng, cap=users),
+            )
+        )
+        # The replies take their ids from the comments table
+        self.ids = {model: next_id(model) for model in (Thread, Comment)}
+        first_id = self.ids[Thread]
+
+        for start in range(0, count, self.batch_size):
+            self.rows = {
+                model: []
+                for model in (Thread, PeriodScore, Comment, CommentReply, Vote, Boost)
+            }
+            for index in range(start, min(start + self.batch_size, count)):
+                self.add_thread(first_id + index, index, *plan[index])
+            # Parents first
+            for model, objects in self.rows.items():
+                self.bulk_create(model, objects)
+            self.stdout.write(f"{min(start + self.batch_size, count)}/{count} threads")
+
+        for magazine_id, comments_count in self.comments_count.items():
+            Magazine.objects.filter(pk=magazine_id).update(  # pylint: disable=no-member
+                comments_count=comments_count
+            )
+
+    def add_thread(self, thread_id, index, comments, votes, boosts):
+        rng = self.rng
+        magazine_id = self.thread_magazines[index]
+        # Newest ids are the newest threads
+        age = self.options["days"] * (1 - index / max(self.options["threads"], 1))
+        created_at = self.now - timedelta(days=age, seconds=rng.randrange(3600))
+        is_link = rng.random() < 0.3
+        thread = Thread(
+            id=thread_id,
+            title=random_text(rng, rng.randint(3, 10)).capitalize(),
+            body="" if is_link else random_text(rng, rng.randint(10, 80)),
+            url=f"https://example.com/{thread_id}" if is_link else None,
+            is_link=is_link,
+            author_id=rng.choice(self.user_ids),
+            magazine_id=magazine_id,
+            created_at=created_at,
+            updated_at=created_at,
+        )
+        self.add_votes(thread, "thread", votes)
+        thread.num_points = boosts
+        self.rows[Boost].extend(
+            Boost(user_id=self.user_ids[user_index], thread_id=thread_id)
+            for user_index in rng.sample(range(len(self.user_ids)), boosts)
+        )
+
+        for _ in range(comments):
+            thread.num_comments += 1 + self.add_comment(thread)
+        self.comments_count[magazine_id] += thread.num_comments
+        thread.hot_score = hot_score(
+            thread.num_likes, thread.num_dislikes, thread.num_points, thread.num_comments, created_at
+        )
+        self.rows[Thread].append(thread)
+        self.rows[PeriodScore].extend(get_period_scores(thread, self.now))
+
+    def add_comment(self, thread):
+        """
+        Add a comment and its replies, returns the number of replies
+        """
+        rng = self.rng
+        comment_id = self.take_id(Comment)
+        comment = Comment(
+            id=comment_id,
+            path=get_path_step(comment_id),
+            thread_id=thread.id,
+            author_id=rng.choice(self.user_ids),
+            body=random_text(rng, rng.randint(3, 40)),
+            created_at=self.created_after(thread.created_at),
+        )
+        comment.updated_at = comment.created_at
+        self.add_votes(comment, "comment", geometric(self.options["comment_votes"], rng))
+        self.rows[Comment].append(comment)
+
+        replies = []
+        for _ in range(geometric(self.options["replies"], rng)):
+            # Mostly answer the last reply: long chains
+            parent = rng.choice(replies) if replies else None
+            if replies and rng.random() < 0.7:
+                parent = replies[-1]
+            if parent is not None and parent.depth >= self.options["max_depth"]:
+                parent = None
+            reply_id = self.take_id(Comment)
+            reply = CommentReply(
+                id=reply_id,
+                path=(parent or comment).path + get_path_step(reply_id),
+                thread_id=thread.id,
+                parent_comment_id=comment.id,
+                parent_id=parent.id if parent is not None else comment.id,
+                depth=parent.depth + 1 if parent is not None else 1,
+                author_id=rng.choice(self.user_ids),
+                body=random_text(rng, rng.randint(3, 40)),
+                created_at=self.created_after(
+                    parent.created_at if parent is not None else comment.created_at
+                ),
+            )
+            reply.updated_at = reply.created_at
+            self.add_votes(reply, "comment", geometric(self.options["comment_votes"], rng))
+            replies.append(reply)
+        self.rows[CommentReply].extend(replies)
+        return len(replies)
+
+    def add_votes(self, target, field, count):
+        rng = self.rng
+        count = min(count, len(self.user_ids))
+        for user_index in rng.sample(range(len(self.user_ids)), count):
+            vote_type = "like" if rng.random() < self.options["like_ratio"] else "dislike"
+            if vote_type == "like":
+                target.num_likes += 1
+            else:
+                target.num_dislikes += 1
+            self.rows[Vote].append(
+                Vote(
+                    user_id=self.user_ids[user_index],
+                    vote_type=vote_type,
+                    **{f"{field}_id": target.id},
+                )
+            )
+
+    def take_id(self, model):
+        self.ids[model] += 1
+        return self.ids[model] - 1
+
+    def created_after(self, moment):
+        # Between the moment and now, mostly soon after
+        span = max((self.now - moment).total_seconds(), 1)
+        return moment + timedelta(seconds=span * self.rng.random() ** 4)
@@ -0,0 +1,106 @@
+"""
+    This module is a script to summarize the slow query log
+"""
+
+import json
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from webPage.slow_queries import read_entries
+
+SORT_KEYS = ("total", "count", "max", "p95")
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    """
+    Group the slow queries by fingerprint, the most expensive first
+    """
+
+    help = "Summarize the slow query log (SLOW_QUERY_LOG_FILE and its rotated files)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", help="Log file, SLOW_QUERY_LOG_FILE by default")
+        parser.add_argument(
+            "--hours", type=float, help="Only the queries of the last hours"
+        )
+        parser.add_argument("--top", type=int, default=10)
+        parser.add_argument("--sort", choices=SORT_KEYS, default="total")
+        parser.add_argument(
+            "--json", action="store_true", help="Print the summary as JSON"
+        )
+
+    def handle(self, *args, **options):
+        path = options["file"] or getattr(settings, "SLOW_QUERY_LOG_FILE", None)
+        if not path:
+            raise CommandError("The slow query log is disabled, use --file.")
+        since = None
+        if options["hours"] is not None:
+            since = timezone.now() - timedelta(hours=options["hours"])
+
+        groups = defaultdict(list)
+        for entry in read_entries(path):
+            if since is not None and datetime.fromisoformat(entry["time"]) < since:
+                continue
+            groups[entry["fingerprint"]].append(entry)
+
+        summary = []
+        for key, entries in groups.items():
+            durations = [entry["duration_ms"] for entry in entries]
+            # The latest entry has the current plan
+            latest = max(entries, key=lambda entry: entry["time"])
+            summary.append(
+                {
+                    "fingerprint": key,
+                    "count": len(entries),
+                    "total": round(sum(durations), 2),
+                    "mean": round(sum(durations) / len(durations), 2),
+                    "p95": percentile(durations, 95),
+                    "max": max(durations),
+                    "views": dict(Counter(entry["view"] for entry in entries).most_common(5)),
+                    "call_sites": dict(
+                        Counter(entry["call_site"] for entry in entries).most_common(3)
+                    ),
+                    "sql": latest["sql"],
+                    "params": latest["params"],
+                    "plan": latest["plan"],
+                    "last_seen": latest["time"],
+                }
+            )
+        summary.sort(key=lambda group: group[options["sort"]], reverse=True)
+        summary = summary[: options["top"]]
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+        if not summary:
+            self.stdout.write("No slow queries logged.")
+            return
+        for group in summary:
+            self.stdout.write(
+                self.style.WARNING(  # pylint: disable=no-member
+                    f"{group['fingerprint']}  {group['count']} queries, "
+                    f"total {group['total']} ms, mean {group['mean']} ms, "
+                    f"p95 {group['p95']} ms, max {group['max']} ms"
+                )
+            )
+            self.stdout.write(f"  views: {self.format_counts(group['views'])}")
+            self.stdout.write(f"  from: {self.format_counts(group['call_sites'])}")
+            self.stdout.write(f"  sql: {group['sql']}")
+            if group["params"]:
+                self.stdout.write(f"  params: {group['params']}")
+            for line in group["plan"] or []:
+                self.stdout.write(f"  plan: {line}")
+            self.stdout.write("")
+
+    @staticmethod
+    def format_counts(counts):
+        return ", ".join(f"{name} ({count})" for name, count in counts.items())
@@ -0,0 +1,156 @@
+"""
+    This module is a script to create the columns, indexes and constraints of
+    the models on an existing database, and to check the plans of the hot
+    queries
+"""
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, router
+from django.db.migrations.state import ProjectState
+
+from threads.query_plans import explain, find_plan_problems, get_hot_queries
+from threads.search import create_search_index, find_missing_search_triggers
+
+
+class Command(BaseCommand):
+    """
+    The apps have no migrations: ``migrate --run-syncdb`` creates the columns,
+    Meta indexes and constraints with new tables only, this command adds the
+    ones an existing table is missing, and the triggers of the search index
+    (threads.search) a rebuild of threads_thread dropped
+    """
+
+    help = "Create the missing columns, Meta indexes and constraints and check the query plans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--database", default=DEFAULT_DB_ALIAS)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list what is missing"
+        )
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            help="Fail if a hot query reads a whole table or sorts in a temporary B-tree",
+        )
+
+    def handle(self, *args, **options):
+        using = options["database"]
+        connection = connections[using]
+        missing = self.find_missing(connection)
+        triggers = find_missing_search_triggers(using)
+        if options["dry_run"]:
+            for model, kind, item in missing:
+                self.stdout.write(f"Missing {kind} {item.name} on {model._meta.db_table}")
+            for name in triggers:
+                self.stdout.write(f"Missing trigger {name} on threads_thread")
+        else:
+            columns = [(model, kind, item) for model, kind, item in missing if kind == "column"]
+            self.create(connection, columns)
+            # Adding a column may rebuild the table and its indexes (SQLite)
+            self.create(connection, self.find_missing(connection) if columns else missing)
+            # The rebuild drops the triggers of the search index too
+            self.create_search_triggers(using)
+        if not missing and not triggers:
+            self.stdout.write("The schema is up to date.")
+
+        if options["check"]:
+            self.check_plans(using)
+
+    def create(self, connection, missing):
+        for model, kind, item in missing:
+            self.stdout.write(f"Creating {kind} {item.name} on {model._meta.db_table}")
+            if kind == "column":
+                model = self.get_table_model(connection, model, item)
+                item = model._meta.get_field(item.name)  # pylint: disable=protected-access
+            with connection.schema_editor() as editor:
+                {
+                    "column": editor.add_field,
+                    "index": editor.add_index,
+                    "constraint": editor.add_constraint,
+                }[kind](model, item)
+
+    def create_search_triggers(self, using):
+        triggers = find_missing_search_triggers(using)
+        if triggers:
+            self.stdout.write(f"Creating triggers {', '.join(triggers)} on threads_thread")
+            create_search_index(using)
+
+    def get_table_model(self, connection, model, field):
+        """
+        Return a version of the model with the columns its table has, plus the
+        field
+
+        SQLite adds some columns by rebuilding the table, and copies the rows
+        to the columns of the model: the other missing columns would be read
+        from the old table. Its indexes and constraints are left to the next
+        pass.
+        """
+        with connection.cursor() as cursor:
+            columns = {
+                column.name
+                for column in connection.introspection.get_table_description(
+                    cursor, model._meta.db_table  # pylint: disable=protected-access
+                )
+            }
+        missing = {
+            other.name
+            for other in model._meta.local_concrete_fields  # pylint: disable=protected-access
+            if other.column not in columns and other.name != field.name
+        }
+        state = ProjectState.from_apps(apps)
+        model_state = state.models[model._meta.app_label, model._meta.model_name]  # pylint: disable=protected-access
+        model_state.fields = {
+            name: other for name, other in model_state.fields.items() if name not in missing
+        }
+        model_state.options = {**model_state.options, "indexes": [], "constraints": []}
+        return state.apps.get_model(model._meta.label)  # pylint: disable=protected-access
+
+    def find_missing(self, connection):
+        """
+        Return the (model, kind, field, index or constraint) triples missing from
+        the database, the columns first
+        """
+        missing = []
+        with connection.cursor() as cursor:
+            tables = set(connection.introspection.table_names(cursor))
+            for model in apps.get_models():
+                meta = model._meta  # pylint: disable=protected-access
+                if (
+                    not meta.managed
+                    or meta.proxy
+                    or meta.db_table not in tables
+                    or not router.allow_migrate_model(connection.alias, model)
+                ):
+                    continue
+                columns = {
+                    column.name
+                    for column in connection.introspection.get_table_description(cursor, meta.db_table)
+                }
+                existing = connection.introspection.get_constraints(cursor, meta.db_table)
+                missing += [
+                    (model, "column", field)
+                    for field in meta.local_concrete_fields
+                    if field.column not in columns
+                ]
+                missing += [(model, "index", index) for index in meta.indexes if index.name not in existing]
+                missing += [
+                    (model, "constraint", constraint)
+                    for constraint in meta.constraints
+                    if constraint.name not in existing
+                ]
+        return missing
+
+    def check_plans(self, using):
+        failed = []
+        for name, queryset in get_hot_queries(using):
+            plan = explain(queryset)
+            problems = find_plan_problems(plan)
+            style = self.style.ERROR if problems else self.style.SUCCESS  # pylint: disable=no-member
+            self.stdout.write(style(f"{'FAIL' if problems else 'ok'}  {name}"))
+            for line in plan:
+                self.stdout.write(f"      {line}")
+            if problems:
+                failed.append(name)
+        if failed:
+            raise CommandError(f"{len(failed)} queries without an index: {', '.join(failed)}")
@@ -2,7 +2,7 @@
     This module contains the models for the Threads app
 """
 
-from django.db import models
+from django.db import models, router, transaction
 from django.utils import timezone
 from django.utils.timesince import timesince
 from magazine.models import Magazine
@@ -44,10 +44,35 @@ class Thread(models.Model):
     num_dislikes = models.IntegerField(default=0)
     num_points = models.IntegerField(default=0)
     num_comments = models.IntegerField(default=0)
+    # "hot" order, maintained by threads.ranking
+    hot_score = models.FloatField(default=0)
+
+    class Meta:
+        # Orderings of the thread lists (front page, magazines, profiles),
+        # checked with EXPLAIN by manage.py sync_schema --check
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="thread_created_idx"),
+            models.Index(fields=["-num_points", "-id"], name="thread_points_idx"),
+            models.Index(fields=["-num_comments", "-id"], name="thread_comments_idx"),
+            models.Index(fields=["-hot_score", "-id"], name="thread_hot_idx"),
+            models.Index(fields=["magazine", "-created_at"], name="thread_magazine_created_idx"),
+            models.Index(fields=["magazine", "-num_points"], name="thread_magazine_points_idx"),
+            models.Index(fields=["magazine", "-num_comments"], name="thread_magazine_comments_idx"),
+            models.Index(fields=["magazine", "-hot_score"], name="thread_magazine_hot_idx"),
+            models.Index(fields=["author", "-created_at"], name="thread_author_created_idx"),
+        ]
 
     def __str__(self):
         return str(self.title)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Magazine stored in the database, to detect moves in the signals
+        if "magazine_id" in instance.__dict__:
+            instance._loaded_magazine_id = instance.magazine_id
+        return instance
+
     @property
     def time_since_creation(self):
         """
@@ -83,84 +108,137 @@ class Thread(models.Model):
         return " ".join(time_parts)
 
 
+class SearchDocumentField(models.TextField):
+    """
+    Hidden column of an FTS5 table, the one full-text queries MATCH against
+    """
 
-#### Comment ####
 
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+    """
+    document__match="fts5 query"
+    """
 
-class Comment(models.Model):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class ThreadSearchIndex(models.Model):
     """
-    Comment Model
+    FTS5 full-text index of the title and body of the threads (SQLite only)
+
+    Not managed by Django: the table and the triggers that keep it in sync
+    are created by threads.search after migrate.
     """
-    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="comments")
-    author = models.ForeignKey(
-        User,
-        on_delete=models.CASCADE,
-        null=True,  # Temporary it lets null
-    )
-    body = models.TextField(max_length=5000)
-    # If delete the magazine, automatically delete the thread
-    magazine = models.ForeignKey(
-        Magazine,
-        on_delete=models.CASCADE,
-        null=True,  # Temporary it lets null
+
+    thread = models.OneToOneField(
+        Thread,
+        on_delete=models.DO_NOTHING,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search_index",
     )
+    title = models.TextField()
+    body = models.TextField()
+    document = SearchDocumentField(db_column="threads_thread_fts")
 
-    # Update only once at creation
-    created_at = models.DateTimeField(auto_now_add=True)
-    # Update after each save
-    updated_at = models.DateTimeField(auto_now=True)
-    # To manage the type of thread in HTML
-    num_likes = models.IntegerField(default=0)
-    num_dislikes = models.IntegerField(default=0)
-    num_replies = models.IntegerField(default=0)
+    class Meta:
+        managed = False
+        db_table = "threads_thread_fts"
 
-    def __str__(self):
-        return str(self.body)
 
-    @property
-    def time_since_creation(self):
+
+#### Comment ####
+
+# Digits of an id in the path of a comment
+PATH_STEP = 10
+# Sorts after every digit: the paths that start with P are in [P, P + PATH_END)
+PATH_END = "~"
+
+
+def get_path_step(comment_id):
+    return str(comment_id).zfill(PATH_STEP)
+
+
+class CommentQuerySet(models.QuerySet):
+    """
+    Comments and replies share the table, the comments of a thread are the
+    rows without a parent (depth 0)
+    """
+
+    def top_level(self):
+        return self.filter(depth=0)
+
+    def replies(self):
+        return self.filter(depth__gt=0)
+
+    def with_reply_id(self, reply_id):
         """
-        Return the time since the comment was created as a model attribute
+        Filter by the id of a reply, or by the id it had in the replies table
+        before manage.py merge_comment_replies
         """
-        # Time since the comment was created
-        time_since = timesince(self.created_at, timezone.now())
-        # If "4 hours, 30 minutes" -> ["4", "hours,"]
-        time_parts = time_since.split()[:2]
+        return self.filter(models.Q(id=reply_id) | models.Q(legacy_reply_id=reply_id))
 
-        # If last character of the second word is ",", remove it
-        if len(time_parts) > 1 and time_parts[1][-1] == ",":
-            time_parts[1] = time_parts[1][:-1]  # Last character excluded
+    def subtree(self, comment):
+        """
+        The comment and its replies at every level, a range of the path index
+        """
+        return self.filter(
+            thread_id=comment.thread_id, path__gte=comment.path, path__lt=comment.path + PATH_END
+        )
 
-        # ["4", "hours,"] -> "4 hours"
-        return " ".join(time_parts)
-    
-    @property
-    def time_since_update(self):
+    def ancestors(self, comment):
         """
-        Return the time since the comment was updated as a model attribute
+        The comment at the root of the tree and the replies down to the
+        comment, without it: the prefixes of its path
         """
-        # Time since the comment was created
-        time_since = timesince(self.updated_at, timezone.now())
-        # If "4 hours, 30 minutes" -> ["4", "hours,"]
-        time_parts = time_since.split()[:2]
+        prefixes = [comment.path[:end] for end in range(PATH_STEP, len(comment.path), PATH_STEP)]
+        return self.filter(thread_id=comment.thread_id, path__in=prefixes)
 
-        # If last character of the second word is ",", remove it
-        if len(time_parts) > 1 and time_parts[1][-1] == ",":
-            time_parts[1] = time_parts[1][:-1]  # Last character excluded
 
-        # ["4", "hours,"] -> "4 hours"
-        return " ".join(time_parts)
-    
-class CommentReply(models.Model):
+class Comment(models.Model):
+    """
+    Comment Model
 
+    Every node of the comment trees: the comments of a thread (depth 0) and
+    their replies, at any level. A reply points to the node it answers
+    (parent) and to the comment at the root of its tree (parent_comment).
+
+    The path is the materialized path of the node: the zero-padded ids of
+    its ancestors and its own, from the root. Ordered by path, the nodes of
+    a thread come in display order (every reply after the node it answers,
+    the siblings oldest first), and a subtree or the ancestors of a node
+    are a range or a list of keys of the (thread, path) index.
+    """
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="comments")
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         null=True,  # Temporary it lets null
     )
-    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="thread_replies")
-    parent_comment = models.ForeignKey(Comment, on_delete=models.CASCADE, related_name="comment_replies")
-    parent_reply = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name="reply_replies")
+    # Null for the comments of the thread, indexed with the path, see Meta
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="children",
+        db_index=False,
+    )
+    # Indexed with the path, see Meta
+    parent_comment = models.ForeignKey(
+        "self",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="comment_replies",
+        db_index=False,
+    )
     body = models.TextField(max_length=5000)
     # If delete the magazine, automatically delete the thread
     magazine = models.ForeignKey(
@@ -168,6 +246,8 @@ class CommentReply(models.Model):
         on_delete=models.CASCADE,
         null=True,  # Temporary it lets null
     )
+
+    # Update only once at creation
     created_at = models.DateTimeField(auto_now_add=True)
     # Update after each save
     updated_at = models.DateTimeField(auto_now=True)
@@ -176,12 +256,84 @@ class CommentReply(models.Model):
     num_dislikes = models.IntegerField(default=0)
     num_replies = models.IntegerField(default=0)
 
-    reply_level = models.PositiveIntegerField(default=1)
-
+    # 0 for a comment, the reply_level of the replies
+    depth = models.PositiveIntegerField(default=0)
+    # Id of a reply in the old replies table (manage.py merge_comment_replies)
+    legacy_reply_id = models.PositiveIntegerField(null=True, blank=True, unique=True)
+    # Written after the insert, it ends with the id
+    path = models.TextField(blank=True, default="")
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Comments of a thread, oldest/newest and by likes (HTML)
+            models.Index(fields=["thread", "depth", "created_at"], name="comment_thread_depth_idx"),
+            # Ascending: read backwards it is also in the order of the id,
+            # the tie-breaker of the pages (threads.comment_pages)
+            models.Index(
+                fields=["thread", "depth", "num_likes", "created_at"],
+                name="comment_thread_likes_idx",
+            ),
+            # The trees of a thread in display order, subtrees and ancestors
+            models.Index(fields=["thread", "path"], name="comment_thread_path_idx"),
+            # The replies of a comment in display order
+            models.Index(fields=["parent_comment", "path"], name="comment_root_path_idx"),
+            # The replies of a node in display order (threads.comment_pages)
+            models.Index(fields=["parent", "path"], name="comment_parent_path_idx"),
+            # Comments and replies of a profile, by creation and by likes (threads.activity)
+            models.Index(fields=["author", "created_at"], name="comment_author_created_idx"),
+            models.Index(fields=["author", "num_likes", "created_at"], name="comment_author_likes_idx"),
+        ]
 
     def __str__(self):
         return str(self.body)
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            super().save(*args, **kwargs)
+            return
+        if self.parent_id is None:
+            # A reply to the comment itself
+            self.parent = self.parent_comment
+            self.depth = 1 if self.parent_id is not None else 0
+        else:
+            if self.parent_comment_id is None:
+                self.parent_comment_id = self.parent.parent_comment_id or self.parent_id
+            if not self.depth:
+                self.depth = self.parent.depth + 1
+        using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+        # Like the parents of a multi-table model, no savepoint of its own
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+            self.path = (self.parent.path if self.parent_id else "") + get_path_step(self.pk)
+            Comment.objects.using(using).filter(pk=self.pk).update(path=self.path)
+
+    # Names of the replies table, the API and the templates still use them
+
+    @property
+    def reply_level(self):
+        return self.depth
+
+    @reply_level.setter
+    def reply_level(self, value):
+        self.depth = value
+
+    @property
+    def parent_reply_id(self):
+        return self.parent_id if self.depth > 1 else None
+
+    @property
+    def parent_reply(self):
+        """
+        The reply this reply answers, None for the replies of the comment
+        """
+        return self.parent if self.depth > 1 else None
+
+    @parent_reply.setter
+    def parent_reply(self, reply):
+        self.parent = reply
+
     @property
     def time_since_creation(self):
         """
@@ -215,6 +367,22 @@ class CommentReply(models.Model):
 
         # ["4", "hours,"] -> "4 hours"
         return " ".join(time_parts)
+
+
+class CommentReplyManager(models.Manager.from_queryset(CommentQuerySet)):
+    def get_queryset(self):
+        return super().get_queryset().replies()
+
+
+class CommentReply(Comment):
+    """
+    The replies: the comments with a parent
+    """
+
+    objects = CommentReplyManager()
+
+    class Meta:
+        proxy = True
  
 
 """
@@ -228,13 +396,32 @@ class Vote(models.Model):
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     thread = models.ForeignKey(Thread, on_delete=models.CASCADE, null=True)
+    # A comment or a reply
     comment = models.ForeignKey(Comment, on_delete=models.CASCADE, null=True, blank=True)
-    reply = models.ForeignKey(CommentReply, on_delete=models.CASCADE, null=True, blank=True)
 
     vote_type = models.CharField(
         max_length=10, choices=[("like", "like"), ("dislike", "dislike")]
     )
 
+    class Meta:
+        # The votes of a user on a page of threads, without reading the rows
+        indexes = [
+            models.Index(fields=["user", "thread", "vote_type"], name="vote_user_thread_type_idx"),
+        ]
+        # One vote per user and voted object, the vote service relies on it
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "thread"],
+                condition=models.Q(thread__isnull=False),
+                name="unique_vote_user_thread",
+            ),
+            models.UniqueConstraint(
+                fields=["user", "comment"],
+                condition=models.Q(comment__isnull=False),
+                name="unique_vote_user_comment",
+            ),
+        ]
+
 
 class Boost(models.Model):
     """
@@ -242,4 +429,74 @@ class Boost(models.Model):
     """
 
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
\ No newline at end of file
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "thread"], name="unique_boost_user_thread"
+            ),
+        ]
+
+
+class PeriodScore(models.Model):
+    """
+    Score of a thread in a "top of the period" ranking (threads.ranking)
+
+    One row per period the thread was created in, copies of the magazine
+    and creation time of the thread let the ranking of a period (and of a
+    magazine in it) be read from an index without joining the threads.
+    """
+
+    PERIODS = [("day", "day"), ("week", "week"), ("month", "month"), ("all", "all")]
+
+    period = models.CharField(max_length=5, choices=PERIODS)
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="period_scores")
+    magazine = models.ForeignKey(Magazine, on_delete=models.CASCADE, null=True, related_name="+")
+    created_at = models.DateTimeField()
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["period", "-score", "-thread"], name="period_score_idx"),
+            models.Index(
+                fields=["period", "magazine", "-score", "-thread"], name="period_magazine_score_idx"
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["thread", "period"], name="unique_period_score"),
+        ]
+
+
+class Feed(models.Model):
+    """
+    Materialized subscribed feed of a user (threads.feed)
+
+    It has every thread of the subscribed magazines from its horizon, the
+    (created_at, id) position of the oldest one, on: every thread when null.
+    """
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="feed")
+    horizon_created_at = models.DateTimeField(null=True)
+    horizon_thread_id = models.IntegerField(null=True)
+
+
+class FeedEntry(models.Model):
+    """
+    A thread in the materialized feed of a user
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name="feed_entries")
+    # Copies of the thread: the magazine for unsubscribing, the time for the order
+    magazine = models.ForeignKey(Magazine, on_delete=models.CASCADE, null=True, related_name="+")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-thread"], name="feed_user_created_idx"),
+            models.Index(fields=["user", "magazine"], name="feed_user_magazine_idx"),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=["user", "thread"], name="unique_feed_entry"),
+        ]
@@ -0,0 +1,256 @@
+"""
+    This module contains the keyset (cursor) pagination for the Threads app
+
+    A page is located by the position of its boundary row, i.e. the value of
+    the ordering column plus the primary key as a unique tie-breaker, so any
+    page costs the same index range scan as the first one (no OFFSET).
+"""
+
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+# Largest value of an INTEGER column, a larger one can not be bound to a query
+MAX_INTEGER = 2**63 - 1
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a cursor can not be decoded
+    """
+
+
+def encode_cursor(value, pk, reverse=False):
+    """
+    Return an opaque cursor for the position (value, pk)
+    """
+    if hasattr(value, "isoformat"):
+        value = value.isoformat()
+    payload = json.dumps({"v": value, "pk": pk, "r": bool(reverse)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Return the (value, pk, reverse) tuple stored in a cursor
+
+    The pk must be an integer in the range of the columns and reverse a
+    boolean; the value is checked by decode_cursor_value().
+    """
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        value, pk, reverse = payload["v"], payload["pk"], payload["r"]
+    except (binascii.Error, ValueError, TypeError, KeyError, OverflowError) as error:
+        raise InvalidCursor(cursor) from error
+    # bool is a subclass of int, it is not a pk
+    if type(pk) is not int or abs(pk) > MAX_INTEGER or not isinstance(reverse, bool):
+        raise InvalidCursor(cursor)
+    return value, pk, reverse
+
+
+def decode_cursor_value(model_field, value, cursor):
+    """
+    Return the value of a cursor converted to the field it orders by
+
+    Raises InvalidCursor for a null value or one that the field or the
+    database can not take, instead of failing in the query.
+    """
+    if value is None:
+        raise InvalidCursor(cursor)
+    try:
+        value = model_field.to_python(value)
+    except (ValidationError, TypeError, ValueError, OverflowError) as error:
+        raise InvalidCursor(cursor) from error
+    if value is None or (isinstance(value, int) and abs(value) > MAX_INTEGER):
+        raise InvalidCursor(cursor)
+    return value
+
+
+def get_keyset_ordering(queryset):
+    """
+    Return the (field, descending) pair of the first ordering term of a queryset
+    """
+    ordering = queryset.query.order_by or queryset.model._meta.ordering
+    term = ordering[0] if ordering else "-" + queryset.model._meta.pk.name
+    return term.lstrip("-"), term.startswith("-")
+
+
+def get_keyset_tiebreaker(queryset):
+    """
+    Return the unique column that breaks the ties of the ordering: "pk", or
+    the second ordering term when it is an annotation (a copy of the pk
+    read from the index of a joined table, see threads.ranking)
+    """
+    ordering = queryset.query.order_by
+    if len(ordering) > 1 and ordering[1].lstrip("-") in queryset.query.annotations:
+        return ordering[1].lstrip("-")
+    return "pk"
+
+
+class KeysetPage:
+    """
+    A page of results with the cursors of its neighbour pages
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def keyset_queryset(queryset, cursor=None):
+    """
+    Return the queryset of the rows after the cursor, in the order they are read
+
+    The queryset is ordered by its first ordering term plus the tie-breaker
+    in the same direction, which makes the order total even when the column
+    has ties.
+    """
+    field, descending = get_keyset_ordering(queryset)
+    tiebreaker = get_keyset_tiebreaker(queryset)
+    position = decode_cursor(cursor) if cursor else None
+    reverse = position[2] if position else False
+
+    # Walking backwards flips the direction of both the comparison and the order
+    scan_descending = descending != reverse
+    prefix = "-" if scan_descending else ""
+    queryset = queryset.order_by(f"{prefix}{field}", f"{prefix}{tiebreaker}")
+
+    if position:
+        annotation = queryset.query.annotations.get(field)
+        if annotation is not None:
+            model_field = annotation.output_field
+        else:
+            model_field = queryset.model._meta.get_field(field)
+        value = decode_cursor_value(model_field, position[0], cursor)
+        lookup = "lt" if scan_descending else "gt"
+        # The first condition alone is a range of the (field, pk) index, the
+        # database seeks to the cursor instead of walking the previous rows
+        queryset = queryset.filter(
+            Q(**{f"{field}__{lookup}e": value}),
+            Q(**{f"{field}__{lookup}": value})
+            | Q(**{field: value, f"{tiebreaker}__{lookup}": position[1]}),
+        )
+    return queryset
+
+
+def paginate_keyset(queryset, cursor=None, page_size=25):
+    """
+    Return the KeysetPage of an ordered queryset that starts after the cursor
+    """
+    field, _ = get_keyset_ordering(queryset)
+    position = decode_cursor(cursor) if cursor else None
+    reverse = position[2] if position else False
+    queryset = keyset_queryset(queryset, cursor)
+
+    rows = list(queryset[: page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    if not rows:
+        return KeysetPage(rows)
+
+    first, last = rows[0], rows[-1]
+    has_next = has_more if not reverse else True
+    has_previous = has_more if reverse else position is not None
+    return KeysetPage(
+        rows,
+        next_cursor=(
+            encode_cursor(getattr(last, field), last.pk) if has_next else None
+        ),
+        previous_cursor=(
+            encode_cursor(getattr(first, field), first.pk, reverse=True)
+            if has_previous
+            else None
+        ),
+    )
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    DRF pagination class on top of paginate_keyset
+
+    The view decides the ordering, the paginator only adds the tie-breaker.
+    """
+
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    page_size = 25
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        cursor = request.query_params.get(self.cursor_query_param)
+        try:
+            self.page = self.get_page(queryset, cursor, self.get_page_size(request))
+        except InvalidCursor:
+            raise NotFound(self.invalid_cursor_message)
+        return list(self.page)
+
+    def get_page(self, queryset, cursor, page_size):
+        return paginate_keyset(queryset, cursor=cursor, page_size=page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self.get_link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        return self.get_link(self.page.previous_cursor)
+
+    def get_paginated_response(self, data):
+        return Response(
+            {
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
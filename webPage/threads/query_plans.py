@@ -0,0 +1,179 @@
+"""
+    This module contains the hot queries of the lists and the check of their
+    query plans
+
+    Every query of the front page, magazine, profile, comment and vote paths
+    should walk or search an index: a full table scan or a temporary B-tree
+    for the ORDER BY grows with the table. ``manage.py sync_schema --check``
+    runs the check against a real database, the tests against an empty one.
+"""
+
+import re
+from datetime import datetime, timezone
+
+from django.db import connections
+from django.db.models import Exists, F, OuterRef
+
+from magazine.models import Subscription
+
+from .activity import UserActivity
+from .comment_pages import ThreadComments, get_level_queryset
+from .models import Thread, Comment, CommentReply, Vote, get_path_step
+from .pagination import encode_cursor, keyset_queryset
+from .ranking import PERIODS, order_by_period
+
+# "SCAN threads_thread" (every row) but not "SCAN ... USING INDEX ..."
+FULL_SCAN_RE = re.compile(r"^SCAN (\w+)(?: AS \w+)?$")
+TEMP_SORT = "USE TEMP B-TREE"
+# The rows of a subquery are read by a "SCAN <name>" of its co-routine
+SUBQUERY_RE = re.compile(r"^(?:CO-ROUTINE|MATERIALIZE) (\w+)$")
+
+# A reply of the third level, for the plans of the path queries
+SAMPLE_REPLY = Comment(
+    id=3, thread_id=1, depth=2, path=get_path_step(1) + get_path_step(2) + get_path_step(3)
+)
+
+THREAD_ORDERINGS = {
+    "created_at": "-created_at",
+    "points": "-num_points",
+    "num_comments": "-num_comments",
+    "hot": "-hot_score",
+}
+
+
+def get_hot_queries(using="default"):
+    """
+    Return the (name, queryset) pairs of the queries that must use an index
+
+    The ids do not need to exist, the plans do not depend on them.
+    """
+    threads = Thread.objects.using(using)
+    comments = Comment.objects.using(using)
+    replies = CommentReply.objects.using(using)
+    queries = []
+    for name, ordering in THREAD_ORDERINGS.items():
+        field = ordering.lstrip("-")
+        # ThreadsAPIView and ThreadListView, first page and after a cursor
+        front_page = threads.order_by(ordering, "-id")
+        queries.append((f"front page by {name}", front_page[:26]))
+        queries.append((f"front page by {name} (threads)", front_page.filter(url__isnull=True)[:26]))
+        queries.append(
+            (f"front page by {name}, next page", next_page_queryset(front_page, field))
+        )
+        # MagazineThreadsView and the magazine page
+        queries.append(
+            (f"magazine by {name}", threads.filter(magazine_id=1).order_by(ordering))
+        )
+        # perfil get_filtered_queryset: an author has few threads, only the
+        # created_at order has its own index
+        profile = threads.filter(author_id=1).order_by(ordering)
+        queries.append((f"profile by {name}", profile if name == "created_at" else None))
+
+    for period in PERIODS:
+        # period=... of the same views
+        top = order_by_period(threads, period)
+        queries.append((f"top of {period}", top[:26]))
+        queries.append((f"top of {period}, next page", next_page_queryset(top, "period_score")))
+        queries.append(
+            (f"magazine top of {period}", order_by_period(threads.filter(magazine_id=1), period, 1))
+        )
+
+    # filter=subscribed, from the feed entries and merged from the threads
+    feed_page = (
+        threads.filter(feed_entries__user_id=1)
+        .annotate(feed_created_at=F("feed_entries__created_at"), feed_thread=F("feed_entries__thread_id"))
+        .order_by("-feed_created_at", "-feed_thread")
+    )
+    queries.append(("subscribed feed", feed_page[:26]))
+    queries.append(("subscribed feed, next page", next_page_queryset(feed_page, "feed_created_at")))
+    for name, ordering in THREAD_ORDERINGS.items():
+        merged = threads.filter(
+            Exists(Subscription.objects.using(using).filter(user_id=1, magazine_id=OuterRef("magazine_id")))
+        ).order_by(ordering, "-id")
+        queries.append((f"subscribed merged by {name}", merged[:26]))
+
+    # The boundary row of a page of comments
+    row = {"created_at": datetime(2024, 1, 1, tzinfo=timezone.utc), "num_likes": 10, "id": 1}
+    for order_by in ("oldest", "newest", "likes"):
+        # perfil UserCommentsView and the comments tab, first page and after a cursor
+        activity = UserActivity(1, order_by)
+        queries.append((f"profile activity {order_by}", activity.rows().using(using)[:26]))
+        position, _ = activity.decode_cursor(activity.encode_cursor(row))
+        queries.append(
+            (f"profile activity {order_by}, next page", activity.rows(position).using(using)[:26])
+        )
+
+    for order_by in ("oldest", "newest", "likes"):
+        # CommentsAPIView and ThreadDetailView, the comments of a thread after a cursor
+        thread_comments = ThreadComments(Thread(id=1), order_by)
+        position, _ = thread_comments.decode_cursor(thread_comments.encode_cursor(row))
+        queries.append(
+            (f"comment page {order_by}, next page", thread_comments.rows(position).using(using)[:26])
+        )
+
+    queries += [
+        # threads.comment_tree: a subtree (and its deletion), the ancestors of a reply
+        ("subtree of a comment", comments.subtree(SAMPLE_REPLY).order_by("path")),
+        ("ancestors of a reply", comments.ancestors(SAMPLE_REPLY).order_by("path")),
+        # ThreadDetailView, the comments without their replies
+        ("comments oldest", comments.top_level().filter(thread_id=1).order_by("created_at")),
+        ("comments newest", comments.top_level().filter(thread_id=1).order_by("-created_at")),
+        (
+            "comments by likes",
+            comments.top_level().filter(thread_id=1).order_by("-num_likes", "-created_at"),
+        ),
+        ("replies of a comment", replies.filter(parent_comment_id=1).order_by("path")),
+        ("replies of a reply", replies.filter(parent_id=1).order_by("path")),
+        # threads.comment_pages: a level of the windows of the replies and
+        # the replies past a more_replies cursor
+        ("level of a comment window", get_level_queryset([1, 2], 11).using(using)),
+        (
+            "more replies of a node",
+            comments.filter(parent_id=1, path__gt=get_path_step(1)).order_by("path")[:11],
+        ),
+        # ViewerState and the vote service
+        (
+            "votes of a page",
+            Vote.objects.using(using).filter(user_id=1, thread_id__in=[1, 2]).values_list(
+                "thread_id", "vote_type"
+            ),
+        ),
+        ("vote of a thread", Vote.objects.using(using).filter(user_id=1, thread_id=1)),
+    ]
+    return [(name, queryset) for name, queryset in queries if queryset is not None]
+
+
+def next_page_queryset(queryset, field):
+    """
+    Return the query of the page after a cursor, as paginate_keyset() runs it
+    """
+    value = "2024-01-01T00:00:00+00:00" if "created_at" in field else 10
+    return keyset_queryset(queryset, encode_cursor(value, 1))[:26]
+
+
+def explain(queryset):
+    """
+    Return the lines of the EXPLAIN QUERY PLAN of a queryset
+    """
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+        rows = cursor.fetchall()
+    if connection.vendor == "sqlite":
+        # id, parent, notused, detail
+        return [row[-1] for row in rows]
+    return [" ".join(str(column) for column in row) for row in rows]
+
+
+def find_plan_problems(plan):
+    """
+    Return the lines of a plan that read a whole table or sort in a temporary B-tree
+    """
+    subqueries = {match.group(1) for match in map(SUBQUERY_RE.match, map(str.strip, plan)) if match}
+    problems = []
+    for line in plan:
+        scan = FULL_SCAN_RE.match(line.strip())
+        if TEMP_SORT in line or (scan and scan.group(1) not in subqueries):
+            problems.append(line)
+    return problems
@@ -0,0 +1,249 @@
+"""
+    This module contains the rankings of the threads: "hot" and the top of
+    a period
+
+    The hot score is stored in Thread.hot_score and indexed, the hot lists
+    read it in index order. It combines the activity of the thread (likes
+    minus dislikes, boosts and comments) on a log scale with its creation
+    time:
+
+        hot = sign(activity) * log10(max(|activity|, 1)) + age / HOT_DECAY
+
+    where age is the creation time in seconds since HOT_EPOCH. A thread needs
+    10 times the activity of one created HOT_DECAY seconds later to rank the
+    same, so the old popular threads sink without ever recomputing the
+    scores of the idle ones.
+
+    The top of a period (day, week, month or all) ranks the threads created
+    in it by their top score (likes minus dislikes plus the boosts). Every
+    thread has a PeriodScore row per period it was created in, indexed by
+    (period, score) and (period, magazine, score): a ranking is read from
+    an index without touching the votes. The scores are moved by the same
+    UPDATE for every period, ``manage.py rollup_period_scores`` (a scheduled
+    job) deletes the rows of the threads that aged out of a period and
+    repairs the others from the counters. The lists filter on the creation
+    time as well, so they are right between two runs of the job.
+
+    The scores of a thread are recomputed when its counters move: by the
+    vote service, and after the comment counter updates of a transaction.
+    ``manage.py refresh_hot_scores`` recomputes every hot score from the
+    counters, for the rows written without the services (bulk imports,
+    admin) or after changing the weights.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Thread, PeriodScore
+
+HOT_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# Seconds worth a factor of 10 in the activity (12.5 hours)
+HOT_DECAY = 45000
+BOOST_WEIGHT = 2
+COMMENT_WEIGHT = 0.5
+
+# Length of the periods of the top rankings, None for every thread
+PERIODS = {
+    "day": timedelta(days=1),
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "all": None,
+}
+
+
+def top_score(num_likes, num_dislikes, num_points):
+    """
+    Return the score of a thread with these counters in the top rankings
+    """
+    return num_likes - num_dislikes + BOOST_WEIGHT * num_points
+
+
+def hot_score(num_likes, num_dislikes, num_points, num_comments, created_at):
+    """
+    Return the hot score of a thread with these counters
+    """
+    activity = top_score(num_likes, num_dislikes, num_points) + COMMENT_WEIGHT * num_comments
+    order = math.log10(max(abs(activity), 1))
+    sign = (activity > 0) - (activity < 0)
+    age = (created_at - HOT_EPOCH).total_seconds()
+    return round(sign * order + age / HOT_DECAY, 7)
+
+
+def refresh_hot_scores(thread_ids=None, using=None, batch_size=1000):
+    """
+    Recompute the hot score of the threads (every thread by default) from
+    their counters, returns the number of scores that changed
+
+    Only the changed scores are written, with one UPDATE per batch.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    changed = 0
+    fields = ("id", "num_likes", "num_dislikes", "num_points", "num_comments", "created_at", "hot_score")
+    for rows in thread_batches(fields, thread_ids, using, batch_size):
+        updates = []
+        for thread_id, *counters, current in rows:
+            score = hot_score(*counters)
+            if score != current:
+                updates.append(Thread(id=thread_id, hot_score=score))
+        if updates:
+            # bulk_update() does not touch updated_at nor send signals
+            Thread.objects.using(using).bulk_update(updates, ["hot_score"])  # pylint: disable=no-member
+            changed += len(updates)
+    return changed
+
+
+def thread_batches(fields, thread_ids, using, batch_size):
+    """
+    Yield the fields of the threads (every thread by default), batch_size
+    rows at a time, the id must be the first field
+    """
+    threads = Thread.objects.using(using).values_list(*fields)  # pylint: disable=no-member
+    if thread_ids is not None:
+        thread_ids = sorted(set(thread_ids))
+        for start in range(0, len(thread_ids), batch_size):
+            yield list(threads.filter(id__in=thread_ids[start : start + batch_size]))
+        return
+    last_id = 0
+    while True:
+        rows = list(threads.filter(id__gt=last_id).order_by("id")[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def refresh_commented_hot_scores(buffer):
+    """
+    Counter hook, after the write: recompute the score of the threads whose
+    num_comments moved in the transaction
+    """
+    refresh_hot_scores(buffer.get_deltas(Thread, "num_comments"), using=buffer.using)
+
+
+def get_period_cutoff(period, now=None):
+    """
+    Return the creation time of the oldest threads of the period, None for "all"
+    """
+    length = PERIODS[period]
+    if length is None:
+        return None
+    return (now or timezone.now()) - length
+
+
+def get_period_scores(thread, now=None):
+    """
+    Return the unsaved PeriodScore rows of a thread, one per period it is in
+    """
+    score = top_score(thread.num_likes, thread.num_dislikes, thread.num_points)
+    return [
+        PeriodScore(
+            period=period,
+            thread_id=thread.id,
+            magazine_id=thread.magazine_id,
+            created_at=thread.created_at,
+            score=score,
+        )
+        for period in PERIODS
+        if thread.created_at >= (get_period_cutoff(period, now) or thread.created_at)
+    ]
+
+
+def create_period_scores(thread, using=None):
+    """
+    Create the PeriodScore rows of a new thread
+    """
+    PeriodScore.objects.using(using or DEFAULT_DB_ALIAS).bulk_create(  # pylint: disable=no-member
+        get_period_scores(thread)
+    )
+
+
+def add_period_score(thread_id, delta, using=None):
+    """
+    Add delta to the score of the thread in every period, with one UPDATE
+    """
+    if delta:
+        PeriodScore.objects.using(using or DEFAULT_DB_ALIAS).filter(  # pylint: disable=no-member
+            thread_id=thread_id
+        ).update(score=F("score") + delta)
+
+
+def order_by_period(queryset, period, magazine_id=None, now=None):
+    """
+    Return the threads of the queryset created in the period (and in the
+    magazine), the best top score first
+
+    The ordering columns are annotations read from the PeriodScore indexes,
+    the keyset pagination accepts them.
+    """
+    # One filter() call and the annotations share the join of period_scores
+    lookups = {"period_scores__period": period}
+    if magazine_id is not None:
+        lookups["period_scores__magazine_id"] = magazine_id
+    cutoff = get_period_cutoff(period, now)
+    if cutoff is not None:
+        lookups["period_scores__created_at__gte"] = cutoff
+    return (
+        queryset.filter(**lookups)
+        .annotate(
+            period_score=F("period_scores__score"),
+            # The id of the thread, from the index: no sort for the ties
+            period_thread=F("period_scores__thread_id"),
+        )
+        .order_by("-period_score", "-period_thread")
+    )
+
+
+def rollup_period_scores(periods=("day", "week", "month"), using=None, batch_size=1000):
+    """
+    Delete the rows of the threads that aged out of the periods, then create
+    the missing rows of the threads in them and repair the scores that
+    drifted from the counters
+
+    Returns the (deleted, written) numbers of rows.
+    """
+    using = using or DEFAULT_DB_ALIAS
+    now = timezone.now()
+    scores = PeriodScore.objects.using(using)  # pylint: disable=no-member
+    fields = ("id", "num_likes", "num_dislikes", "num_points", "magazine_id", "created_at")
+    deleted = written = 0
+    for period in periods:
+        cutoff = get_period_cutoff(period, now)
+        thread_ids = None
+        if cutoff is not None:
+            deleted += scores.filter(period=period, created_at__lt=cutoff).delete()[0]
+            thread_ids = Thread.objects.using(using).filter(  # pylint: disable=no-member
+                created_at__gte=cutoff
+            ).values_list("id", flat=True)
+        for rows in thread_batches(fields, thread_ids, using, batch_size):
+            current = {
+                thread_id: (score, magazine_id)
+                for thread_id, score, magazine_id in scores.filter(
+                    period=period, thread_id__in=[row[0] for row in rows]
+                ).values_list("thread_id", "score", "magazine_id")
+            }
+            updates = []
+            for thread_id, num_likes, num_dislikes, num_points, magazine_id, created_at in rows:
+                score = top_score(num_likes, num_dislikes, num_points)
+                if current.get(thread_id) != (score, magazine_id):
+                    updates.append(
+                        PeriodScore(
+                            period=period,
+                            thread_id=thread_id,
+                            magazine_id=magazine_id,
+                            created_at=created_at,
+                            score=score,
+                        )
+                    )
+            if updates:
+                scores.bulk_create(
+                    updates,
+                    update_conflicts=True,
+                    unique_fields=["thread", "period"],
+                    update_fields=["magazine", "created_at", "score"],
+                )
+                written += len(updates)
+    return deleted, written
@@ -0,0 +1,137 @@
+"""
+    This module contains the response cache of the anonymous API lists
+
+    Anonymous viewers get the same thread lists, so their GET responses are
+    cached by scheme, host, path, sorted query parameters and format: the
+    next and previous links of a page are absolute URLs. Every key includes
+    the version of its scopes: "global" for the lists of every magazine and
+    "magazine:<id>" for the lists of one magazine. threads.signals bumps the
+    versions when a thread, comment or reply is saved or deleted, so the
+    old entries are never read again and expire. The comment trees of a
+    thread (threads.tree_cache) have their own "thread:<id>" scope.
+
+    Votes and boosts move the counters with update() and send no signal:
+    the counters of a cached list are at most API_CACHE_TIMEOUT seconds old.
+    With several worker processes CACHES must be a shared backend (Redis,
+    Memcached...), with the local memory cache a version is only bumped in
+    the process that wrote.
+"""
+
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+
+from webPage.metrics import Counter, get_view_label
+
+GLOBAL_SCOPE = "global"
+VERSION_KEY = "api-cache:version:{}"
+
+CACHE_REQUESTS = Counter(
+    "api_cache_requests_total",
+    "Anonymous API responses served from the cache (hit) or computed (miss)",
+    ("view", "result"),
+)
+
+
+def magazine_scope(magazine_id):
+    return f"magazine:{magazine_id}"
+
+
+def thread_scope(thread_id):
+    return f"thread:{thread_id}"
+
+
+def get_timeout():
+    return getattr(settings, "API_CACHE_TIMEOUT", 0)
+
+
+def get_versions(scopes):
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Never a previous value, in case the version was evicted
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes, using=None):
+    """
+    Invalidate the cached responses of the scopes
+
+    The versions move now, so this transaction does not read its old
+    entries, and again on commit, so a response computed by another request
+    before the commit is not cached under the new version.
+    """
+
+    def bump():
+        for scope in scopes:
+            key = VERSION_KEY.format(scope)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+
+    bump()
+    transaction.on_commit(bump, using=using)
+
+
+def get_cache_key(request, scopes):
+    params = sorted((name, sorted(values)) for name, values in request.GET.lists())
+    # The browsable API and the JSON of the same list
+    response_format = "html" if "text/html" in request.META.get("HTTP_ACCEPT", "") else "json"
+    # The pagination links are built from the scheme and host of the request
+    text = (
+        f"{request.scheme}://{request.get_host()}{request.path}"
+        f"?{urlencode(params, doseq=True)}#{response_format}"
+    )
+    versions = ".".join(str(version) for version in get_versions(scopes))
+    return f"api-cache:{versions}:{hashlib.sha1(text.encode()).hexdigest()}"
+
+
+class AnonymousCacheMixin:
+    """
+    Serve the GET responses of the viewers without a token from the cache
+    """
+
+    cache_scopes = (GLOBAL_SCOPE,)
+
+    def get_cache_scopes(self, **kwargs):  # pylint: disable=unused-argument
+        return self.cache_scopes
+
+    def dispatch(self, request, *args, **kwargs):
+        timeout = get_timeout()
+        if request.method != "GET" or "HTTP_AUTHORIZATION" in request.META or not timeout:
+            return super().dispatch(request, *args, **kwargs)
+
+        view = get_view_label(request)
+        key = get_cache_key(request, self.get_cache_scopes(**kwargs))
+        cached = cache.get(key)
+        if cached is not None:
+            CACHE_REQUESTS.inc(view, "hit")
+            content, headers = cached
+            # The client may already have it (threads.conditional)
+            response = get_conditional_response(request, etag=headers.get("ETag"))
+            if response is not None:
+                for header in ("ETag", "Last-Modified", "Vary"):
+                    if header in headers:
+                        response[header] = headers[header]
+            else:
+                response = HttpResponse(content, headers=headers)
+            response["X-Cache"] = "HIT"
+            return response
+
+        CACHE_REQUESTS.inc(view, "miss")
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            response.render()
+            cache.set(key, (response.content, dict(response.items())), timeout)
+        response["X-Cache"] = "MISS"
+        return response
@@ -0,0 +1,193 @@
+"""
+    This module contains the full-text search of threads
+
+    On SQLite the title and body of the threads are indexed in an FTS5
+    external content table (the unmanaged ThreadSearchIndex model), kept in
+    sync with threads_thread by triggers, so bulk_create() and update() are
+    indexed too. SQLite drops the triggers when it rebuilds threads_thread
+    to add a column, sync_schema creates them again. Searches join the
+    index with a MATCH and rank with BM25 instead of a LIKE scan of the
+    whole table. Other databases, or SQLite builds without FTS5, fall back
+    to the previous icontains search.
+
+    Query syntax: words must all appear, ``word*`` is a prefix query and
+    ``"some words"`` is a phrase query.
+"""
+
+import re
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import F, FloatField, Func, Q
+from .models import Thread, ThreadSearchIndex
+
+FTS_TABLE = ThreadSearchIndex._meta.db_table
+
+# BM25 weight of the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+# Aliases with the index created, filled lazily
+_fts_enabled = {}
+
+_CREATE_TABLE = f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, body,
+        content='threads_thread', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+"""
+
+# Rebuilding threads_thread (SQLite adds some columns that way) drops them
+_CREATE_TRIGGERS = {
+    f"{FTS_TABLE}_ai": f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON threads_thread BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, body)
+        VALUES (new.id, new.title, coalesce(new.body, ''));
+    END
+    """,
+    f"{FTS_TABLE}_ad": f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON threads_thread BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body)
+        VALUES ('delete', old.id, old.title, coalesce(old.body, ''));
+    END
+    """,
+    f"{FTS_TABLE}_au": f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, body ON threads_thread BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body)
+        VALUES ('delete', old.id, old.title, coalesce(old.body, ''));
+        INSERT INTO {FTS_TABLE}(rowid, title, body)
+        VALUES (new.id, new.title, coalesce(new.body, ''));
+    END
+    """,
+}
+
+# Index the threads that already exist
+_REBUILD_INDEX = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"
+
+# "a phrase", word* or word
+_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def _get_missing_triggers(cursor):
+    cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'threads_thread'"
+    )
+    existing = {name for (name,) in cursor.fetchall()}
+    return [name for name in _CREATE_TRIGGERS if name not in existing]
+
+
+def find_missing_search_triggers(using=DEFAULT_DB_ALIAS):
+    """
+    Return the names of the triggers of the FTS5 index missing from the
+    database, none if it has no index
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return []
+    with connection.cursor() as cursor:
+        if FTS_TABLE not in connection.introspection.table_names(cursor):
+            return []
+        return _get_missing_triggers(cursor)
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Create the FTS5 index and the triggers it is missing
+
+    Called after migrate (syncdb) and sync_schema, returns True if the index
+    is available. The index is rebuilt when something was created: the
+    threads written without the triggers are not in it.
+    """
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return False
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            created = FTS_TABLE not in connection.introspection.table_names(cursor)
+            if created:
+                cursor.execute(_CREATE_TABLE)
+            missing = _get_missing_triggers(cursor)
+            for name in missing:
+                cursor.execute(_CREATE_TRIGGERS[name])
+            if created or missing:
+                cursor.execute(_REBUILD_INDEX)
+    except DatabaseError:
+        # SQLite compiled without FTS5
+        return False
+    _fts_enabled[using] = True
+    return True
+
+
+def has_search_index(using=DEFAULT_DB_ALIAS):
+    """
+    Return True if the database has the FTS5 index
+    """
+    if using not in _fts_enabled:
+        connection = connections[using]
+        _fts_enabled[using] = (
+            connection.vendor == "sqlite"
+            and FTS_TABLE in connection.introspection.table_names()
+        )
+    return _fts_enabled[using]
+
+
+def _quote(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def parse_query(query):
+    """
+    Translate the text typed by the user into an FTS5 MATCH expression
+
+    Every term is quoted, so the FTS5 operators typed by the user (AND, OR,
+    NEAR, column filters...) are searched as plain words. Returns "" if
+    there is nothing to search.
+    """
+    terms = []
+    for phrase, word in _TOKEN_RE.findall(query):
+        text = phrase if phrase else word
+        prefix = not phrase and text.endswith("*")
+        text = text.rstrip("*") if prefix else text
+        if not re.search(r"\w", text):
+            continue
+        terms.append(_quote(text) + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_threads(query, order_by="created_at", queryset=None, using=DEFAULT_DB_ALIAS):
+    """
+    Return the threads matching the query ordered by 'relevance' (BM25),
+    'points', 'num_comments' or 'created_at' (default)
+
+    Without the FTS5 index 'relevance' falls back to the newest first.
+    """
+    if queryset is None:
+        queryset = Thread.objects.all()
+    query = query.strip()
+
+    if has_search_index(using):
+        match = parse_query(query)
+        if not match:
+            return queryset.none()
+        # Joins the index: the MATCH is evaluated once for the whole query
+        queryset = queryset.filter(search_index__document__match=match)
+        if order_by == "relevance":
+            # Lower is more relevant
+            return queryset.annotate(
+                relevance=Func(
+                    F("search_index__document"),
+                    TITLE_WEIGHT,
+                    BODY_WEIGHT,
+                    function="bm25",
+                    output_field=FloatField(),
+                )
+            ).order_by("relevance", "-created_at", "-id")
+    else:
+        if not query:
+            return queryset.none()
+        queryset = queryset.filter(Q(title__icontains=query) | Q(body__icontains=query))
+
+    if order_by == "points":
+        return queryset.order_by("-num_points", "-id")
+    if order_by == "num_comments":
+        return queryset.order_by("-num_comments", "-id")
+    return queryset.order_by("-created_at", "-id")
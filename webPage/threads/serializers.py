@@ -7,12 +7,26 @@ from django.forms import ValidationError
 from django.http import Http404
 from rest_framework import serializers
 from .models import Thread, Boost, Vote, Comment, CommentReply
+from .viewer_state import ViewerStateListSerializer, get_viewer_state
 
 
 class VoteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Vote
-        fields = ["id", "user", "thread", "comment", "reply", "vote_type"]
+        fields = ["id", "user", "thread", "comment", "vote_type"]
+
+
+class ReplyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Id of the parent_reply of a comment, a property and not a foreign key
+    """
+
+    def use_pk_only_optimization(self):
+        return False
+
+
+def parent_comment_field(**kwargs):
+    return serializers.PrimaryKeyRelatedField(queryset=Comment.objects.top_level(), **kwargs)
 
 
 class BoostSerializer(serializers.ModelSerializer):
@@ -64,6 +78,7 @@ class ThreadSerializer(serializers.ModelSerializer):
             "user_has_liked",
             "user_has_disliked",
         ]
+        list_serializer_class = ViewerStateListSerializer
     
     def get_author(self, obj):
         return {
@@ -78,16 +93,16 @@ class ThreadSerializer(serializers.ModelSerializer):
         }
 
     def get_user_has_liked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, thread=obj, vote_type='like').exists()
+        return state.vote_type("thread", obj) == "like"
     
     def get_user_has_disliked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, thread=obj, vote_type='dislike').exists()
+        return state.vote_type("thread", obj) == "dislike"
 
 
 class EditThreadSerializer(serializers.ModelSerializer):
@@ -102,13 +117,14 @@ class EditThreadSerializer(serializers.ModelSerializer):
 
 
 class CreateCommentSerializer(serializers.ModelSerializer):
+    parent_comment = parent_comment_field(required=False)
+    parent_reply = ReplyRelatedField(queryset=CommentReply.objects.all(), required=False)
+
     class Meta:
         model = CommentReply
         fields = ["id", "author", "thread", "parent_comment", "parent_reply", "body"]
         extra_kwargs = {
             "author": {"read_only": True},
-            "parent_comment": {"required": False},
-            "parent_reply": {"required": False},
         }
 
     def create(self, validated_data):
@@ -184,6 +200,8 @@ class CommentReplySerializer(serializers.ModelSerializer):
     magazine = serializers.SerializerMethodField()
     user_has_liked = serializers.SerializerMethodField()
     user_has_disliked = serializers.SerializerMethodField()
+    parent_comment = serializers.ReadOnlyField(source="parent_comment_id")
+    parent_reply = serializers.ReadOnlyField(source="parent_reply_id")
 
     class Meta:
         model = CommentReply
@@ -204,6 +222,7 @@ class CommentReplySerializer(serializers.ModelSerializer):
             "thread_id",
             "reply_level",
         ]
+        list_serializer_class = ViewerStateListSerializer
     def get_author(self, obj):
         return {
             "id": obj.author.id,
@@ -215,15 +234,15 @@ class CommentReplySerializer(serializers.ModelSerializer):
             "name": obj.thread.magazine.name
         }
     def get_user_has_liked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, reply=obj, vote_type='like').exists()
+        return state.vote_type("comment", obj) == "like"
     def get_user_has_disliked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None
-        return Vote.objects.filter(user=user, reply=obj, vote_type='dislike').exists()
+        return state.vote_type("comment", obj) == "dislike"
     
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -250,6 +269,7 @@ class CommentSerializer(serializers.ModelSerializer):
             "user_has_disliked",
             "replies",
         ]
+        list_serializer_class = ViewerStateListSerializer
     def get_author(self, obj):
         return {
             "id": obj.author.id,
@@ -263,24 +283,62 @@ class CommentSerializer(serializers.ModelSerializer):
         }
     
     def get_user_has_liked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, comment=obj ,vote_type='like').exists()
+        return state.vote_type("comment", obj) == "like"
     
     def get_user_has_disliked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, comment=obj, vote_type='dislike').exists()
+        return state.vote_type("comment", obj) == "dislike"
     
     def get_replies(self, obj):
-        replies = CommentReply.objects.filter(parent_comment=obj)
+        # Already attached by threads.comment_tree.prefetch_replies
+        replies = getattr(obj, "replies", None)
+        if replies is None:
+            replies = CommentReply.objects.filter(parent_comment=obj).select_related(
+                "author", "thread__magazine"
+            )
         return CommentReplySerializer(replies, many=True, context=self.context).data
     
 
 
+class CommentTreeReplySerializer(CommentReplySerializer):
+    # Cursor of the replies the window does not show, see threads.comment_pages
+    more_replies = serializers.ReadOnlyField()
+
+    class Meta(CommentReplySerializer.Meta):
+        fields = [*CommentReplySerializer.Meta.fields, "more_replies"]
+
+
+class CommentTreeSerializer(CommentSerializer):
+    more_replies = serializers.ReadOnlyField()
+
+    class Meta(CommentSerializer.Meta):
+        fields = [*CommentSerializer.Meta.fields, "more_replies"]
+
+    def get_replies(self, obj):
+        # The window attached by threads.comment_pages
+        return CommentTreeReplySerializer(obj.replies, many=True, context=self.context).data
+
+
+class ReplySubtreeSerializer(CommentTreeReplySerializer):
+    # A reply of a more_replies page, with its own window
+    replies = serializers.SerializerMethodField()
+
+    class Meta(CommentTreeReplySerializer.Meta):
+        fields = [*CommentTreeReplySerializer.Meta.fields, "replies"]
+
+    def get_replies(self, obj):
+        return CommentTreeReplySerializer(obj.replies, many=True, context=self.context).data
+
+
 class CreateCommentReplySerializer(serializers.ModelSerializer):
+    parent_comment = parent_comment_field()
+    parent_reply = ReplyRelatedField(queryset=CommentReply.objects.all())
+
     class Meta:
         model = CommentReply
         fields = ["id", "author", "thread", "parent_comment", "parent_reply", "body"]
@@ -298,7 +356,7 @@ class CreateCommentReplySerializer(serializers.ModelSerializer):
         
         # Obtiene el parent_comment_id 
         parent_comment_id = validated_data["parent_comment"].id
-        if not Comment.objects.filter(id=parent_comment_id).exists():
+        if not Comment.objects.top_level().filter(id=parent_comment_id).exists():
             raise Http404("Parent comment does not exist")
         
         # Obtiene el parent_reply_id
@@ -307,7 +365,7 @@ class CreateCommentReplySerializer(serializers.ModelSerializer):
             raise Http404("Parent reply does not exist")
 
         # Obtener el parent_comment
-        parent_comment = Comment.objects.get(pk=parent_comment_id)
+        parent_comment = Comment.objects.top_level().get(pk=parent_comment_id)
         # Ontener el parent_reply
         parent_reply = CommentReply.objects.get(pk=parent_reply_id)
         # Obtener el thread_id del parent_comment
@@ -332,9 +390,25 @@ class CreateCommentReplySerializer(serializers.ModelSerializer):
 
 class CommentReplyReplySerializer(serializers.ModelSerializer):
     magazine = serializers.ReadOnlyField(source="thread.magazine.id")
+    parent_reply = serializers.ReadOnlyField(source="parent_reply_id")
     class Meta:
         model = CommentReply
-        fields = "__all__"
+        # The columns of the replies table
+        fields = [
+            "id",
+            "author",
+            "thread",
+            "parent_comment",
+            "parent_reply",
+            "body",
+            "magazine",
+            "created_at",
+            "updated_at",
+            "num_likes",
+            "num_dislikes",
+            "num_replies",
+            "reply_level",
+        ]
 
 class CreateCommentReplyReplySerializer(serializers.ModelSerializer):
     class Meta:
@@ -362,7 +436,7 @@ class CreateCommentReplyReplySerializer(serializers.ModelSerializer):
         
         # Comprobar si existe el parent_comment
         try:
-            parent_comment = Comment.objects.get(id=parent_comment_id)
+            parent_comment = Comment.objects.top_level().get(id=parent_comment_id)
         except Comment.DoesNotExist:
             raise Http404("Parent comment does not exist")
         
@@ -438,6 +512,7 @@ class SearchSerializer(serializers.ModelSerializer):
             "user_has_liked",
             "user_has_disliked",
         ]
+        list_serializer_class = ViewerStateListSerializer
 
     def get_author(self, obj):
         return {
@@ -452,13 +527,13 @@ class SearchSerializer(serializers.ModelSerializer):
         }
 
     def get_user_has_liked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, thread=obj, vote_type='like').exists()
+        return state.vote_type("thread", obj) == "like"
     
     def get_user_has_disliked(self, obj):
-        user = self.context.get('user')
-        if user is None:
+        state = get_viewer_state(self.context)
+        if state is None:
             return None # Devuelve None si no hay usuario autenticado
-        return Vote.objects.filter(user=user, thread=obj, vote_type='dislike').exists()
+        return state.vote_type("thread", obj) == "dislike"
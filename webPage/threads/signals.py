@@ -2,54 +2,166 @@
 Signals for the threads app
 """
 
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete, post_migrate
 from django.dispatch import receiver
-from .models import Comment, Thread, CommentReply
+from django.utils import timezone
+from .models import Comment, Thread, CommentReply, PeriodScore, FeedEntry
 from magazine.models import Magazine
+from .counters import increment
+from .feed import fan_out
+from .search import create_search_index
+from .ranking import create_period_scores, hot_score, refresh_commented_hot_scores
+from .response_cache import GLOBAL_SCOPE, bump_versions, magazine_scope, thread_scope
 
 def count_total_comments_and_replies(thread):
     """
     Function to count the total number of comments and replies in a thread
     """
-    total_comments = thread.comments.count()  # Count the main comments
-    total_replies = CommentReply.objects.filter(thread=thread).count()  # Count the replies
-    return total_comments + total_replies
+    # The replies are in the comments table
+    return thread.comments.count()
 
 
 
+def comment_count_delta(signal, created=False, raw=False):
+    """
+    Return the change in the comment count for a comment or reply signal:
+    +1 on creation, -1 on deletion and 0 on edits or fixture loading
+    """
+    if raw:
+        return 0
+    if signal is post_delete:
+        return -1
+    return 1 if created else 0
+
+
+def propagate_comment_count_to_magazines(buffer):
+    """
+    Counter hook: add the pending thread num_comments deltas to the
+    comments_count of their magazines (one query for the whole transaction)
+    and invalidate the cached thread lists of those magazines
+    """
+    thread_deltas = buffer.get_deltas(Thread, "num_comments")
+    threads = Thread.objects.using(buffer.using).filter(  # pylint: disable=no-member
+        id__in=thread_deltas, magazine__isnull=False
+    )
+    magazine_ids = set()
+    for thread_id, magazine_id in threads.values_list("id", "magazine_id"):
+        buffer.add(Magazine, magazine_id, "comments_count", thread_deltas[thread_id])
+        magazine_ids.add(magazine_id)
+    if magazine_ids:
+        bump_versions(*map(magazine_scope, magazine_ids), using=buffer.using)
+
+
+def update_thread_comment_count(instance, delta):
+    """
+    Move the comment count of the thread of a comment or reply by delta,
+    and invalidate the cached comment trees of the thread
+    """
+    bump_versions(thread_scope(instance.thread_id))
+    if delta:
+        # The magazine lists are invalidated by the counter hook
+        bump_versions(GLOBAL_SCOPE)
+    increment(
+        Thread,
+        instance.thread_id,
+        "num_comments",
+        delta,
+        hook=propagate_comment_count_to_magazines,
+        after=refresh_commented_hot_scores,
+    )
+
+
 @receiver([post_save, post_delete], sender=Comment)
 def update_thread_comment_count_on_comment_change(
-    sender, instance, **kwargs
-):
+    sender, instance, signal, created=False, raw=False, **kwargs
+):  # pylint: disable=unused-argument
     """
     Update the comment count on the thread when a comment is created or deleted
     """
-    thread = instance.thread
-    thread.num_comments = count_total_comments_and_replies(thread)
-    thread.save(update_fields=["num_comments"])
+    update_thread_comment_count(instance, comment_count_delta(signal, created, raw))
 
 @receiver([post_save, post_delete], sender=CommentReply)
 def update_thread_comment_count_on_reply_change(
-    sender, instance, **kwargs
-):
+    sender, instance, signal, created=False, raw=False, **kwargs
+):  # pylint: disable=unused-argument
     """
     Update the comment count on the thread when a reply is created or deleted
+
+    The replies deleted with their comment are collected as Comment rows.
+    """
+    update_thread_comment_count(instance, comment_count_delta(signal, created, raw))
+
+
+@receiver(pre_save, sender=Thread)
+def set_new_thread_hot_score(sender, instance, raw=False, **kwargs):  # pylint: disable=unused-argument
     """
-    thread = instance.thread
-    thread.num_comments = count_total_comments_and_replies(thread)
-    thread.save(update_fields=["num_comments"])
+    Give a new thread the hot score of its counters and creation time
+    """
+    if raw or not instance._state.adding:  # pylint: disable=protected-access
+        return
+    instance.hot_score = hot_score(
+        instance.num_likes,
+        instance.num_dislikes,
+        instance.num_points,
+        instance.num_comments,
+        instance.created_at or timezone.now(),
+    )
+
+
+def move_thread_to_magazine(thread, magazine_id, sign):
+    """
+    Add (sign=1) or remove (sign=-1) a thread and its comments to a magazine count
+    """
+    increment(Magazine, magazine_id, "threads_count", sign)
+    increment(Magazine, magazine_id, "comments_count", sign * thread.num_comments)
 
 
 @receiver([post_save, post_delete], sender=Thread)
 def update_magazine_count(
-    sender, instance, **kwargs
+    sender, instance, signal, created=False, raw=False, **kwargs
 ):  # pylint: disable=unused-argument
     """
-    Update the comment count on the thread after a comment is created or deleted
+    Update the thread and comment counts of the magazine when a thread is
+    created, deleted or moved to another magazine, with the top of the
+    period rankings and the subscribed feeds, and invalidate the cached
+    thread lists it appears in
+
+    Saves that do not touch the magazine (edits, counter updates) do not
+    change the counts.
     """
-    magazine = instance.magazine
-    magazine.threads_count = magazine.threads.count()
-    magazine.comments_count = sum(
-        thread.num_comments for thread in magazine.threads.all()
+    if raw:
+        return
+    previous_magazine_id = getattr(
+        instance, "_loaded_magazine_id", instance.magazine_id
     )
-    magazine.save(update_fields=["threads_count", "comments_count"])
\ No newline at end of file
+    scopes = {
+        GLOBAL_SCOPE,
+        magazine_scope(instance.magazine_id),
+        magazine_scope(previous_magazine_id),
+        # The comment trees show the magazine of the thread
+        thread_scope(instance.id),
+    }
+    bump_versions(*scopes)
+    if signal is post_delete:
+        move_thread_to_magazine(instance, instance.magazine_id, -1)
+        return
+    if created:
+        move_thread_to_magazine(instance, instance.magazine_id, 1)
+        create_period_scores(instance)
+        fan_out(instance)
+    elif previous_magazine_id != instance.magazine_id:
+        move_thread_to_magazine(instance, previous_magazine_id, -1)
+        move_thread_to_magazine(instance, instance.magazine_id, 1)
+        PeriodScore.objects.filter(thread=instance).update(magazine_id=instance.magazine_id)
+        FeedEntry.objects.filter(thread=instance).delete()
+        fan_out(instance)
+    instance._loaded_magazine_id = instance.magazine_id  # pylint: disable=protected-access
+
+
+@receiver(post_migrate)
+def create_thread_search_index(sender, using, **kwargs):
+    """
+    Create the full-text index of the threads once their table exists
+    """
+    if sender.name == "threads":
+        create_search_index(using)
@@ -0,0 +1,30 @@
+"""
+    Template tags of the thread cards (threads/common.html)
+"""
+
+from django import template
+from django.utils import timezone
+
+register = template.Library()
+
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+
+
+@register.simple_tag
+def age_key(*moments):
+    """
+    Return a key that changes when the "N units ago" text of one of the
+    moments (time_since_creation, time_since_update) would change
+
+    The text shows minutes for the first hour, hours for the first day and
+    days, weeks, months or years after that, which only move once a day.
+    """
+    now = timezone.now()
+    parts = []
+    for moment in moments:
+        age = (now - moment).total_seconds()
+        unit = MINUTE if age < HOUR else HOUR if age < DAY else DAY
+        parts.append(f"{int(age // unit)}.{unit}")
+    return "-".join(parts)
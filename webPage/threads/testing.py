@@ -0,0 +1,212 @@
+"""
+    This module contains the SQL query budget helpers shared by the tests of
+    every app
+
+    QueryBudgetTestCase seeds a dataset larger than a page (so a per-row query
+    blows any budget) and assertQueryBudget() requests an endpoint as an
+    anonymous or authenticated user, failing with the SQL grouped by the line
+    of the project that issued it.
+"""
+
+import traceback
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from magazine.models import Magazine, Subscription
+from .models import Thread, Comment, CommentReply, Vote, Boost
+
+PROJECT_DIR = Path(settings.BASE_DIR).resolve()
+
+# Wrap every request, never the origin of a query
+IGNORED_FILES = {Path(__file__).resolve(), PROJECT_DIR / "webPage" / "metrics.py"}
+
+
+class QueryRecorder:
+    """
+    Execute wrapper that keeps the project call site of every query
+    """
+
+    def __init__(self):
+        self.call_sites = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.call_sites.append(self.find_call_site())
+        return execute(sql, params, many, context)
+
+    @staticmethod
+    def find_call_site():
+        # Innermost frame in the project, outside of this module and the tests
+        for frame in reversed(traceback.extract_stack()[:-2]):
+            path = Path(frame.filename).resolve()
+            if (
+                PROJECT_DIR in path.parents
+                and path not in IGNORED_FILES
+                and path.name != "tests.py"
+            ):
+                return f"{path.relative_to(PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+        return "(outside the project)"
+
+
+def format_queries(queries, call_sites):
+    """
+    Return the captured SQL grouped by call site, the busiest first
+    """
+    groups = defaultdict(list)
+    for query, call_site in zip(queries, call_sites):
+        groups[call_site].append(query["sql"])
+    lines = []
+    for call_site, statements in sorted(groups.items(), key=lambda item: -len(item[1])):
+        lines.append(f"{len(statements)} queries from {call_site}")
+        # A few distinct statements are enough to spot an N+1
+        distinct = list(dict.fromkeys(statements))
+        for sql in distinct[:3]:
+            lines.append(f"    {sql}")
+        if len(distinct) > 3:
+            lines.append(f"    ... and {len(distinct) - 3} more")
+    return "\n".join(lines)
+
+
+# The budgets measure the views, not the response caches
+@override_settings(API_CACHE_TIMEOUT=0, COMMENT_TREE_CACHE_TIMEOUT=0)
+class QueryBudgetTestCase(TestCase):
+    """
+    Base class of the per-endpoint query budget tests
+
+    Every named URL of ``urlconf`` needs a test_<url name> method (dashes
+    as underscores), except the ones in ``untested_urls`` with the reason.
+    """
+
+    urlconf = None
+    untested_urls = {}
+
+    # More rows than a page of the paginated lists (25)
+    threads_per_magazine = 30
+    comments_per_thread = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="pass")
+        cls.viewer = User.objects.create_user(username="viewer", password="pass")
+        cls.users = [cls.author, cls.viewer]
+        for user in cls.users:
+            Token.objects.create(user=user)
+
+        cls.magazines = [
+            Magazine.objects.create(name=f"magazine{i}", title=f"Magazine {i}", author=cls.author)
+            for i in range(2)
+        ]
+        cls.magazine = cls.magazines[0]
+
+        # Run the counter updates like a real commit would
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.threads = [
+                Thread.objects.create(
+                    title=f"Python thread {i}",
+                    body="Threads about python",
+                    url="https://example.com" if i % 2 else None,
+                    is_link=bool(i % 2),
+                    author=cls.author,
+                    magazine=magazine,
+                )
+                for magazine in cls.magazines
+                for i in range(cls.threads_per_magazine)
+            ]
+            cls.thread = cls.threads[0]
+
+            # One busy thread: comments with two levels of replies by both users
+            cls.comments = []
+            for i in range(cls.comments_per_thread):
+                comment = Comment.objects.create(
+                    thread=cls.thread, author=cls.users[i % 2], body=f"Comment {i}"
+                )
+                reply = CommentReply.objects.create(
+                    thread=cls.thread,
+                    parent_comment=comment,
+                    author=cls.users[(i + 1) % 2],
+                    body=f"Reply {i}",
+                )
+                CommentReply.objects.create(
+                    thread=cls.thread,
+                    parent_comment=comment,
+                    parent_reply=reply,
+                    author=cls.users[i % 2],
+                    body=f"Nested reply {i}",
+                    reply_level=2,
+                )
+                cls.comments.append(comment)
+            cls.comment = cls.comments[0]
+            cls.reply = CommentReply.objects.filter(parent_comment=cls.comment).first()
+
+        # The viewer state of every list is populated
+        Vote.objects.bulk_create(
+            [Vote(user=cls.viewer, thread=thread, vote_type="like") for thread in cls.threads[::2]]
+            + [Vote(user=cls.viewer, comment=comment, vote_type="dislike") for comment in cls.comments[::2]]
+            + [
+                Vote(user=cls.viewer, comment=reply, vote_type="like")
+                for reply in CommentReply.objects.filter(thread=cls.thread).order_by("id")[::2]
+            ]
+        )
+        Boost.objects.bulk_create(
+            [Boost(user=user, thread=thread) for user in cls.users for thread in cls.threads[::3]]
+        )
+        Subscription.objects.bulk_create(
+            [Subscription(user=cls.viewer, magazine=magazine) for magazine in cls.magazines]
+        )
+
+    def get_client(self, path, user=None):
+        """
+        API client authenticated with the token, or Django client with a session
+        """
+        if "/api/" in path:
+            client = APIClient()
+            if user is not None:
+                client.credentials(HTTP_AUTHORIZATION=f"Token {user.auth_token.key}")
+        else:
+            client = self.client_class()
+            if user is not None:
+                client.force_login(user)
+        return client
+
+    def assertQueryBudget(self, budget, path, method="get", user=None, status=None, **kwargs):
+        """
+        Request the path and assert that it runs at most ``budget`` queries
+
+        The on_commit callbacks (counter updates) are executed and counted.
+        Returns the response.
+        """
+        client = self.get_client(path, user)
+        recorder = QueryRecorder()
+        with CaptureQueriesContext(connection) as queries, connection.execute_wrapper(recorder):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = getattr(client, method)(path, **kwargs)
+
+        if status is not None:
+            self.assertEqual(response.status_code, status, f"{method.upper()} {path}")
+        if len(queries) > budget:
+            who = user.username if user is not None else "anonymous"
+            self.fail(
+                f"{method.upper()} {path} as {who} ran {len(queries)} queries, "
+                f"the budget is {budget}:\n"
+                + format_queries(queries.captured_queries, recorder.call_sites)
+            )
+        return response
+
+    def test_every_url_has_a_budget(self):
+        if self.urlconf is None:
+            return
+        for pattern in get_resolver(self.urlconf).url_patterns:
+            name = getattr(pattern, "name", None)
+            if name is None or name in self.untested_urls:
+                continue
+            method = "test_" + name.replace("-", "_")
+            with self.subTest(url_name=name):
+                self.assertTrue(hasattr(self, method), f"{name} has no {method}")
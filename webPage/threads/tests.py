@@ -1,3 +1,2126 @@
-from django.test import TestCase
+import base64
+import json
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from magazine.models import Magazine, Subscription
+from magazine.subscriptions import subscribe, unsubscribe
+from webPage.metrics import REGISTRY
+from .comment_pages import NodeReplies, ThreadComments, decode_replies_cursor, encode_replies_cursor
+from .comment_tree import delete_subtree, rebuild_paths
+from .counters import CounterBuffer, increment
+from .models import Thread, Comment, CommentReply, Vote, Boost, PeriodScore, Feed, FeedEntry, get_path_step
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, get_keyset_tiebreaker, paginate_keyset
+from .query_plans import explain, find_plan_problems, get_hot_queries
+from .ranking import hot_score, order_by_period, refresh_hot_scores
+from .response_cache import CACHE_REQUESTS
+from .search import find_missing_search_triggers, search_threads
+from .serializers import ThreadSerializer
+from .testing import QueryBudgetTestCase
+from .votes import cast_vote, remove_vote, add_boost, remove_boost, insert_or_ignore
+
+
+class KeysetPaginationTest(TestCase):
+    """
+    Keyset pages are stable over ties and walk back and forth to the same rows
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="pass")
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.threads = [
+            Thread.objects.create(
+                title=f"Thread {i}", author=cls.author, magazine=cls.magazine, num_points=points
+            )
+            for i, points in enumerate([3, 1, 3, 0, 1, 3, 1])
+        ]
+
+    def walk(self, queryset, page_size):
+        pages = [paginate_keyset(queryset, page_size=page_size)]
+        while pages[-1].has_next():
+            pages.append(paginate_keyset(queryset, pages[-1].next_cursor, page_size))
+        return pages
+
+    def test_ties_are_broken_by_the_pk(self):
+        queryset = Thread.objects.order_by("-num_points")
+        pages = self.walk(queryset, 2)
+        rows = [thread.pk for page in pages for thread in page]
+        self.assertEqual(rows, list(queryset.order_by("-num_points", "-pk").values_list("pk", flat=True)))
+        self.assertEqual([len(page) for page in pages], [2, 2, 2, 1])
+        self.assertFalse(pages[0].has_previous())
+
+    def test_previous_returns_the_same_rows(self):
+        queryset = Thread.objects.order_by("num_points")
+        pages = self.walk(queryset, 3)
+        for page, following in zip(pages, pages[1:]):
+            back = paginate_keyset(queryset, following.previous_cursor, 3)
+            self.assertEqual(list(back), list(page))
+            self.assertEqual(back.next_cursor, page.next_cursor)
+            self.assertEqual(back.has_previous(), page.has_previous())
+            self.assertEqual(list(paginate_keyset(queryset, back.next_cursor, 3)), list(following))
+
+    def test_annotation_tiebreaker(self):
+        scores = dict(zip([thread.pk for thread in self.threads], [2, 2, 5, 2, 0, 5, 2]))
+        for pk, score in scores.items():
+            PeriodScore.objects.filter(thread_id=pk).update(score=score)
+        queryset = order_by_period(Thread.objects.all(), "all")
+        self.assertEqual(get_keyset_tiebreaker(queryset), "period_thread")
+
+        pages = self.walk(queryset, 2)
+        rows = [thread.pk for page in pages for thread in page]
+        self.assertEqual(rows, sorted(scores, key=lambda pk: (-scores[pk], -pk)))
+        back = paginate_keyset(queryset, pages[2].previous_cursor, 2)
+        self.assertEqual(list(back), list(pages[1]))
+
+    def test_invalid_cursors(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not a cursor")
+        queryset = Thread.objects.order_by("-created_at")
+        with self.assertRaises(InvalidCursor):
+            paginate_keyset(queryset, encode_cursor("yesterday", 1))
+
+        for cursor in ("!!!", "e30", encode_cursor("yesterday", 1), encode_cursor(None, "x")):
+            with self.subTest(cursor=cursor):
+                response = self.client.get("/api/threads/", {"cursor": cursor, "order_by": "created_at"})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+    def test_malformed_cursors(self):
+        def raw_cursor(payload):
+            return base64.urlsafe_b64encode(payload.encode()).decode()
+
+        now = '"2024-01-01T00:00:00+00:00"'
+        cursors = {
+            "created_at": [
+                '{"v": null, "pk": 1, "r": false}',
+                f'{{"v": {now}, "pk": 1e400, "r": false}}',
+                f'{{"v": {now}, "pk": 100000000000000000000, "r": false}}',
+                f'{{"v": {now}, "pk": "1", "r": false}}',
+                f'{{"v": {now}, "pk": true, "r": false}}',
+                f'{{"v": {now}, "pk": 1, "r": 1}}',
+                f'{{"v": [{now}], "pk": 1, "r": false}}',
+                f"[{now}, 1, false]",
+            ],
+            "points": [
+                '{"v": null, "pk": 1, "r": false}',
+                '{"v": 1e400, "pk": 1, "r": false}',
+                '{"v": 100000000000000000000, "pk": 1, "r": false}',
+                '{"v": {"points": 1}, "pk": 1, "r": false}',
+            ],
+        }
+        for order_by, payloads in cursors.items():
+            for payload in payloads:
+                with self.subTest(order_by=order_by, payload=payload):
+                    response = self.client.get(
+                        "/api/threads/", {"cursor": raw_cursor(payload), "order_by": order_by}
+                    )
+                    self.assertEqual(response.status_code, 404)
+                    self.assertEqual(response.json(), {"detail": "Invalid cursor"})
+
+    def test_api_pages(self):
+        response = self.client.get("/api/threads/", {"order_by": "points", "page_size": 4})
+        first = response.json()
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        self.assertIsNone(second["next"])
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+        self.assertIsNone(back["previous"])
+        ids = [thread["id"] for thread in first["results"] + second["results"]]
+        self.assertCountEqual(ids, [thread.pk for thread in self.threads])
+
+
+class ViewerStateTest(TestCase):
+    """
+    The user_has_* fields of the lists show the votes of the viewer only,
+    loaded with one query for the whole page
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user(username="viewer", password="pass")
+        cls.other = User.objects.create_user(username="other", password="pass")
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.other)
+        cls.threads = [
+            Thread.objects.create(title=f"Thread {i}", author=cls.other, magazine=cls.magazine)
+            for i in range(4)
+        ]
+        liked, disliked, boosted, _ = cls.threads
+        cast_vote(cls.viewer, liked, "like")
+        cast_vote(cls.viewer, disliked, "dislike")
+        add_boost(cls.viewer, boosted)
+        for thread in cls.threads:
+            cast_vote(cls.other, thread, "dislike")
+            add_boost(cls.other, thread)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_states(self, **extra):
+        response = self.client.get("/api/threads/", {"order_by": "created_at"}, **extra)
+        self.assertEqual(response.status_code, 200)
+        return {
+            thread["id"]: (thread["user_has_liked"], thread["user_has_disliked"])
+            for thread in response.json()["results"]
+        }
+
+    def test_anonymous_viewer(self):
+        self.assertEqual(self.get_states(), {thread.id: (None, None) for thread in self.threads})
+
+    def test_authenticated_viewer(self):
+        liked, disliked, boosted, untouched = self.threads
+        self.assertEqual(
+            self.get_states(HTTP_AUTHORIZATION=f"Token {self.token.key}"),
+            {
+                liked.id: (True, False),
+                disliked.id: (False, True),
+                boosted.id: (False, False),
+                untouched.id: (False, False),
+            },
+        )
+
+    def test_no_boost_state(self):
+        auth = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        for path, params in (("/api/threads/", {}), ("/api/search/", {"query": "Thread"})):
+            with self.subTest(path=path):
+                response = self.client.get(path, params, **auth).json()
+                threads = response["results"] if isinstance(response, dict) else response
+                self.assertEqual(len(threads), 4)
+                self.assertFalse(any("user_has_boosted" in thread for thread in threads))
+
+    def test_one_query_per_relation(self):
+        threads = list(Thread.objects.select_related("author", "magazine"))
+        # The votes of the viewer, whatever the length of the list
+        with self.assertNumQueries(1):
+            data = ThreadSerializer(threads, many=True, context={"user": self.viewer}).data
+        self.assertEqual(sum(thread["user_has_liked"] for thread in data), 1)
+        with self.assertNumQueries(0):
+            ThreadSerializer(threads, many=True, context={"user": None}).data
+
+        for i in range(10):
+            thread = Thread.objects.create(title=f"More {i}", author=self.other, magazine=self.magazine)
+            cast_vote(self.viewer, thread, "like")
+        threads = list(Thread.objects.select_related("author", "magazine"))
+        with self.assertNumQueries(1):
+            data = ThreadSerializer(threads, many=True, context={"user": self.viewer}).data
+        self.assertEqual(sum(thread["user_has_liked"] for thread in data), 11)
+
+    def test_list_query_count(self):
+        # The token, the page and the votes
+        with self.assertNumQueries(3):
+            self.get_states(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        with self.assertNumQueries(1):
+            self.get_states()
+
+
+@override_settings(COMMENT_TREE_CACHE_TIMEOUT=0, API_CACHE_TIMEOUT=0)
+class CommentViewerStateTest(TestCase):
+    """
+    The comment trees of the API show the votes of the viewer on every
+    node, loaded with one query whatever the size of the trees
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        ViewerStateTest.setUpTestData()
+        cls.viewer = User.objects.get(username="viewer")
+        cls.other = User.objects.get(username="other")
+        cls.token = Token.objects.get(user=cls.viewer)
+        cls.thread = Thread.objects.get(title="Thread 0")
+        cls.comment = Comment.objects.create(thread=cls.thread, author=cls.other, body="Comment")
+        cls.reply = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.comment, author=cls.other, body="Reply"
+        )
+        cls.nested = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.comment, parent=cls.reply, author=cls.other, body="Nested"
+        )
+        cast_vote(cls.viewer, cls.comment, "dislike")
+        cast_vote(cls.viewer, cls.nested, "like")
+        cast_vote(cls.other, cls.reply, "like")
+
+    def get_states(self, **extra):
+        response = self.client.get("/api/comments/", {"thread_id": self.thread.id}, **extra)
+        self.assertEqual(response.status_code, 200)
+        return {
+            node["id"]: (node["user_has_liked"], node["user_has_disliked"])
+            for comment in response.json()["results"]
+            for node in (comment, *comment["replies"])
+        }
+
+    def test_votes_of_every_node(self):
+        self.assertEqual(
+            self.get_states(),
+            {node.id: (None, None) for node in (self.comment, self.reply, self.nested)},
+        )
+        self.assertEqual(
+            self.get_states(HTTP_AUTHORIZATION=f"Token {self.token.key}"),
+            {
+                self.comment.id: (False, True),
+                self.reply.id: (False, False),
+                self.nested.id: (True, False),
+            },
+        )
+
+    def test_query_count_does_not_grow_with_the_tree(self):
+        auth = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"}
+        # The token, the thread, the page, its comments, one query per level
+        # of replies read (three for two levels), the votes on the replies
+        # and on the comments
+        with self.assertNumQueries(9):
+            self.get_states(**auth)
+        for i in range(5):
+            comment = Comment.objects.create(thread=self.thread, author=self.other, body=f"More {i}")
+            reply = CommentReply.objects.create(
+                thread=self.thread, parent_comment=comment, author=self.other, body="Reply"
+            )
+            cast_vote(self.viewer, reply, "like")
+        with self.assertNumQueries(9):
+            states = self.get_states(**auth)
+        self.assertEqual(sum(liked for liked, _ in states.values()), 6)
+
+
+class CounterBufferTest(TestCase):
+    """
+    The counter deltas of a transaction are written once, at commit
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="pass")
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.threads = [
+            Thread.objects.create(title=f"Thread {i}", author=cls.author, magazine=cls.magazine)
+            for i in range(2)
+        ]
+
+    def comment(self, thread):
+        return Comment.objects.create(thread=thread, author=self.author, body="Comment")
+
+    def assertCounts(self, *counts):
+        self.assertEqual(
+            [thread.num_comments for thread in Thread.objects.order_by("id")], list(counts[:-1])
+        )
+        self.magazine.refresh_from_db()
+        self.assertEqual(self.magazine.comments_count, counts[-1])
+
+    def test_deltas_collapse_into_one_update_per_row(self):
+        first, second = self.threads
+        with self.captureOnCommitCallbacks() as callbacks:
+            for _ in range(3):
+                self.comment(first)
+            self.comment(second)
+            self.comment(second).delete()
+            self.comment(second)
+        # Nothing is written before the commit
+        self.assertCounts(0, 0, 0)
+        self.assertEqual(
+            len([callback for callback in callbacks if isinstance(callback, CounterBuffer)]), 1
+        )
+
+        with CaptureQueriesContext(connection) as queries:
+            for callback in callbacks:
+                callback()
+        updates = [query["sql"] for query in queries.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len([sql for sql in updates if 'SET "num_comments" = ' in sql]), 2)
+        self.assertEqual(len([sql for sql in updates if 'SET "comments_count" = ' in sql]), 1)
+        self.assertCounts(3, 2, 5)
+
+    def test_rolled_back_savepoint_drops_its_deltas(self):
+        first, second = self.threads
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment(first)
+            try:
+                with transaction.atomic():
+                    self.comment(first)
+                    self.comment(second)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            with transaction.atomic():
+                self.comment(second)
+        self.assertCounts(1, 1, 2)
+
+    def test_hooks_run_only_on_commit(self):
+        thread = self.threads[0]
+        calls = []
+
+        def hook(buffer):
+            calls.append(("hook", buffer.get_deltas(Thread, "num_comments")))
+
+        def after(buffer):  # pylint: disable=unused-argument
+            calls.append(("after", Thread.objects.get(pk=thread.pk).num_comments))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            increment(Thread, thread.pk, "num_comments", 2, hook=hook, after=after)
+            increment(Thread, thread.pk, "num_comments", 3, hook=hook, after=after)
+            try:
+                with transaction.atomic():
+                    increment(Thread, thread.pk, "num_likes", 1, hook=hook, after=after)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self.assertEqual(calls, [])
+        # Once per buffer: the rolled back savepoint had its own
+        self.assertEqual(calls, [("hook", {thread.pk: 5}), ("after", 5)])
+        self.assertEqual(Thread.objects.get(pk=thread.pk).num_likes, 0)
+
+
+class CounterCommitTest(TransactionTestCase):
+    """
+    The database backend writes the counters in the transaction of the rows
+    they count, right before its COMMIT
+    """
+
+    def setUp(self):
+        author = User.objects.create_user(username="author", password="pass")
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=author)
+        self.thread = Thread.objects.create(title="Thread", author=author, magazine=magazine)
+
+    def test_counters_commit_with_the_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for _ in range(2):
+                    Comment.objects.create(thread=self.thread, author=self.thread.author, body="Comment")
+        statements = [query["sql"] for query in queries.captured_queries]
+        update = next(i for i, sql in enumerate(statements) if 'SET "num_comments" = ' in sql)
+        self.assertLess(update, statements.index("COMMIT"))
+        self.assertEqual(statements[-1], "COMMIT")
+        self.thread.magazine.refresh_from_db()
+        self.assertEqual(self.thread.magazine.comments_count, 2)
+
+    def test_failed_counter_write_rolls_back_the_rows(self):
+        def hook(buffer):  # pylint: disable=unused-argument
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Comment.objects.create(thread=self.thread, author=self.thread.author, body="Comment")
+                increment(Thread, self.thread.pk, "num_likes", hook=hook)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).num_comments, 0)
+        self.assertFalse(connection.in_atomic_block)
+        self.assertTrue(connection.get_autocommit())
+
+
+class ConcurrentWritesTest(TransactionTestCase):
+    """
+    Thousands of parallel vote, boost and subscription requests must leave
+    every counter equal to the number of rows it counts
+    """
+
+    workers = 8
+    operations = 2000
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f"user{i}", password="pass")
+            for i in range(10)
+        ]
+        self.magazine = Magazine.objects.create(name="stress", title="Stress")
+        self.threads = [
+            Thread.objects.create(
+                title=f"Thread {i}", author=self.users[0], magazine=self.magazine
+            )
+            for i in range(3)
+        ]
+
+    def run_operation(self, seed):
+        rng = random.Random(seed)
+        user = rng.choice(self.users)
+        thread = rng.choice(self.threads)
+        operation = rng.choice(
+            [
+                lambda: cast_vote(user, thread, "like"),
+                lambda: cast_vote(user, thread, "dislike"),
+                lambda: remove_vote(user, thread, "like"),
+                lambda: remove_vote(user, thread, "dislike"),
+                lambda: add_boost(user, thread),
+                lambda: remove_boost(user, thread),
+                lambda: subscribe(user, self.magazine),
+                lambda: unsubscribe(user, self.magazine),
+            ]
+        )
+        try:
+            # SQLite serializes the writers: retry while the table is locked
+            for _ in range(200):
+                try:
+                    operation()
+                    return
+                except OperationalError as error:
+                    if "locked" not in str(error):
+                        raise
+                    time.sleep(0.001)
+            raise AssertionError("Database stayed locked")
+        finally:
+            connection.close()
+
+    def test_counters_match_rows(self):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(self.run_operation, range(self.operations)))
+
+        for thread in Thread.objects.all():
+            votes = Vote.objects.filter(thread=thread)
+            self.assertEqual(
+                thread.num_likes, votes.filter(vote_type="like").count()
+            )
+            self.assertEqual(
+                thread.num_dislikes, votes.filter(vote_type="dislike").count()
+            )
+            self.assertEqual(thread.num_points, Boost.objects.filter(thread=thread).count())
+        self.magazine.refresh_from_db()
+        self.assertEqual(
+            self.magazine.subscriptions_count,
+            Subscription.objects.filter(magazine=self.magazine).count(),
+        )
+
+
+class MagazineCounterTest(TransactionTestCase):
+    """
+    The thread and comment counts of the magazines follow the creations,
+    moves and deletions of threads and comments (committed, the counters
+    are written at commit)
+    """
+
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pass")
+        self.first = Magazine.objects.create(name="first", title="First", author=self.author)
+        self.second = Magazine.objects.create(name="second", title="Second", author=self.author)
+
+    def create_thread(self, magazine, comments=2, replies=2):
+        with transaction.atomic():
+            thread = Thread.objects.create(title="Thread", author=self.author, magazine=magazine)
+            for _ in range(comments):
+                comment = Comment.objects.create(thread=thread, author=self.author, body="Comment")
+                for _ in range(replies):
+                    CommentReply.objects.create(
+                        thread=thread, parent_comment=comment, author=self.author, body="Reply"
+                    )
+        thread.refresh_from_db()
+        return thread
+
+    def assertCounts(self, magazine, threads, comments):
+        magazine.refresh_from_db()
+        self.assertEqual((magazine.threads_count, magazine.comments_count), (threads, comments))
+
+    def test_create_edit_and_move(self):
+        thread = self.create_thread(self.first)
+        self.create_thread(self.second, comments=1, replies=0)
+        self.assertEqual(thread.num_comments, 6)
+        self.assertCounts(self.first, 1, 6)
+
+        thread.title = "Edited"
+        thread.save()
+        Comment.objects.filter(thread=thread).first().save()
+        self.assertCounts(self.first, 1, 6)
+
+        thread.magazine = self.second
+        thread.save()
+        self.assertCounts(self.first, 0, 0)
+        self.assertCounts(self.second, 2, 7)
+
+    def test_deletions(self):
+        thread = self.create_thread(self.first)
+        comment = Comment.objects.top_level().filter(thread=thread).first()
+        delete_subtree(comment)
+        self.assertEqual(Thread.objects.get(pk=thread.pk).num_comments, 3)
+        self.assertCounts(self.first, 1, 3)
+
+        reply = CommentReply.objects.filter(thread=thread).first()
+        response = self.client.post(
+            f"/threads/{thread.pk}/comment/{reply.pk}/reply/{reply.parent_comment_id}/delete/"
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertCounts(self.first, 1, 2)
+
+        # The comments deleted by the cascade are not counted twice
+        Thread.objects.get(pk=thread.pk).delete()
+        self.assertCounts(self.first, 0, 0)
+
+        other = self.create_thread(self.second)
+        response = self.client.post(f"/thread/{other.pk}/delete/")
+        self.assertEqual(response.status_code, 302)
+        self.assertCounts(self.second, 0, 0)
+        self.assertFalse(Comment.objects.exists())
+
+
+class VoteServiceTest(TestCase):
+    """
+    cast_vote, remove_vote and the boosts move the counters only when a row
+    is inserted, switched or deleted
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="user", password="pass")
+        cls.other = User.objects.create_user(username="other", password="pass")
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.user)
+        cls.thread = Thread.objects.create(title="Thread", author=cls.user, magazine=magazine)
+        cls.comment = Comment.objects.create(thread=cls.thread, author=cls.user, body="Comment")
+        cls.reply = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.comment, author=cls.user, body="Reply"
+        )
+
+    def assertCounters(self, target, likes, dislikes):
+        target = type(target).objects.get(pk=target.pk)
+        self.assertEqual((target.num_likes, target.num_dislikes), (likes, dislikes))
+
+    def test_switch_and_remove(self):
+        for target in (self.thread, self.comment, self.reply):
+            with self.subTest(target=type(target).__name__):
+                vote, changed = cast_vote(self.user, target, "like")
+                self.assertTrue(changed)
+                cast_vote(self.other, target, "like")
+                self.assertCounters(target, 2, 0)
+
+                switched, changed = cast_vote(self.user, target, "dislike")
+                self.assertTrue(changed)
+                self.assertEqual(switched.pk, vote.pk)
+                self.assertCounters(target, 1, 1)
+
+                self.assertFalse(remove_vote(self.user, target, "like"))
+                self.assertCounters(target, 1, 1)
+                self.assertTrue(remove_vote(self.user, target, "dislike"))
+                self.assertTrue(remove_vote(self.other, target, "like"))
+                self.assertCounters(target, 0, 0)
+                self.assertFalse(Vote.objects.filter(user__in=[self.user, self.other]).exists())
+
+    def test_repeated_votes_are_ignored(self):
+        cast_vote(self.user, self.reply, "dislike")
+        vote, changed = cast_vote(self.user, self.reply, "dislike")
+        self.assertFalse(changed)
+        self.assertEqual(vote.vote_type, "dislike")
+        self.assertCounters(self.reply, 0, 1)
+        self.assertEqual(Vote.objects.filter(user=self.user, comment=self.reply).count(), 1)
+
+    def test_insert_or_ignore(self):
+        vote, created = insert_or_ignore(
+            Vote, defaults={"vote_type": "like"}, user=self.user, thread=self.thread
+        )
+        self.assertTrue(created)
+        # The row of a concurrent request wins, the defaults are not applied
+        duplicate, created = insert_or_ignore(
+            Vote, defaults={"vote_type": "dislike"}, user=self.user, thread=self.thread
+        )
+        self.assertFalse(created)
+        self.assertEqual((duplicate.pk, duplicate.vote_type), (vote.pk, "like"))
+        self.assertEqual(Vote.objects.filter(user=self.user, thread=self.thread).count(), 1)
+
+        # The vote was inserted without the service: its counter is not moved twice
+        _, changed = cast_vote(self.user, self.thread, "like")
+        self.assertFalse(changed)
+        self.assertCounters(self.thread, 0, 0)
+
+    def test_boosts(self):
+        self.assertTrue(add_boost(self.user, self.thread)[1])
+        self.assertFalse(add_boost(self.user, self.thread)[1])
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).num_points, 1)
+        self.assertTrue(remove_boost(self.user, self.thread))
+        self.assertFalse(remove_boost(self.user, self.thread))
+        self.assertEqual(Thread.objects.get(pk=self.thread.pk).num_points, 0)
+
+    def test_invalid_votes(self):
+        with self.assertRaises(ValueError):
+            cast_vote(self.user, self.thread, "boost")
+        with self.assertRaises(TypeError):
+            cast_vote(self.user, self.thread.magazine, "like")
+        self.assertFalse(Vote.objects.exists())
+
+
+class SeedDataCommandTest(TestCase):
+    """
+    The seed_data command writes the counters its rows imply
+    """
+
+    def seed(self, prefix):
+        call_command(
+            "seed_data",
+            users=20,
+            magazines=3,
+            threads=40,
+            max_depth=3,
+            prefix=prefix,
+            batch_size=7,
+            stdout=StringIO(),
+        )
+        return list(
+            Thread.objects.filter(magazine__name__startswith=prefix)
+            .order_by("id")
+            .values_list("title", "num_likes", "num_points", "num_comments")
+        )
+
+    def test_counters_match_rows(self):
+        self.seed("seed")
+
+        for thread in Thread.objects.all():
+            votes = Vote.objects.filter(thread=thread)
+            self.assertEqual(thread.num_likes, votes.filter(vote_type="like").count())
+            self.assertEqual(thread.num_dislikes, votes.filter(vote_type="dislike").count())
+            self.assertEqual(thread.num_points, Boost.objects.filter(thread=thread).count())
+            # The comments and their replies
+            self.assertEqual(thread.num_comments, thread.comments.count())
+        for comment in Comment.objects.all():
+            self.assertEqual(
+                comment.num_likes,
+                Vote.objects.filter(comment=comment, vote_type="like").count(),
+            )
+        for magazine in Magazine.objects.all():
+            self.assertEqual(magazine.threads_count, magazine.count_threads())
+            self.assertEqual(magazine.subscriptions_count, magazine.count_subscriptions())
+            self.assertEqual(
+                magazine.comments_count,
+                sum(magazine.threads.values_list("num_comments", flat=True)),
+            )
+        self.assertFalse(CommentReply.objects.exclude(depth=F("parent__depth") + 1))
+        self.assertFalse(CommentReply.objects.exclude(parent_comment__depth=0))
+        self.assertFalse(CommentReply.objects.filter(depth__gt=3))
+
+    def test_same_seed_same_rows(self):
+        self.assertEqual(self.seed("first"), self.seed("second"))
+
+
+class BenchmarkCommandTest(TransactionTestCase):
+    """
+    The benchmark command runs the whole mix on a small seeded dataset
+    """
+
+    def test_report(self):
+        call_command("seed_data", users=10, magazines=2, threads=20, stdout=StringIO())
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            call_command(
+                "benchmark",
+                requests=60,
+                # The in-memory test database locks whole tables
+                concurrency=1,
+                warmup=0,
+                output=output.name,
+                stdout=StringIO(),
+                stderr=StringIO(),
+            )
+            results = json.load(output)
+
+        scenarios = results["scenarios"]
+        self.assertEqual(scenarios["total"]["requests"], 60)
+        self.assertEqual(scenarios["total"]["errors"], 0)
+        for name in ("front_page", "open_thread", "comments", "search", "vote", "post_comment"):
+            self.assertIn(name, scenarios)
+            self.assertGreater(scenarios[name]["queries_per_request"], 0)
+            latency = scenarios[name]["latency_ms"]
+            self.assertLessEqual(latency["p50"], latency["p95"])
+            self.assertLessEqual(latency["p95"], latency["p99"])
+
+
+class AnonymousResponseCacheTest(TestCase):
+    """
+    The anonymous thread lists are cached until a thread or comment changes
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="pass")
+        cls.token = Token.objects.create(user=cls.author)
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.other_magazine = Magazine.objects.create(name="other", title="Other", author=cls.author)
+        cls.thread = Thread.objects.create(
+            title="Thread", body="Body", author=cls.author, magazine=cls.magazine
+        )
+
+    def setUp(self):
+        cache.clear()
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+
+    def get(self, url, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count(self, view, result):
+        return REGISTRY.values.get((CACHE_REQUESTS.name, (view, result)), 0)
+
+    def test_hit_with_the_same_params_in_any_order(self):
+        first = self.get("/api/threads/?order_by=points&filter=all")
+        with self.assertNumQueries(0):
+            second = self.get("/api/threads/?filter=all&order_by=points")
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second["Content-Type"], first["Content-Type"])
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(self.get("/api/threads/?order_by=num_comments")["X-Cache"], "MISS")
+        self.assertEqual(self.count("threads_api", "hit"), 1)
+        self.assertEqual(self.count("threads_api", "miss"), 2)
+
+    @override_settings(ALLOWED_HOSTS=["testserver", "example.com"])
+    def test_links_follow_the_host_and_scheme(self):
+        Thread.objects.create(title="Other", body="Body", author=self.author, magazine=self.magazine)
+        url = "/api/threads/?page_size=1"
+        for host, secure in (("testserver", False), ("example.com", False), ("example.com", True)):
+            with self.subTest(host=host, secure=secure):
+                response = self.get(url, HTTP_HOST=host, secure=secure)
+                self.assertEqual(response["X-Cache"], "MISS")
+                scheme = "https" if secure else "http"
+                self.assertTrue(response.json()["next"].startswith(f"{scheme}://{host}/api/threads/"))
+                self.assertEqual(self.get(url, HTTP_HOST=host, secure=secure)["X-Cache"], "HIT")
+
+    def test_token_requests_are_not_cached(self):
+        self.get("/api/threads/")
+        response = self.get("/api/threads/", HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertNotIn("X-Cache", response)
+
+    def test_new_thread_invalidates_its_magazine(self):
+        magazine_url = f"/api/magazines/{self.magazine.id}/threads/"
+        other_url = f"/api/magazines/{self.other_magazine.id}/threads/"
+        for url in ("/api/threads/", magazine_url, other_url):
+            self.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Thread.objects.create(title="New", body="Body", author=self.author, magazine=self.magazine)
+
+        response = self.get("/api/threads/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["results"]), 2)
+        self.assertEqual(self.get(magazine_url)["X-Cache"], "MISS")
+        self.assertEqual(self.get(other_url)["X-Cache"], "HIT")
+
+    def test_new_comment_invalidates_the_counts(self):
+        magazine_url = f"/api/magazines/{self.magazine.id}/threads/"
+        self.get(magazine_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(thread=self.thread, author=self.author, body="Comment")
+
+        response = self.get(magazine_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()[0]["num_comments"], 1)
+
+
+class ThreadCardCacheTest(TestCase):
+    """
+    The thread cards are cached for every viewer, the viewer part is not
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        AnonymousResponseCacheTest.setUpTestData()
+        cls.author = User.objects.get(username="author")
+        cls.viewer = User.objects.create_user(username="viewer", password="pass")
+        cls.thread = Thread.objects.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, user=None):
+        if user is None:
+            self.client.logout()
+        else:
+            self.client.force_login(user)
+        response = self.client.get("/threads/")
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_cards_are_shared_by_the_viewers(self):
+        edit_url = f"/threads_links/{self.thread.id}/edit/"
+        page = self.get_page(self.author)
+        self.assertIn(edit_url, page)
+        self.assertIn('form="thread-%d-like"' % self.thread.id, page)
+
+        # Not a save: the cached card is still valid
+        Thread.objects.filter(pk=self.thread.pk).update(title="Changed")
+        for user in (self.viewer, None):
+            page = self.get_page(user)
+            self.assertIn("Thread", page)
+            self.assertNotIn("Changed", page)
+            self.assertNotIn(edit_url, page)
+            # The forms of the buttons have the token of this viewer
+            self.assertEqual(page.count("csrfmiddlewaretoken"), 3)
+
+    def test_counters_refresh_the_card(self):
+        self.get_page(self.viewer)
+        Thread.objects.filter(pk=self.thread.pk).update(title="Changed")
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.viewer, self.thread, "like")
+        page = self.get_page(self.viewer)
+        self.assertIn("Changed", page)
+
+
+class ConditionalGetTest(TestCase):
+    """
+    The API answers If-None-Match with a 304 after loading the rows
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        AnonymousResponseCacheTest.setUpTestData()
+        cls.author = User.objects.get(username="author")
+        cls.token = Token.objects.get(user=cls.author)
+        cls.thread = Thread.objects.get()
+        cls.comment = Comment.objects.create(thread=cls.thread, author=cls.author, body="Comment")
+        cls.reply = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.comment, author=cls.author, body="Reply"
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def assertNotModified(self, url, queries, **extra):
+        response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(queries):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"], **extra)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(not_modified.content, b"")
+        return response["ETag"]
+
+    def test_thread_detail(self):
+        url = f"/api/threads/{self.thread.id}/"
+        self.assertTrue(self.client.get(url)["Last-Modified"])
+        # The lookup of the thread
+        etag = self.assertNotModified(url, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.author, self.thread, "like")
+        # And of the token
+        self.assertNotEqual(
+            self.assertNotModified(url, 2, HTTP_AUTHORIZATION=f"Token {self.token.key}"), etag
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["num_likes"], 1)
+
+    def test_comment_detail_has_its_replies(self):
+        url = f"/api/comments/{self.comment.id}/"
+        etag = self.assertNotModified(url, 2)
+        self.reply.body = "Edited"
+        self.reply.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["replies"][0]["body"], "Edited")
+
+    def test_lists(self):
+        # The thread, its version is in the cache
+        self.assertNotModified(f"/api/comments/?thread_id={self.thread.id}", 1)
+        with self.settings(COMMENT_TREE_CACHE_TIMEOUT=0):
+            # The thread, the page of comments and the levels of their replies
+            self.assertNotModified(f"/api/comments/?thread_id={self.thread.id}", 5)
+        # Magazines have no updated_at, no Last-Modified
+        self.assertNotModified("/api/magazines/", 1)
+        # Served by the anonymous response cache
+        self.assertNotModified("/api/threads/", 0)
+        with self.settings(API_CACHE_TIMEOUT=0):
+            self.assertNotModified("/api/threads/", 1)
+
+
+class ThreadSearchTest(TestCase):
+    """
+    The FTS5 index finds the threads by word, prefix and phrase, ranks
+    them with BM25 and follows the writes to threads_thread
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="pass")
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.title_match = cls.create("Learning Python", "A guide for beginners")
+        cls.body_match = cls.create("A guide", "Notes about python, written for a python thread")
+        cls.prefix_match = cls.create("Pythonic code", "Idioms")
+        cls.other = cls.create("Rust or Go", "Thread about compilers")
+
+    @classmethod
+    def create(cls, title, body):
+        return Thread.objects.create(title=title, body=body, author=cls.author, magazine=cls.magazine)
+
+    def search(self, query, order_by="created_at"):
+        return list(search_threads(query, order_by))
+
+    def test_words_prefixes_and_phrases(self):
+        self.assertCountEqual(self.search("python"), [self.title_match, self.body_match])
+        self.assertCountEqual(
+            self.search("PYTH*"), [self.title_match, self.body_match, self.prefix_match]
+        )
+        # Every word must appear, in any order
+        self.assertEqual(self.search("thread python"), [self.body_match])
+        self.assertEqual(self.search('"python thread"'), [self.body_match])
+        self.assertEqual(self.search('"thread python"'), [])
+        self.assertEqual(self.search("   "), [])
+
+    def test_ties_are_broken_by_the_id(self):
+        Thread.objects.update(created_at=timezone.now())
+        newest_first = [self.prefix_match, self.body_match, self.title_match]
+        for order_by in ("created_at", "points", "num_comments"):
+            with self.subTest(order_by=order_by):
+                self.assertEqual(self.search("pyth*", order_by), newest_first)
+
+    def test_relevance_ranks_the_title_first(self):
+        self.assertEqual(self.search("python", "relevance"), [self.title_match, self.body_match])
+
+        response = self.client.get("/api/search/", {"query": "python", "order_by": "relevance"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [thread["id"] for thread in response.json()], [self.title_match.id, self.body_match.id]
+        )
+
+    def test_operators_and_quotes_are_searched_as_text(self):
+        self.assertEqual(self.search("rust OR python"), [])
+        self.assertEqual(self.search("Rust or"), [self.other])
+        self.assertEqual(self.search("NOT python"), [])
+        self.assertEqual(self.search("title:python"), [])
+        self.assertCountEqual(self.search('"python'), [self.title_match, self.body_match])
+        self.assertCountEqual(self.search('python"'), [self.title_match, self.body_match])
+        for query in ('"', "*", "NEAR(", "-", '""" AND', "python)"):
+            with self.subTest(query=query):
+                self.search(query)
+        response = self.client.get("/api/search/", {"query": 'NEAR("python'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_the_index_follows_the_writes(self):
+        thread = self.create("Haskell", "Monads")
+        self.assertEqual(self.search("haskell"), [thread])
+
+        thread.title = "Erlang"
+        thread.save()
+        self.assertEqual(self.search("haskell"), [])
+        self.assertEqual(self.search("erlang"), [thread])
+
+        Thread.objects.filter(pk=thread.pk).update(body="Processes and actors")
+        self.assertEqual(self.search("monads"), [])
+        self.assertEqual(self.search("actors"), [thread])
+
+        # Other columns do not touch the index
+        Thread.objects.filter(pk=thread.pk).update(num_points=5)
+        self.assertEqual(self.search("erlang actors"), [thread])
+
+        thread.delete()
+        self.assertEqual(self.search("erlang"), [])
+        self.assertEqual(self.search("actors"), [])
+
+        (bulk,) = Thread.objects.bulk_create(
+            [Thread(title="Elixir", body="", author=self.author, magazine=self.magazine)]
+        )
+        self.assertEqual([thread.title for thread in self.search("elixir")], [bulk.title])
+
+
+class HotRankingTest(TestCase):
+    """
+    order_by=hot and the maintenance of Thread.hot_score
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        AnonymousResponseCacheTest.setUpTestData()
+        cls.author = User.objects.get(username="author")
+        cls.magazine = Magazine.objects.get(title="Magazine")
+        cls.thread = Thread.objects.get()
+
+    def setUp(self):
+        cache.clear()
+
+    def assertScoreIsCurrent(self, thread):
+        thread.refresh_from_db()
+        self.assertEqual(
+            thread.hot_score,
+            hot_score(
+                thread.num_likes, thread.num_dislikes, thread.num_points, thread.num_comments,
+                thread.created_at,
+            ),
+        )
+        return thread.hot_score
+
+    def test_new_thread_has_a_score(self):
+        self.assertGreater(self.assertScoreIsCurrent(self.thread), 0)
+
+    def test_newer_thread_ranks_above_older_popular_one(self):
+        old = Thread.objects.create(title="Old", body="Body", author=self.author, magazine=self.magazine)
+        Thread.objects.filter(id=old.id).update(
+            num_likes=50, created_at=timezone.now() - timedelta(days=3)
+        )
+        refresh_hot_scores([old.id])
+        new = Thread.objects.create(title="New", body="Body", author=self.author, magazine=self.magazine)
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.author, new, "like")
+
+        for url in ("/api/threads/?order_by=hot", f"/api/magazines/{self.magazine.id}/threads/?order_by=hot"):
+            with self.subTest(url):
+                response = self.client.get(url)
+                results = response.json()
+                results = results["results"] if isinstance(results, dict) else results
+                self.assertEqual([thread["id"] for thread in results], [new.id, self.thread.id, old.id])
+
+    def test_votes_boosts_and_comments_move_the_score(self):
+        score = self.assertScoreIsCurrent(self.thread)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_boost(self.author, self.thread)
+        boosted = self.assertScoreIsCurrent(self.thread)
+        self.assertGreater(boosted, score)
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.author, self.thread, "like")
+            Comment.objects.create(thread=self.thread, author=self.author, body="Comment")
+        self.assertGreater(self.assertScoreIsCurrent(self.thread), boosted)
+        self.assertEqual(self.thread.num_comments, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            remove_vote(self.author, self.thread, "like")
+            remove_boost(self.author, self.thread)
+        self.assertLess(self.assertScoreIsCurrent(self.thread), boosted)
+
+    def test_command_repairs_the_scores(self):
+        Thread.objects.update(num_likes=10, hot_score=0)
+        output = StringIO()
+        call_command("refresh_hot_scores", stdout=output)
+        self.assertEqual(output.getvalue().strip(), "1 hot scores updated.")
+        self.assertScoreIsCurrent(self.thread)
+        output = StringIO()
+        call_command("refresh_hot_scores", "--batch-size", "1", stdout=output)
+        self.assertEqual(output.getvalue().strip(), "0 hot scores updated.")
+
+
+class PeriodRankingTest(TestCase):
+    """
+    period=day|week|month|all and the maintenance of the PeriodScore rows
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        AnonymousResponseCacheTest.setUpTestData()
+        cls.author = User.objects.get(username="author")
+        cls.voter = User.objects.create_user(username="voter", password="password")
+        cls.magazine = Magazine.objects.get(title="Magazine")
+        cls.thread = Thread.objects.get()
+        cls.old = Thread.objects.create(title="Old", body="Body", author=cls.author, magazine=cls.magazine)
+        cast_vote(cls.author, cls.old, "like")
+        cast_vote(cls.voter, cls.old, "like")
+        # Created 10 days ago, before the next rollup
+        ten_days_ago = timezone.now() - timedelta(days=10)
+        Thread.objects.filter(id=cls.old.id).update(created_at=ten_days_ago)
+        PeriodScore.objects.filter(thread=cls.old).update(created_at=ten_days_ago)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_scores(self, thread):
+        return dict(PeriodScore.objects.filter(thread=thread).values_list("period", "score"))
+
+    def test_top_of_the_period(self):
+        for url in ("/api/threads/", f"/api/magazines/{self.magazine.id}/threads/"):
+            with self.subTest(url):
+                results = self.client.get(url, {"period": "week"}).json()
+                results = results["results"] if isinstance(results, dict) else results
+                self.assertEqual([thread["id"] for thread in results], [self.thread.id])
+                results = self.client.get(url, {"period": "all", "order_by": "created_at"}).json()
+                results = results["results"] if isinstance(results, dict) else results
+                self.assertEqual([thread["id"] for thread in results], [self.old.id, self.thread.id])
+
+        response = self.client.get("/api/threads/", {"period": "all", "page_size": 1})
+        self.assertEqual([thread["id"] for thread in response.json()["results"]], [self.old.id])
+        response = self.client.get(response.json()["next"])
+        self.assertEqual([thread["id"] for thread in response.json()["results"]], [self.thread.id])
+
+        page = self.client.get("/threads/", {"period": "week"}).content.decode()
+        self.assertIn(self.thread.title, page)
+        self.assertNotIn(self.old.title, page)
+
+    def test_votes_and_boosts_move_every_period(self):
+        self.assertEqual(self.get_scores(self.thread), {"day": 0, "week": 0, "month": 0, "all": 0})
+        self.assertEqual(self.get_scores(self.old), {"day": 2, "week": 2, "month": 2, "all": 2})
+        add_boost(self.voter, self.thread)
+        cast_vote(self.voter, self.thread, "dislike")
+        self.assertEqual(set(self.get_scores(self.thread).values()), {1})
+        cast_vote(self.voter, self.thread, "like")
+        remove_boost(self.voter, self.thread)
+        self.assertEqual(set(self.get_scores(self.thread).values()), {1})
+
+    def test_moved_thread_moves_its_scores(self):
+        self.thread.magazine = Magazine.objects.get(title="Other")
+        self.thread.save()
+        self.assertEqual(
+            set(PeriodScore.objects.filter(thread=self.thread).values_list("magazine__title", flat=True)),
+            {"Other"},
+        )
+
+    def test_rollup_expires_and_repairs(self):
+        PeriodScore.objects.filter(thread=self.thread, period="week").update(score=7)
+        output = StringIO()
+        call_command("rollup_period_scores", stdout=output)
+        # The day and week rows of the old thread, the drifted week score
+        self.assertEqual(output.getvalue().strip(), "2 expired and 1 updated period scores.")
+        self.assertEqual(self.get_scores(self.old), {"month": 2, "all": 2})
+        self.assertEqual(self.get_scores(self.thread)["week"], 0)
+
+        PeriodScore.objects.filter(thread=self.thread, period="all").delete()
+        output = StringIO()
+        call_command("rollup_period_scores", "--period", "all", stdout=output)
+        self.assertEqual(output.getvalue().strip(), "0 expired and 1 updated period scores.")
+        self.assertEqual(self.get_scores(self.thread)["all"], 0)
+
+
+class SubscribedFeedTest(TestCase):
+    """
+    filter=subscribed from the feed entries (fan-out on write) or merged
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        cls.viewer = User.objects.create_user(username="viewer", password="password")
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.magazines = [
+            Magazine.objects.create(name=f"magazine{i}", title=f"Magazine {i}", author=cls.author)
+            for i in range(3)
+        ]
+        cls.threads = [
+            Thread.objects.create(
+                title=f"Thread {i}", body="Body", author=cls.author, magazine=cls.magazines[i % 3]
+            )
+            for i in range(6)
+        ]
+        subscribe(cls.viewer, cls.magazines[0])
+        subscribe(cls.viewer, cls.magazines[1])
+
+    def setUp(self):
+        cache.clear()
+
+    def get_feed(self, **params):
+        """
+        Return the ids of every page of the feed of the viewer
+        """
+        response = self.client.get(
+            "/api/threads/", {"filter": "subscribed", **params}, HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        ids = []
+        while True:
+            ids += [thread["id"] for thread in response.json()["results"]]
+            if not response.json()["next"]:
+                return ids
+            response = self.client.get(response.json()["next"], HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def expected(self):
+        magazine_ids = Subscription.objects.filter(user=self.viewer).values("magazine_id")
+        return list(
+            Thread.objects.filter(magazine_id__in=magazine_ids).order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+
+    def test_feed_is_built_on_the_first_read(self):
+        self.assertFalse(Feed.objects.filter(user=self.viewer).exists())
+        self.assertEqual(self.get_feed(), self.expected())
+        self.assertEqual(FeedEntry.objects.filter(user=self.viewer).count(), 4)
+        self.assertEqual(self.get_feed(order_by="points"), self.expected())
+        self.assertEqual(self.client.get("/api/threads/", {"filter": "subscribed"}).json()["results"], [])
+
+        self.client.force_login(self.viewer)
+        page = self.client.get("/threads/", {"filter": "subscribed"}).content.decode()
+        self.assertIn("Thread 0", page)
+        self.assertNotIn("Thread 2", page)
+
+    def test_writes_follow(self):
+        self.get_feed()
+        thread = Thread.objects.create(title="New", body="Body", author=self.author, magazine=self.magazines[0])
+        self.assertTrue(FeedEntry.objects.filter(user=self.viewer, thread=thread).exists())
+        unsubscribe(self.viewer, self.magazines[1])
+        subscribe(self.viewer, self.magazines[2])
+        self.assertEqual(
+            set(FeedEntry.objects.filter(user=self.viewer).values_list("magazine_id", flat=True)),
+            {self.magazines[0].id, self.magazines[2].id},
+        )
+        thread.magazine = self.magazines[1]
+        thread.save()
+        self.assertFalse(FeedEntry.objects.filter(thread=thread).exists())
+        self.assertEqual(self.get_feed(), self.expected())
+
+    def test_pages_past_the_horizon_are_merged(self):
+        with self.settings(FEED_BACKFILL=2):
+            self.assertEqual(self.get_feed(page_size=1), self.expected())
+            feed = Feed.objects.get(user=self.viewer)
+            self.assertIsNotNone(feed.horizon_created_at)
+            self.assertEqual(FeedEntry.objects.filter(user=self.viewer).count(), 2)
+            self.assertEqual(self.get_feed(page_size=1), self.expected())
+
+            for payload in ('{"v": null, "pk": 1, "r": true}', '{"v": [], "pk": 1, "r": false}'):
+                with self.subTest(payload=payload):
+                    response = self.client.get(
+                        "/api/threads/",
+                        {"filter": "subscribed", "cursor": base64.urlsafe_b64encode(payload.encode()).decode()},
+                        HTTP_AUTHORIZATION=f"Token {self.token.key}",
+                    )
+                    self.assertEqual(response.status_code, 404)
+
+    def test_many_subscriptions_are_merged(self):
+        self.get_feed()
+        with self.settings(FEED_FANOUT_MAX_SUBSCRIPTIONS=2):
+            subscribe(self.viewer, self.magazines[2])
+            self.assertFalse(Feed.objects.filter(user=self.viewer).exists())
+            self.assertFalse(FeedEntry.objects.filter(user=self.viewer).exists())
+            self.assertEqual(self.get_feed(), self.expected())
+            self.assertFalse(Feed.objects.filter(user=self.viewer).exists())
+
+
+class ProfileActivityTest(TestCase):
+    """
+    The comments and replies of a profile, merged and paginated by the database
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        thread = Thread.objects.create(title="Thread", body="Body", author=cls.author, magazine=magazine)
+        comments = [
+            Comment.objects.create(thread=thread, author=cls.author, body=f"Comment {i}") for i in range(5)
+        ]
+        for i in range(6):
+            CommentReply.objects.create(
+                thread=thread, parent_comment=comments[i % 5], author=cls.author, body=f"Reply {i}"
+            )
+        # Ties in created_at and num_likes, between comments and replies
+        now = timezone.now()
+        Comment.objects.filter(body__in=["Comment 0", "Comment 1", "Reply 0", "Reply 1"]).update(
+            created_at=now, num_likes=2
+        )
+
+    def expected(self, order_by):
+        rows = list(Comment.objects.all())
+        if order_by == "likes":
+            key = lambda row: (row.num_likes, row.created_at, row.id)
+        else:
+            key = lambda row: (row.created_at, row.id)
+        rows.sort(key=key, reverse=order_by != "oldest")
+        return [obj.body for obj in rows]
+
+    def walk(self, order_by):
+        """
+        Return the bodies of every page of the API, forwards then backwards
+        """
+        response = self.client.get(
+            f"/api/profile/{self.author.id}/comments/", {"order_by": order_by, "page_size": 3}
+        )
+        pages = []
+        while True:
+            pages.append([comment["body"] for comment in response.json()["results"]])
+            if not response.json()["next"]:
+                break
+            response = self.client.get(response.json()["next"])
+        backwards = [pages[-1]]
+        while response.json()["previous"]:
+            response = self.client.get(response.json()["previous"])
+            backwards.insert(0, [comment["body"] for comment in response.json()["results"]])
+        return pages, backwards
+
+    def test_orders(self):
+        for order_by in ("oldest", "newest", "likes"):
+            with self.subTest(order_by=order_by):
+                pages, backwards = self.walk(order_by)
+                self.assertEqual(sum(pages, []), self.expected(order_by))
+                self.assertEqual(backwards, pages)
+
+    def test_missing_and_unknown_orders_are_newest(self):
+        thread = Thread.objects.get()
+        for path, params in (
+            (f"/api/profile/{self.author.id}/comments/", {}),
+            ("/api/comments/", {"thread_id": thread.id}),
+        ):
+            newest = self.client.get(path, {**params, "order_by": "newest"}).json()["results"]
+            self.assertNotEqual(newest, self.client.get(path, {**params, "order_by": "oldest"}).json()["results"])
+            for order_by in (None, "created_at", "unknown"):
+                with self.subTest(path=path, order_by=order_by):
+                    query = {**params, "order_by": order_by} if order_by else params
+                    self.assertEqual(self.client.get(path, query).json()["results"], newest)
+
+    def test_replies_and_pages(self):
+        response = self.client.get(f"/api/profile/{self.author.id}/comments/", {"order_by": "newest"})
+        self.assertEqual(len(response.json()["results"]), 11)
+        reply = next(row for row in response.json()["results"] if row["body"] == "Reply 0")
+        self.assertEqual(reply["thread_id"], Thread.objects.get().id)
+        self.assertEqual(
+            self.client.get(f"/api/profile/{self.author.id}/comments/", {"cursor": "nope"}).status_code, 404
+        )
+
+        page = self.client.get(f"/profile/{self.author.id}/comments", {"order_by": "newest"})
+        self.assertContains(page, "Reply 0")
+        self.assertEqual(page.context["comments_count"], 11)
+        self.assertEqual(self.client.get(f"/profile/{self.author.id}/comments", {"cursor": "nope"}).status_code, 404)
+
+    def test_malformed_cursors(self):
+        now = '"2024-01-01T00:00:00+00:00"'
+        payloads = {
+            "oldest": [
+                '{"v": [null], "pk": 1, "r": false}',
+                '{"v": null, "pk": 1, "r": false}',
+                f'{{"v": {now}, "pk": 1, "r": false}}',
+                '{"v": ["yesterday"], "pk": 1, "r": false}',
+                '{"v": [[]], "pk": 1, "r": false}',
+                f'{{"v": [{now}], "pk": 1e400, "r": false}}',
+                f'{{"v": [{now}], "pk": "1", "r": false}}',
+            ],
+            "likes": [
+                f'{{"v": [null, {now}], "pk": 1, "r": false}}',
+                f'{{"v": [1e400, {now}], "pk": 1, "r": false}}',
+                f'{{"v": [100000000000000000000, {now}], "pk": 1, "r": false}}',
+                f'{{"v": [1], "pk": 1, "r": false}}',
+            ],
+        }
+        paths = [
+            (f"/api/profile/{self.author.id}/comments/", {}),
+            ("/api/comments/", {"thread_id": Thread.objects.get().id}),
+            (f"/profile/{self.author.id}/comments", {}),
+        ]
+        for order_by, cursors in payloads.items():
+            for payload in cursors:
+                cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+                for path, params in paths:
+                    with self.subTest(path=path, order_by=order_by, payload=payload):
+                        response = self.client.get(path, {**params, "order_by": order_by, "cursor": cursor})
+                        self.assertEqual(response.status_code, 404)
+
+
+class UnifiedCommentTest(TestCase):
+    """
+    Comments and replies are rows of one table, with the API of the two old ones
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        cls.token = Token.objects.create(user=cls.author)
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.thread = Thread.objects.create(title="Thread", body="Body", author=cls.author, magazine=magazine)
+
+    def post_comment(self, **data):
+        response = self.client.post(
+            "/api/comments/",
+            {"thread": self.thread.id, "body": "Body", **data},
+            HTTP_AUTHORIZATION=f"Token {self.token.key}",
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+    def test_tree(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            comment = self.post_comment()
+            reply = self.post_comment(parent_comment=comment["id"])
+            nested = self.post_comment(parent_comment=comment["id"], parent_reply=reply["id"])
+        self.assertEqual(reply["parent_reply"], None)
+        self.assertEqual(nested["parent_reply"], reply["id"])
+
+        self.assertEqual(
+            list(self.thread.comments.order_by("id").values_list("depth", "parent_id", "parent_comment_id")),
+            [(0, None, None), (1, comment["id"], comment["id"]), (2, reply["id"], comment["id"])],
+        )
+        self.assertEqual(Thread.objects.get().num_comments, 3)
+        detail = self.client.get(f"/api/replies/{nested['id']}/").json()
+        self.assertEqual(
+            (detail["parent_comment"], detail["parent_reply"], detail["reply_level"]),
+            (comment["id"], reply["id"], 2),
+        )
+        # A reply is not a comment of the thread
+        self.assertEqual(self.client.get(f"/api/comments/{reply['id']}/").status_code, 404)
+        self.assertEqual(self.client.get(f"/api/replies/{comment['id']}/").status_code, 404)
+        tree = self.client.get("/api/comments/", {"thread_id": self.thread.id}).json()["results"]
+        self.assertEqual([row["id"] for row in tree], [comment["id"]])
+        self.assertEqual([row["id"] for row in tree[0]["replies"]], [reply["id"], nested["id"]])
+
+        like = self.client.post(
+            f"/api/replies/{nested['id']}/likes/", HTTP_AUTHORIZATION=f"Token {self.token.key}"
+        )
+        self.assertEqual(like.json()["reply"], nested["id"])
+        self.assertEqual(Vote.objects.get().comment_id, nested["id"])
+
+        # The replies and their votes go with the comment
+        Comment.objects.get(id=comment["id"]).delete()
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Vote.objects.exists())
+
+    def test_merge_comment_replies(self):
+        comment = Comment.objects.create(thread=self.thread, author=self.author, body="Comment")
+        with connection.cursor() as cursor:
+            # The old replies table, and the reply column of the votes
+            cursor.execute(
+                """
+                CREATE TABLE threads_commentreply (
+                    id integer NOT NULL PRIMARY KEY AUTOINCREMENT, author_id integer NULL,
+                    thread_id integer NOT NULL, parent_comment_id integer NOT NULL,
+                    parent_reply_id integer NULL, body text NOT NULL, magazine_id integer NULL,
+                    created_at datetime NOT NULL, updated_at datetime NOT NULL,
+                    num_likes integer NOT NULL, num_dislikes integer NOT NULL,
+                    num_replies integer NOT NULL, reply_level integer unsigned NOT NULL
+                )
+                """
+            )
+            cursor.execute("ALTER TABLE threads_vote ADD COLUMN reply_id integer NULL")
+            now = timezone.now().isoformat()
+            cursor.executemany(
+                "INSERT INTO threads_commentreply VALUES (%s, %s, %s, %s, %s, %s, NULL, %s, %s, %s, 0, 0, %s)",
+                [
+                    (1, self.author.id, self.thread.id, comment.id, None, "Reply", now, now, 1, 1),
+                    (2, self.author.id, self.thread.id, comment.id, 1, "Nested", now, now, 0, 2),
+                ],
+            )
+            cursor.execute(
+                "INSERT INTO threads_vote (user_id, vote_type, reply_id) VALUES (%s, 'like', 2)",
+                [self.author.id],
+            )
+
+        call_command("merge_comment_replies", stdout=StringIO())
+        call_command("merge_comment_replies", stdout=StringIO())
+
+        # offset: the largest id of both tables
+        reply, nested = CommentReply.objects.order_by("id")
+        self.assertEqual((reply.id, nested.id), (3, 4))
+        self.assertEqual((reply.legacy_reply_id, reply.parent_id, reply.reply_level), (1, comment.id, 1))
+        self.assertEqual((nested.parent_reply, nested.parent_comment, nested.reply_level), (reply, comment, 2))
+        self.assertEqual(list(Comment.objects.subtree(comment).order_by("path")), [comment, reply, nested])
+        self.assertEqual(Vote.objects.get().comment, nested)
+        # The old ids still work in the API
+        self.assertEqual(self.client.get("/api/replies/2/").json()["id"], nested.id)
+        self.assertEqual(self.client.get(f"/api/replies/{nested.id}/").json()["body"], "Nested")
+        # New rows are numbered after them
+        self.assertGreater(
+            Comment.objects.create(thread=self.thread, author=self.author, body="New").id, nested.id
+        )
+
+
+class CommentPathTest(TestCase):
+    """
+    The materialized paths of the comments: display order, subtrees and ancestors
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        cls.thread = Thread.objects.create(title="Thread", author=cls.author)
+        cls.first = Comment.objects.create(thread=cls.thread, author=cls.author, body="first")
+        cls.second = Comment.objects.create(thread=cls.thread, author=cls.author, body="second")
+        cls.reply = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.first, author=cls.author, body="reply"
+        )
+        CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.second, author=cls.author, body="other reply"
+        )
+        cls.nested = CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.first, parent_reply=cls.reply, author=cls.author, body="nested"
+        )
+        CommentReply.objects.create(
+            thread=cls.thread, parent_comment=cls.first, author=cls.author, body="last reply"
+        )
+        Vote.objects.create(user=cls.author, comment=cls.nested, vote_type="like")
+
+    def bodies(self, queryset):
+        return list(queryset.order_by("path").values_list("body", flat=True))
+
+    def test_paths(self):
+        self.assertEqual(
+            self.nested.path, "".join(get_path_step(node.id) for node in (self.first, self.reply, self.nested))
+        )
+        self.assertEqual(
+            self.bodies(Comment.objects.filter(thread=self.thread)),
+            ["first", "reply", "nested", "last reply", "second", "other reply"],
+        )
+        self.assertEqual(self.bodies(Comment.objects.subtree(self.reply)), ["reply", "nested"])
+        self.assertEqual(self.bodies(Comment.objects.ancestors(self.nested)), ["first", "reply"])
+        self.assertEqual(self.bodies(Comment.objects.ancestors(self.first)), [])
+
+        paths = list(Comment.objects.order_by("id").values_list("path", flat=True))
+        Comment.objects.update(path="")
+        self.assertEqual(rebuild_paths(), 6)
+        self.assertEqual(list(Comment.objects.order_by("id").values_list("path", flat=True)), paths)
+
+    def test_delete_subtree(self):
+        num_comments = Thread.objects.get().num_comments
+        # One DELETE for the votes and one for the comments, in a savepoint
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(4):
+            self.assertEqual(delete_subtree(self.reply), 2)
+        self.assertEqual(self.bodies(Comment.objects.all()), ["first", "last reply", "second", "other reply"])
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(Thread.objects.get().num_comments, num_comments - 2)
+
+
+class CommentTreePageTest(TestCase):
+    """
+    The paginated comment trees: a page of comments, a window of replies per
+    comment and the more_replies cursors of the rest
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.thread = Thread.objects.create(title="Thread", author=cls.author, magazine=cls.magazine)
+        cls.first = cls.add("first")
+        cls.reply = cls.add("reply", cls.first)
+        cls.nested = cls.add("nested", cls.reply)
+        cls.deepest = cls.add("deepest", cls.nested)
+        cls.second_reply = cls.add("second reply", cls.first)
+        cls.third_reply = cls.add("third reply", cls.first)
+        cls.second = cls.add("second")
+
+    @classmethod
+    def add(cls, body, parent=None):
+        return Comment.objects.create(thread=cls.thread, author=cls.author, body=body, parent=parent)
+
+    def bodies(self, nodes):
+        return [node.body for node in nodes]
+
+    def test_window(self):
+        comments = ThreadComments(Thread.objects.select_related("magazine").get(), "oldest", breadth=2, depth=2)
+        with self.assertNumQueries(5):
+            # The page, its comments and a query per level
+            page = comments.page(page_size=1)
+        self.assertEqual(self.bodies(page), ["first"])
+        first = page.object_list[0]
+        self.assertEqual(self.bodies(first.replies), ["reply", "nested", "second reply"])
+        # The third reply is past the breadth, the deepest reply past the depth
+        self.assertEqual(decode_replies_cursor(first.more_replies), (self.first.id, self.second_reply.path))
+        nested = first.replies[1]
+        self.assertEqual(decode_replies_cursor(nested.more_replies), (self.nested.id, ""))
+        self.assertEqual([reply.more_replies for reply in (first.replies[0], first.replies[2])], [None, None])
+        self.assertEqual(self.bodies(first.hidden_replies), ["third reply", "deepest"])
+
+        page = comments.page(page.next_cursor, page_size=1)
+        self.assertEqual(self.bodies(page), ["second"])
+        self.assertEqual((page.object_list[0].replies, page.object_list[0].more_replies), ([], None))
+        self.assertFalse(page.has_next())
+
+    def test_more_replies(self):
+        comments = ThreadComments(Thread.objects.get(), "oldest", breadth=2, depth=2)
+        first = comments.page(page_size=1).object_list[0]
+        replies = NodeReplies(breadth=2, depth=2)
+        page = replies.page(first.more_replies)
+        self.assertEqual(replies.node, self.first)
+        self.assertEqual(self.bodies(page), ["third reply"])
+        self.assertFalse(page.has_next())
+
+        page = replies.page(encode_replies_cursor(self.first), page_size=1)
+        self.assertEqual(self.bodies(page), ["reply"])
+        self.assertEqual(self.bodies(page.object_list[0].replies), ["nested"])
+        self.assertEqual(self.bodies(replies.page(page.next_cursor, page_size=1)), ["second reply"])
+
+        page = replies.page(first.replies[1].more_replies)
+        self.assertEqual(self.bodies(page), ["deepest"])
+        for cursor in (None, "invalid", encode_replies_cursor(Comment(id=0))):
+            with self.assertRaises(InvalidCursor):
+                replies.page(cursor)
+
+    def test_api(self):
+        with self.settings(COMMENT_TREE_BREADTH=2, COMMENT_TREE_DEPTH=2):
+            response = self.client.get(
+                "/api/comments/", {"thread_id": self.thread.id, "order_by": "newest", "page_size": 1}
+            )
+            data = response.json()
+            self.assertEqual([comment["body"] for comment in data["results"]], ["second"])
+            response = self.client.get(data["next"])
+            first = response.json()["results"][0]
+            self.assertEqual(
+                [reply["body"] for reply in first["replies"]], ["reply", "nested", "second reply"]
+            )
+            self.assertEqual(first["replies"][1]["parent_reply"], self.reply.id)
+
+            response = self.client.get("/api/comments/replies/", {"cursor": first["more_replies"]})
+            self.assertEqual(response.status_code, 200)
+            replies = response.json()
+            self.assertEqual([reply["body"] for reply in replies["results"]], ["third reply"])
+            self.assertEqual(replies["results"][0]["replies"], [])
+            self.assertIsNone(replies["next"])
+        self.assertEqual(self.client.get("/api/comments/replies/", {"cursor": "invalid"}).status_code, 404)
+
+    def test_html(self):
+        with self.settings(COMMENT_TREE_BREADTH=2, COMMENT_TREE_DEPTH=2):
+            response = self.client.get(f"/thread/{self.thread.id}/", {"order_by": "oldest"})
+            self.assertEqual(self.bodies(response.context["comments"]), ["first", "second"])
+            more_replies = response.context["comments"][0].more_replies
+            self.assertContains(response, f"/thread/{self.thread.id}/replies/?cursor={more_replies}")
+
+            response = self.client.get(f"/thread/{self.thread.id}/replies/", {"cursor": more_replies})
+            self.assertEqual(self.bodies(response.context["replies"]), ["third reply"])
+            self.assertContains(response, "third reply")
+        other = Thread.objects.create(title="Other", author=self.author)
+        response = self.client.get(f"/thread/{other.id}/replies/", {"cursor": more_replies})
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentTreeCacheTest(TestCase):
+    """
+    The pages of the comment trees are cached per thread version, the votes
+    of the viewer are filled in at read time
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username="author", password="password")
+        cls.viewer = User.objects.create_user(username="viewer", password="password")
+        cls.token = Token.objects.create(user=cls.viewer)
+        cls.magazine = Magazine.objects.create(name="magazine", title="Magazine", author=cls.author)
+        cls.other_magazine = Magazine.objects.create(name="other", title="Other", author=cls.author)
+        cls.thread = Thread.objects.create(title="Thread", author=cls.author, magazine=cls.magazine)
+        cls.comment = Comment.objects.create(thread=cls.thread, author=cls.author, body="comment")
+        cls.reply = Comment.objects.create(
+            thread=cls.thread, author=cls.author, body="reply", parent=cls.comment
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.url = f"/api/comments/?thread_id={self.thread.id}"
+
+    def get(self, queries=None, user=None):
+        extra = {"HTTP_AUTHORIZATION": f"Token {self.token.key}"} if user else {}
+        if queries is None:
+            response = self.client.get(self.url, **extra)
+        else:
+            with self.assertNumQueries(queries):
+                response = self.client.get(self.url, **extra)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_hit(self):
+        results = self.get()
+        # The thread
+        self.assertEqual(self.get(1), results)
+        self.assertEqual(results[0]["replies"][0]["user_has_liked"], None)
+        # And the token and the votes of the viewer
+        results = self.get(3, user=self.viewer)
+        self.assertEqual(results[0]["user_has_liked"], False)
+        with self.settings(COMMENT_TREE_CACHE_TIMEOUT=0):
+            self.assertEqual(self.get(user=self.viewer), results)
+
+    def test_votes_are_overlaid(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.viewer, self.reply, "like")
+        # The counters moved, a miss
+        reply = self.get()[0]["replies"][0]
+        self.assertEqual((reply["num_likes"], reply["user_has_liked"]), (1, None))
+        reply = self.get(3, user=self.viewer)[0]["replies"][0]
+        self.assertEqual((reply["user_has_liked"], reply["user_has_disliked"]), (True, False))
+        self.assertIsNone(self.get(1)[0]["replies"][0]["user_has_liked"])
+
+    def test_changes_invalidate_the_thread(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.comment.body = "edited"
+            self.comment.save()
+        self.assertEqual(self.get()[0]["body"], "edited")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(thread=self.thread, author=self.author, body="new", parent=self.reply)
+        self.assertEqual([reply["body"] for reply in self.get()[0]["replies"]], ["reply", "new"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_subtree(self.reply)
+        self.assertEqual(self.get()[0]["replies"], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thread.magazine = self.other_magazine
+            self.thread.save()
+        self.assertEqual(self.get()[0]["magazine"]["name"], "other")
+
+    def test_other_threads_are_kept(self):
+        other = Thread.objects.create(title="Other", author=self.author, magazine=self.magazine)
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(thread=other, author=self.author, body="comment")
+        self.get(1)
+
+    def test_etag(self):
+        response = self.client.get(self.url)
+        # The thread and its version
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        viewer = self.client.get(self.url, HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.assertNotEqual(viewer["ETag"], response["ETag"])
+        with self.captureOnCommitCallbacks(execute=True):
+            cast_vote(self.author, self.comment, "dislike")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["results"][0]["num_dislikes"], 1)
+
+
+class QueryPlanTest(TestCase):
+    """
+    The hot queries use the Meta indexes
+    """
+
+    def test_hot_queries_use_an_index(self):
+        for name, queryset in get_hot_queries():
+            with self.subTest(name):
+                plan = explain(queryset)
+                self.assertEqual(find_plan_problems(plan), [], plan)
+
+
+class SyncSchemaCommandTest(TransactionTestCase):
+    """
+    sync_schema adds the columns and Meta indexes an existing table is missing
+    """
+
+    def test_missing_column_and_index_are_created(self):
+        field = Thread._meta.get_field("hot_score")
+        index = next(index for index in Thread._meta.indexes if index.name == "thread_points_idx")
+        hot_indexes = [
+            hot_index
+            for hot_index in Thread._meta.indexes
+            if any(name.lstrip("-") == "hot_score" for name in hot_index.fields)
+        ]
+        # The schema editor of SQLite can not run in the transaction of a TestCase
+        with connection.schema_editor() as editor:
+            for hot_index in hot_indexes:
+                editor.remove_index(Thread, hot_index)
+            editor.remove_field(Thread, field)
+            editor.remove_index(Thread, index)
+        self.addCleanup(call_command, "sync_schema", stdout=StringIO())
+
+        output = StringIO()
+        call_command("sync_schema", "--dry-run", stdout=output)
+        self.assertIn("Missing column hot_score on threads_thread", output.getvalue())
+        self.assertIn("Missing index thread_points_idx on threads_thread", output.getvalue())
+
+        output = StringIO()
+        call_command("sync_schema", "--check", stdout=output)
+        self.assertIn("Creating column hot_score", output.getvalue())
+        self.assertNotIn("The schema is up to date.", output.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, "threads_thread")
+        self.assertIn("thread_points_idx", constraints)
+        self.assertIn("thread_hot_idx", constraints)
+
+    def test_search_triggers_survive_the_rebuild(self):
+        old = Thread.objects.create(title="Quokka before the sync")
+        field = Thread._meta.get_field("hot_score")
+        with connection.schema_editor() as editor:
+            for index in Thread._meta.indexes:
+                if any(name.lstrip("-") == "hot_score" for name in index.fields):
+                    editor.remove_index(Thread, index)
+            editor.remove_field(Thread, field)
+        self.addCleanup(call_command, "sync_schema", stdout=StringIO())
+
+        output = StringIO()
+        call_command("sync_schema", stdout=output)
+        # Adding the column rebuilds the table and drops its triggers (SQLite)
+        self.assertIn("Creating column hot_score", output.getvalue())
+        self.assertIn("Creating triggers threads_thread_fts_ai", output.getvalue())
+        self.assertEqual(find_missing_search_triggers(), [])
+
+        new = Thread.objects.create(title="Wombat after the sync")
+        self.assertEqual(list(search_threads("wombat")), [new])
+        self.assertEqual(list(search_threads("quokka")), [old])
+        Thread.objects.filter(pk=old.pk).update(title="Numbat after the sync")
+        self.assertEqual(list(search_threads("quokka")), [])
+        self.assertEqual(list(search_threads("numbat")), [old])
+        new.delete()
+        self.assertEqual(list(search_threads("wombat")), [])
+
+    def test_several_rebuilding_columns(self):
+        thread = Thread.objects.create(title="Thread")
+        comments = [Comment.objects.create(thread=thread, body=f"Comment {i}") for i in range(2)]
+        # Both columns are added by rebuilding the table (SQLite)
+        with connection.schema_editor() as editor:
+            editor.remove_field(Comment, Comment._meta.get_field("legacy_reply_id"))
+            for index in Comment._meta.indexes:
+                editor.remove_index(Comment, index)
+            editor.execute("ALTER TABLE threads_comment DROP COLUMN depth")
+        self.addCleanup(call_command, "sync_schema", stdout=StringIO())
+
+        output = StringIO()
+        call_command("sync_schema", "--check", stdout=output)
+        self.assertIn("Creating column legacy_reply_id", output.getvalue())
+        self.assertEqual(
+            list(Comment.objects.order_by("id").values_list("body", "depth", "legacy_reply_id")),
+            [(comment.body, 0, None) for comment in comments],
+        )
+
+    def test_missing_index_is_created(self):
+        index = next(index for index in Thread._meta.indexes if index.name == "thread_points_idx")
+        with connection.schema_editor() as editor:
+            editor.remove_index(Thread, index)
+        self.addCleanup(call_command, "sync_schema", stdout=StringIO())
+
+        output = StringIO()
+        call_command("sync_schema", stdout=output)
+        self.assertIn("Creating index thread_points_idx on threads_thread", output.getvalue())
+
+        output = StringIO()
+        call_command("sync_schema", stdout=output)
+        self.assertEqual(output.getvalue().strip(), "The schema is up to date.")
+
+
+class ThreadsQueryBudgetTest(QueryBudgetTestCase):
+    """
+    SQL queries per request of the threads.urls endpoints
+    """
+
+    urlconf = "threads.urls"
+
+    # HTML
+
+    def test_home(self):
+        self.assertQueryBudget(7, "/", status=200)
+        self.assertQueryBudget(6, "/", user=self.viewer, status=200)
+
+    def test_thread_list(self):
+        for query in ("", "?order_by=points", "?order_by=num_comments&filter=links"):
+            self.assertQueryBudget(6, f"/threads/{query}", status=200)
+            self.assertQueryBudget(6, f"/threads/{query}", user=self.viewer, status=200)
+
+    def test_link_create(self):
+        self.assertQueryBudget(0, "/new_link/", status=302)
+        self.assertQueryBudget(3, "/new_link/", user=self.viewer, status=200)
+        self.assertQueryBudget(
+            8,
+            "/new_link/",
+            "post",
+            user=self.viewer,
+            status=302,
+            data={"title": "Link", "url": "https://example.com", "body": "", "magazine": self.magazine.id},
+        )
+
+    def test_thread_create(self):
+        self.assertQueryBudget(0, "/new_thread/", status=302)
+        self.assertQueryBudget(3, "/new_thread/", user=self.viewer, status=200)
+        self.assertQueryBudget(
+            8,
+            "/new_thread/",
+            "post",
+            user=self.viewer,
+            status=302,
+            data={"title": "Thread", "body": "Body", "magazine": self.magazine.id},
+        )
+
+    def test_thread_link_edit(self):
+        path = f"/threads_links/{self.thread.id}/edit/"
+        self.assertQueryBudget(2, path, status=404)
+        self.assertQueryBudget(7, path, user=self.author, status=200)
+        self.assertQueryBudget(
+            8, path, "post", user=self.author, status=302, data={"title": "Edited", "body": "Body"}
+        )
+
+    def test_thread_link_delete(self):
+        self.assertQueryBudget(
+            19, f"/thread/{self.thread.id}/delete/", "post", user=self.author, status=302
+        )
+
+    def test_thread_vote(self):
+        path = f"/thread/{self.thread.id}/vote/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        for vote_type in ("like", "dislike", "dislike"):
+            self.assertQueryBudget(
+                16,
+                path,
+                "post",
+                user=self.viewer,
+                status=302,
+                data={"thread_id": self.thread.id, "vote_type": vote_type},
+            )
+
+    def test_search(self):
+        self.assertQueryBudget(1, "/search/", status=200)
+        self.assertQueryBudget(2, "/search/", user=self.viewer, status=200)
+
+    def test_search_results(self):
+        for query in ("?q=python", "?q=pyth*&order_by=points"):
+            self.assertQueryBudget(2, f"/search/results/{query}", status=200)
+            self.assertQueryBudget(3, f"/search/results/{query}", user=self.viewer, status=200)
+
+    def test_thread_boost(self):
+        path = f"/thread/{self.thread.id}/boost/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        for _ in range(2):
+            self.assertQueryBudget(
+                15, path, "post", user=self.viewer, status=302, data={"thread_id": self.thread.id}
+            )
+
+    def test_thread_detail(self):
+        for query in ("", "?order_by=points", "?order_by=oldest"):
+            self.assertQueryBudget(13, f"/thread/{self.thread.id}/{query}", status=200)
+            self.assertQueryBudget(
+                12, f"/thread/{self.thread.id}/{query}", user=self.viewer, status=200
+            )
+
+    def test_create_comment(self):
+        path = f"/thread/{self.thread.id}/comment/create/"
+        self.assertQueryBudget(0, path, status=302)
+        self.assertQueryBudget(9, path, user=self.viewer, status=200)
+        self.assertQueryBudget(10, path, "post", user=self.viewer, status=302, data={"body": "New"})
+
+    def test_more_replies(self):
+        path = f"/thread/{self.thread.id}/replies/?cursor={encode_replies_cursor(self.comment)}"
+        self.assertQueryBudget(7, path, status=200)
+        self.assertQueryBudget(7, path, user=self.viewer, status=200)
+        self.assertQueryBudget(0, f"/thread/{self.thread.id}/replies/?cursor=invalid", status=404)
+
+    def test_comment_vote(self):
+        path = f"/comment/{self.comment.id}/vote/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        for vote_type in ("like", "dislike", "dislike"):
+            self.assertQueryBudget(
+                11,
+                path,
+                "post",
+                user=self.viewer,
+                status=302,
+                data={"comment_id": self.comment.id, "vote_type": vote_type},
+                HTTP_REFERER="/",
+            )
+
+    def test_comment_edit(self):
+        path = f"/threads/{self.thread.id}/comment/{self.comment.id}/edit/"
+        self.assertQueryBudget(2, path, status=404)
+        self.assertQueryBudget(7, path, user=self.author, status=200)
+        self.assertQueryBudget(6, path, "post", user=self.author, status=302, data={"body": "Edited"})
+
+    def test_comment_delete(self):
+        self.assertQueryBudget(
+            16, f"/comment/{self.comment.id}/delete/{self.thread.id}/", "post", user=self.author, status=302
+        )
+
+    def test_reply_comment(self):
+        for path in (
+            f"/threads/{self.thread.id}/comment/{self.comment.id}/reply/",
+            f"/threads/{self.thread.id}/comment/{self.comment.id}/reply/{self.reply.id}/",
+        ):
+            self.assertQueryBudget(0, path, status=302)
+            self.assertQueryBudget(3, path, user=self.viewer, status=200)
+            self.assertQueryBudget(12, path, "post", user=self.viewer, status=302, data={"body": "Reply"})
+
+    def test_reply_vote(self):
+        path = f"/reply/{self.reply.id}/vote/"
+        self.assertQueryBudget(0, path, "post", status=302)
+        for vote_type in ("like", "dislike", "dislike"):
+            self.assertQueryBudget(
+                13,
+                path,
+                "post",
+                user=self.viewer,
+                status=302,
+                data={"reply_id": self.reply.id, "vote_type": vote_type},
+                HTTP_REFERER="/",
+            )
+
+    def test_reply_edit(self):
+        path = f"/threads/{self.thread.id}/comment/{self.reply.id}/reply/{self.reply.id}/edit/"
+        self.assertQueryBudget(4, path, user=self.author, status=200)
+        self.assertQueryBudget(2, path, "post", user=self.author, status=302, data={"body": "Edited"})
+
+    def test_reply_delete(self):
+        self.assertQueryBudget(
+            14,
+            f"/threads/{self.thread.id}/comment/{self.reply.id}/reply/{self.reply.id}/delete/",
+            "post",
+            user=self.author,
+            status=302,
+        )
+
+    def test_magazine_threads_list(self):
+        for query in ("", "?order_by=points", "?filter=threads"):
+            self.assertQueryBudget(9, f"/magazine/{self.magazine.id}/{query}", status=200)
+            self.assertQueryBudget(
+                10, f"/magazine/{self.magazine.id}/{query}", user=self.viewer, status=200
+            )
+
+    # API
+
+    def test_threads_api(self):
+        for query in ("", "?order_by=points", "?order_by=num_comments&filter=threads"):
+            self.assertQueryBudget(1, f"/api/threads/{query}", status=200)
+            self.assertQueryBudget(3, f"/api/threads/{query}", user=self.viewer, status=200)
+        next_page = self.assertQueryBudget(1, "/api/threads/", status=200).json()["next"]
+        self.assertQueryBudget(3, next_page, user=self.viewer, status=200)
+        self.assertQueryBudget(
+            6,
+            "/api/threads/",
+            "post",
+            user=self.viewer,
+            status=201,
+            data={"title": "New", "body": "Body", "magazine": self.magazine.id},
+        )
+
+    def test_thread_detail_api(self):
+        path = f"/api/threads/{self.thread.id}/"
+        self.assertQueryBudget(3, path, status=200)
+        self.assertQueryBudget(5, path, user=self.viewer, status=200)
+        self.assertQueryBudget(5, path, "patch", user=self.author, status=200, data={"title": "Edited"})
+        self.assertQueryBudget(21, path, "delete", user=self.author, status=204)
+
+    def test_thread_boost_api(self):
+        path = f"/api/threads/{self.threads[1].id}/boosts/"
+        self.assertQueryBudget(0, path, "post", status=401)
+        self.assertQueryBudget(11, path, "post", user=self.viewer, status=201)
+        self.assertQueryBudget(9, path, "post", user=self.viewer, status=409)
+        self.assertQueryBudget(9, path, "delete", user=self.viewer, status=204)
+
+    def test_thread_like_api(self):
+        path = f"/api/threads/{self.thread.id}/likes/"
+        self.assertQueryBudget(0, path, "post", status=401)
+        self.assertQueryBudget(9, path, "delete", user=self.viewer, status=204)
+        self.assertQueryBudget(12, path, "post", user=self.viewer, status=201)
+        self.assertQueryBudget(10, path, "post", user=self.viewer, status=409)
+
+    def test_thread_dislike_api(self):
+        path = f"/api/threads/{self.thread.id}/dislikes/"
+        self.assertQueryBudget(10, path, "post", user=self.viewer, status=201)
+        self.assertQueryBudget(9, path, "delete", user=self.viewer, status=204)
+
+    def test_comments_api(self):
+        for order_by in ("oldest", "newest", "likes"):
+            path = f"/api/comments/?thread_id={self.thread.id}&order_by={order_by}"
+            self.assertQueryBudget(6, path, status=200)
+            self.assertQueryBudget(9, path, user=self.viewer, status=200)
+        self.assertQueryBudget(
+            10,
+            "/api/comments/",
+            "post",
+            user=self.viewer,
+            status=201,
+            data={"thread": self.thread.id, "body": "New"},
+        )
+
+    def test_comment_replies_api(self):
+        path = f"/api/comments/replies/?cursor={encode_replies_cursor(self.comment)}"
+        self.assertQueryBudget(4, path, status=200)
+        self.assertQueryBudget(6, path, user=self.viewer, status=200)
+
+    def test_comment_detail_api(self):
+        path = f"/api/comments/{self.comment.id}/"
+        self.assertQueryBudget(5, path, status=200)
+        self.assertQueryBudget(8, path, user=self.viewer, status=200)
+        self.assertQueryBudget(5, path, "patch", user=self.author, status=200, data={"body": "Edited"})
+        self.assertQueryBudget(19, path, "delete", user=self.author, status=204)
+
+    def test_comment_like_api(self):
+        path = f"/api/comments/{self.comment.id}/likes/"
+        self.assertQueryBudget(7, path, "post", user=self.viewer, status=201)
+        self.assertQueryBudget(6, path, "delete", user=self.viewer, status=204)
+
+    def test_comment_dislike_api(self):
+        path = f"/api/comments/{self.comment.id}/dislikes/"
+        self.assertQueryBudget(10, path, "post", user=self.viewer, status=409)
+        self.assertQueryBudget(6, path, "delete", user=self.viewer, status=204)
+
+    def test_replies_detail_api(self):
+        path = f"/api/replies/{self.reply.id}/"
+        self.assertQueryBudget(4, path, status=200)
+        self.assertQueryBudget(5, path, user=self.viewer, status=200)
+        self.assertQueryBudget(3, path, "patch", user=self.author, status=403, data={"body": "Edited"})
+        self.assertQueryBudget(17, path, "delete", user=self.viewer, status=204)
+
+    def test_reply_like_api(self):
+        path = f"/api/replies/{self.reply.id}/likes/"
+        self.assertQueryBudget(10, path, "post", user=self.viewer, status=409)
+        self.assertQueryBudget(6, path, "delete", user=self.viewer, status=204)
+
+    def test_reply_dislike_api(self):
+        path = f"/api/replies/{self.reply.id}/dislikes/"
+        self.assertQueryBudget(7, path, "post", user=self.viewer, status=201)
+        self.assertQueryBudget(6, path, "delete", user=self.viewer, status=204)
+
+    def test_search_results_api(self):
+        for query in ("query=python", "query=pyth*&order_by=relevance", 'query="python thread"'):
+            self.assertQueryBudget(1, f"/api/search/?{query}", status=200)
+            self.assertQueryBudget(3, f"/api/search/?{query}", user=self.viewer, status=200)
@@ -0,0 +1,116 @@
+"""
+    This module contains the cache of the comment trees of the API
+
+    A page of CommentsAPIView (threads.comment_pages) is the same for every
+    viewer but for the user_has_* fields. It is serialized once without a
+    viewer and cached under the version of its thread ("thread:<id>", see
+    threads.response_cache), the votes of the viewer are filled in at read
+    time with one query.
+
+    The version of a thread moves when one of its comments or replies is
+    created, edited or deleted (threads.signals), when the vote counters of
+    one of them move (threads.votes) and when the thread is saved, which
+    may change its magazine. The ETag of a page is its key plus the viewer,
+    a 304 only needs the thread and the version.
+"""
+
+import hashlib
+from itertools import chain
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+
+from .conditional import get_last_modified, set_validators
+from .models import Vote
+from .pagination import KeysetPage
+from .response_cache import get_versions, thread_scope
+
+
+def get_tree_cache_timeout():
+    return getattr(settings, "COMMENT_TREE_CACHE_TIMEOUT", 0)
+
+
+def get_tree_cache_key(thread_id, params):
+    """
+    Return the key of a page of the comment tree of a thread, for the
+    current version of the thread
+    """
+    query = urlencode(sorted((name, sorted(values)) for name, values in params.lists()), doseq=True)
+    (version,) = get_versions([thread_scope(thread_id)])
+    return f"comment-tree:{thread_id}:{version}:{hashlib.sha1(query.encode()).hexdigest()}"
+
+
+def get_tree_etag(request, key):
+    viewer = request.user.pk if request.user.is_authenticated else None
+    return '"%s"' % hashlib.sha1(repr([viewer, key]).encode()).hexdigest()[:32]
+
+
+def overlay_viewer_votes(comments, user):
+    """
+    Fill the user_has_liked and user_has_disliked fields of serialized
+    comments and their replies with the votes of the user
+    """
+    nodes = [node for comment in comments for node in (comment, *comment["replies"])]
+    votes = dict(
+        Vote.objects.filter(  # pylint: disable=no-member
+            user=user, comment_id__in=[node["id"] for node in nodes]
+        ).values_list("comment_id", "vote_type")
+    )
+    for node in nodes:
+        vote_type = votes.get(node["id"])
+        node["user_has_liked"] = vote_type == "like"
+        node["user_has_disliked"] = vote_type == "dislike"
+    return comments
+
+
+class CommentTreeCacheMixin:
+    """
+    list() of CommentsAPIView from the cached pages of the tree of its thread
+
+    The view provides get_thread() and a paginator with KeysetPage pages.
+    """
+
+    def list(self, request, *args, **kwargs):
+        timeout = get_tree_cache_timeout()
+        if not timeout:
+            return super().list(request, *args, **kwargs)
+
+        key = get_tree_cache_key(self.get_thread().id, request.query_params)
+        etag = get_tree_etag(request, key)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return set_validators(not_modified, etag, None)
+
+        entry = cache.get(key)
+        if entry is None:
+            entry = self.build_tree_entry()
+            cache.set(key, entry, timeout)
+        else:
+            # The links of the page are built from this request
+            self.paginator.base_url = request.build_absolute_uri()
+            self.paginator.page = KeysetPage(entry["results"], entry["next"], entry["previous"])
+
+        results = entry["results"]
+        if request.user.is_authenticated:
+            overlay_viewer_votes(results, request.user)
+        response = self.get_paginated_response(results)
+        return set_validators(response, etag, entry["last_modified"])
+
+    def build_tree_entry(self):
+        """
+        Return the cache entry of the page: its comments serialized without
+        a viewer, the cursors of its neighbour pages and its Last-Modified
+        """
+        page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+        context = {**self.get_serializer_context(), "user": None}
+        serializer = self.get_serializer_class()(page, many=True, context=context)
+        return {
+            "results": list(serializer.data),
+            "next": self.paginator.page.next_cursor,
+            "previous": self.paginator.page.previous_cursor,
+            "last_modified": get_last_modified(
+                list(chain.from_iterable(map(self.get_version_objects, page)))
+            ),
+        }
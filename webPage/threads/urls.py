@@ -39,6 +39,11 @@ urlpatterns = [
     path("search/results/", views.SearchResultsView.as_view(), name="search_results"),
     path("thread/<int:pk>/boost/", views.boost_thread, name="thread_boost"),
     path("thread/<int:pk>/", views.ThreadDetailView.as_view(), name="thread_detail"),
+    path(
+        "thread/<int:thread_id>/replies/",
+        views.MoreRepliesView.as_view(),
+        name="more_replies",
+    ),
     path(
         "thread/<int:thread_id>/comment/create/",
         views.CreateComment.as_view(),
@@ -102,6 +107,11 @@ urlpatterns += [
     ),
     
     path("api/comments/", apis.CommentsAPIView.as_view(), name="comments_api"),
+    path(
+        "api/comments/replies/",
+        apis.CommentRepliesAPIView.as_view(),
+        name="comment_replies_api",
+    ),
     path(
         "api/comments/<int:comment_id>/",
         apis.CommentDetailAPIView.as_view(),
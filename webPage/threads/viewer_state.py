@@ -0,0 +1,151 @@
+"""
+    This module contains the viewer-state preloader for the serializers
+
+    The authenticated user's votes and subscriptions are fetched once
+    per page (one query per relation) and kept in the serializer context, so
+    the user_has_* fields become dictionary lookups instead of per-row queries.
+"""
+
+from django.db.models.manager import BaseManager
+from rest_framework import serializers
+from magazine.models import Magazine, Subscription
+from .models import Thread, Comment, Vote
+
+
+class ViewerState:
+    """
+    Votes and subscriptions of one user for the objects being serialized
+    """
+
+    def __init__(self, user):
+        self.user = user
+        # {"thread": {thread_id: "like"}, ...}
+        self.votes = {"thread": {}, "comment": {}}
+        self.subscriptions = set()
+        # Object ids already looked up, voted or not
+        self.loaded = {
+            "thread": set(),
+            "comment": set(),
+            "subscription": set(),
+        }
+        # Comments whose replies (every level) had their votes loaded in bulk
+        self.loaded_reply_parents = set()
+
+    def _missing(self, kind, objects):
+        ids = {obj.id for obj in objects} - self.loaded[kind]
+        self.loaded[kind] |= ids
+        return ids
+
+    def _load_votes(self, kind, ids):
+        if ids:
+            self.votes[kind].update(
+                Vote.objects.filter(  # pylint: disable=no-member
+                    user=self.user, **{f"{kind}_id__in": ids}
+                ).values_list(f"{kind}_id", "vote_type")
+            )
+
+    def preload_threads(self, threads):
+        """
+        Load the votes of the user for a list of threads
+        """
+        self._load_votes("thread", self._missing("thread", threads))
+
+    def preload_comments(self, comments):
+        """
+        Load the votes of the user for a list of comments or replies, with
+        every reply of the trees of the comments and the replies attached
+        to the replies by prefetch_replies()
+        """
+        parent_ids = {comment.id for comment in comments if not comment.depth}
+        parent_ids -= self.loaded_reply_parents
+        if parent_ids:
+            self.loaded_reply_parents |= parent_ids
+            self.votes["comment"].update(
+                Vote.objects.filter(  # pylint: disable=no-member
+                    user=self.user, comment__parent_comment_id__in=parent_ids
+                ).values_list("comment_id", "vote_type")
+            )
+        nodes = [
+            node
+            for comment in comments
+            for node in (comment, *(getattr(comment, "replies", ()) if comment.depth else ()))
+            if node.parent_comment_id not in self.loaded_reply_parents
+        ]
+        self._load_votes("comment", self._missing("comment", nodes))
+
+    def preload_magazines(self, magazines):
+        """
+        Load the subscriptions of the user for a list of magazines
+        """
+        ids = self._missing("subscription", magazines)
+        if ids:
+            self.subscriptions.update(
+                Subscription.objects.filter(
+                    user=self.user, magazine_id__in=ids
+                ).values_list("magazine_id", flat=True)
+            )
+
+    def preload(self, objects):
+        """
+        Load the state of the user for a list of objects, one load per model
+        """
+        loaders = {
+            Thread: self.preload_threads,
+            Comment: self.preload_comments,
+            Magazine: self.preload_magazines,
+        }
+        by_model = {}
+        for obj in objects:
+            # Comments and replies share the table and the votes
+            by_model.setdefault(obj._meta.concrete_model, []).append(obj)  # pylint: disable=protected-access
+        for model, group in by_model.items():
+            loader = loaders.get(model)
+            if loader is not None:
+                loader(group)
+
+    def vote_type(self, kind, obj):
+        """
+        Return "like", "dislike" or None for the vote of the user on an object
+        """
+        loaded = obj.id in self.loaded[kind] or (
+            kind == "comment" and obj.parent_comment_id in self.loaded_reply_parents
+        )
+        if not loaded:
+            # Single object (detail views): fall back to a lookup
+            self._load_votes(kind, self._missing(kind, [obj]))
+        return self.votes[kind].get(obj.id)
+
+    def has_subscribed(self, magazine):
+        """
+        Return True if the user is subscribed to the magazine
+        """
+        if magazine.id not in self.loaded["subscription"]:
+            self.preload_magazines([magazine])
+        return magazine.id in self.subscriptions
+
+
+def get_viewer_state(context):
+    """
+    Return the ViewerState shared through a serializer context, None if anonymous
+    """
+    user = context.get("user")
+    if user is None:
+        return None
+    state = context.get("viewer_state")
+    if state is None or state.user != user:
+        state = context["viewer_state"] = ViewerState(user)
+    return state
+
+
+class ViewerStateListSerializer(serializers.ListSerializer):
+    """
+    ListSerializer that preloads the viewer state of the whole list at once
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, BaseManager) else data
+        objects = list(iterable)
+        state = get_viewer_state(self.context)
+        if state is not None:
+            state.preload(objects)
+        return super().to_representation(objects)
@@ -5,6 +5,7 @@
 from django.http import Http404, HttpResponseRedirect
 from django.views.generic import (
     ListView,
+    TemplateView,
     CreateView,
     UpdateView,
     DeleteView,
@@ -12,8 +13,14 @@ from django.views.generic import (
 )
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
-from django.core.exceptions import ObjectDoesNotExist
-from .models import Thread, Magazine, Vote, User, Boost, Comment, CommentReply
+from .models import Thread, Magazine, Comment, CommentReply
+from .pagination import InvalidCursor, paginate_keyset
+from .feed import subscribed_threads
+from .ranking import PERIODS, order_by_period
+from .votes import VOTE_TYPES, toggle_vote, toggle_boost
+from .search import search_threads
+from .comment_pages import NodeReplies, ThreadComments
+from .comment_tree import delete_subtree
 from .forms import (
     ThreadForm,
     LinkForm,
@@ -41,9 +48,23 @@ class ThreadListView(ListView):
     model = Thread
     template_name = "threads/thread_list.html"
     context_object_name = "threads"
+    paginate_by = 25
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Keyset pagination driven by the "cursor" query param instead of page numbers
+        """
+        try:
+            page = paginate_keyset(
+                queryset, cursor=self.request.GET.get("cursor"), page_size=page_size
+            )
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        return (None, page, page.object_list, page.has_other_pages())
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # Author and magazine are shown in every card
+        queryset = super().get_queryset().select_related("author", "magazine")
         # Get the query param "filter" from the HTTP request
         # If no query param, the default value is "all"
         filter_option = self.request.GET.get("filter", "all")
@@ -56,14 +77,29 @@ class ThreadListView(ListView):
 
         # Query param
         order_by = self.request.GET.get("order_by", "created_at")
+        period = self.request.GET.get("period")
 
         # Order the queryset based on the query param
-        if order_by == "points":
-            queryset = queryset.order_by("-num_points")
+        # "id" is the tie-breaker that keeps the cursor pagination stable
+        if period in PERIODS:
+            queryset = order_by_period(queryset, period)
+        elif order_by == "points":
+            queryset = queryset.order_by("-num_points", "-id")
         elif order_by == "num_comments":
-            queryset = queryset.order_by("-num_comments")
+            queryset = queryset.order_by("-num_comments", "-id")
+        elif order_by == "hot":
+            queryset = queryset.order_by("-hot_score", "-id")
         else:
-            queryset = queryset.order_by("-created_at")  # Order by most recent
+            queryset = queryset.order_by("-created_at", "-id")  # Order by most recent
+
+        # After the ordering: the most recent first is read from the feed
+        if filter_option == "subscribed":
+            queryset = subscribed_threads(
+                queryset,
+                self.request.user,
+                cursor=self.request.GET.get("cursor"),
+                page_size=self.get_paginate_by(queryset),
+            )
 
         # Save the filter and order_by values in the user session
         self.request.session["filter"] = filter_option
@@ -81,10 +117,37 @@ class ThreadListView(ListView):
 
         context["active_filter"] = filter_option
         context["active_order"] = order_by
+        context["active_period"] = self.request.GET.get("period")
+        context["periods"] = list(PERIODS)
+        context["next_cursor"] = context["page_obj"].next_cursor
+        context["prev_cursor"] = context["page_obj"].previous_cursor
 
         return context
 
 
+# Comments per page of a thread, with their first replies (threads.comment_pages)
+THREAD_COMMENTS_PAGE_SIZE = 25
+
+
+def get_comment_page_context(request, thread, order_by):
+    """
+    Return the page of comments of the thread after the "cursor" query
+    param, each one with its first replies, and the cursors of its
+    neighbour pages
+    """
+    try:
+        page = ThreadComments(thread, order_by).page(
+            request.GET.get("cursor"), THREAD_COMMENTS_PAGE_SIZE
+        )
+    except InvalidCursor:
+        raise Http404("Invalid cursor")
+    return {
+        "comments": page.object_list,
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.previous_cursor,
+    }
+
+
 class ThreadDetailView(DetailView):
     """
     View for displaying the details of a specific thread
@@ -94,7 +157,8 @@ class ThreadDetailView(DetailView):
     template_name = "threads/specific_thread.html"
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        # The magazine is shared by the comments of the page
+        queryset = super().get_queryset().select_related("magazine")
 
         # Query param
         order_by = self.request.GET.get("order_by", "newest")
@@ -113,25 +177,41 @@ class ThreadDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        thread = self.get_object()
-        thread_id = self.kwargs["pk"]
+        thread = self.object
         order_by = self.request.GET.get("order_by", "newest")
 
-        comments = Comment.objects.filter(thread_id=thread_id)
-        if order_by == "points":
-            comments = comments.order_by("-num_likes", "-created_at")
-        elif order_by == "newest":
-            comments = comments.order_by("-created_at")
-        else:
-            comments = comments.order_by("created_at")
-
-        context["comments"] = comments
+        context.update(get_comment_page_context(self.request, thread, order_by))
         context["magazine"] = thread.magazine
         context["active_order"] = order_by
 
         return context
 
 
+class MoreRepliesView(TemplateView):
+    """
+    View for the replies a comment tree does not show, from the
+    more_replies cursor of a comment or reply
+    """
+
+    template_name = "threads/more_replies.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        replies = NodeReplies()
+        try:
+            page = replies.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404("Invalid cursor")
+        if replies.node.thread_id != self.kwargs["thread_id"]:
+            raise Http404("Invalid cursor")
+
+        context["thread"] = replies.node.thread
+        context["node"] = replies.node
+        context["replies"] = page.object_list
+        context["next_cursor"] = page.next_cursor
+        return context
+
+
 @method_decorator(login_required, name="dispatch")
 class CreateThread(CreateView):
     """
@@ -298,45 +378,11 @@ def vote_thread(request, pk):  # pylint: disable=unused-argument
     if request.method == "POST":
         thread_id = request.POST.get("thread_id")
         vote_type = request.POST.get("vote_type")
-        user = User.objects.get(
-            id=request.user.id
-        )  # request.user (Add this when login is implemented)
-        thread = Thread.objects.get(id=thread_id)  # pylint: disable=no-member
-
-        # Check if the user has already voted this thread
-        existing_vote = None
-        try:
-            existing_vote = Vote.objects.get(  # pylint: disable=no-member
-                user=user, thread=thread
-            )
-        except ObjectDoesNotExist:
-            # If the user has not voted previously, create a new vote
-            Vote.objects.create(  # pylint: disable=no-member
-                user=user, thread=thread, vote_type=vote_type
-            )
+        thread = get_object_or_404(Thread, id=thread_id)
 
-        if existing_vote:  # Any object is considered True
-            if existing_vote.vote_type == vote_type:
-                # If the user votes the same as their previous vote, delete the vote
-                existing_vote.delete()
-            else:
-                # If the user changes their vote, update the existing vote
-                existing_vote.vote_type = vote_type
-                existing_vote.save()
-
-        # Update likes and dislikes counts
-        likes = Vote.objects.filter(  # pylint: disable=no-member
-            thread=thread, vote_type="like"
-        ).count()
-        dislikes = Vote.objects.filter(  # pylint: disable=no-member
-            thread=thread, vote_type="dislike"
-        ).count()
-
-        # Update thread with the num_likes and num_dislikes without updating the updated_at field
-        Thread.objects.filter(id=thread_id).update(  # pylint: disable=no-member
-            num_likes=likes,
-            num_dislikes=dislikes,
-        )
+        # Create, switch or remove (same vote twice) the vote of the user
+        if vote_type in VOTE_TYPES:
+            toggle_vote(request.user, thread, vote_type)
 
         # Redirect back to the previous page it comes from or to a default page ("thread_list")
         return redirect(request.META.get("HTTP_REFERER", "thread_list"))
@@ -348,34 +394,8 @@ def boost_thread(request, pk):  # pylint: disable=unused-argument
     View for boosting a specific thread
     """
     if request.method == "POST":
-        thread_id = request.POST.get("thread_id")
-        user = User.objects.get(id=request.user.id)  # pylint: disable=no-member
-        thread = Thread.objects.get(id=thread_id)  # pylint: disable=no-member
-
-        # Check if the user has already boosted this thread
-        existing_boost = None
-        try:
-            existing_boost = Boost.objects.get(  # pylint: disable=no-member
-                user=user, thread=thread
-            )
-        except ObjectDoesNotExist:
-            # If the user has not boosted previously, create a new Boost
-            Boost.objects.create(  # pylint: disable=no-member
-                user=user,
-                thread=thread,
-            )
-            # Update the thread with the num_likes without updating the updated_at field
-            Thread.objects.filter(id=thread_id).update(  # pylint: disable=no-member
-                num_points=thread.num_points + 1,
-            )
-
-        if existing_boost:  # Any object is considered True
-            # If the user has already boosted the thread, delete the Boost
-            existing_boost.delete()
-            # Update the thread with the num_likes without updating the updated_at field
-            Thread.objects.filter(id=thread_id).update(  # pylint: disable=no-member
-                num_points=thread.num_points - 1,
-            )
+        thread = get_object_or_404(Thread, id=request.POST.get("thread_id"))
+        toggle_boost(request.user, thread)
 
         # Redirect back to the previous page it comes from or to a default page ("thread_list")
         return redirect(request.META.get("HTTP_REFERER", "thread_list"))
@@ -396,7 +416,7 @@ class CommentListView(ListView):
     context_object_name = "comments"
 
     def get_queryset(self):
-        queryset = super().get_queryset()
+        queryset = super().get_queryset().top_level()
 
         # Query param
         order_by = self.request.GET.get("order_by", "created_at")
@@ -447,30 +467,10 @@ class CreateComment(CreateView):  # LoginRequiredMixin
             "thread_id"
         ]  # Obtener el ID del thread de los parámetros de la URL
         order_by = self.request.GET.get("order_by", "newest")
-        comments = Comment.objects.filter(
-            thread_id=thread_id
-        )  # Obtén todos los comentarios
-
-        for comment in comments:
-            # Obtener todas las respuestas asociadas a este comentario
-            replies = CommentReply.objects.filter(parent_comment=comment)
-            comment.comment_replies.set(replies)
-            for reply in replies:
-                # Obtener las subrespuestas del comentario original
-                subreplies = CommentReply.objects.filter(
-                    parent_comment=comment, parent_reply=reply
-                )
-                reply.reply_replies.set(subreplies)
-
-        if order_by == "points":
-            comments = comments.order_by("-num_likes", "-created_at")
-        elif order_by == "newest":
-            comments = comments.order_by("-created_at")
-        else:
-            comments = comments.order_by("created_at")
-
-        context["comments"] = comments
-        context["thread"] = Thread.objects.get(id=thread_id)
+        thread = get_object_or_404(Thread.objects.select_related("magazine"), id=thread_id)
+        # Obtén los comentarios con sus primeras respuestas
+        context.update(get_comment_page_context(self.request, thread, order_by))
+        context["thread"] = thread
         context["active_order"] = order_by
         return context
 
@@ -524,7 +524,18 @@ class UpdateComment(UpdateView):
         return reverse_lazy("thread_detail", kwargs={"pk": self.object.thread_id})
 
 
-class DeleteComment(DeleteView):
+class SubtreeDeleteMixin:
+    """
+    Delete the comment or reply with its replies in one statement
+    """
+
+    def form_valid(self, form):
+        success_url = self.get_success_url()
+        delete_subtree(self.object)
+        return HttpResponseRedirect(success_url)
+
+
+class DeleteComment(SubtreeDeleteMixin, DeleteView):
     """
     View for deleting a specific comment
     """
@@ -544,39 +555,11 @@ def vote_comment(request, pk):  # pylint: disable=unused-argument
     if request.method == "POST":
         comment_id = request.POST.get("comment_id")
         vote_type = request.POST.get("vote_type")
-        user = User.objects.get(
-            id=request.user.id
-        )  # request.user (Add this when login is implemented)
-        comment = Comment.objects.get(id=comment_id)
+        comment = get_object_or_404(Comment, id=comment_id)
 
-        # Check if the user has already voted this comment
-        existing_vote = None
-        try:
-            existing_vote = Vote.objects.get(user=user, comment=comment)
-        except ObjectDoesNotExist:
-            # If the user has not voted previously, create a new vote
-            Vote.objects.create(  # pylint: disable=no-member
-                user=user, comment=comment, vote_type=vote_type
-            )
-
-        if existing_vote:  # Any object is considered True
-            if existing_vote.vote_type == vote_type:
-                # If the user votes the same as their previous vote, delete the vote
-                existing_vote.delete()
-            else:
-                # If the user changes their vote, update the existing vote
-                existing_vote.vote_type = vote_type
-                existing_vote.save()
-
-        # Update likes and dislikes counts
-        likes = Vote.objects.filter(comment=comment, vote_type="like").count()
-        dislikes = Vote.objects.filter(comment=comment, vote_type="dislike").count()
-
-        # Update comment with the num_likes and num_dislikes without updating the updated_at field
-        Comment.objects.filter(id=comment_id).update(
-            num_likes=likes,
-            num_dislikes=dislikes,
-        )
+        # Create, switch or remove (same vote twice) the vote of the user
+        if vote_type in VOTE_TYPES:
+            toggle_vote(request.user, comment, vote_type)
 
         # Redirect back to the previous page it comes from or to a default page ("thread_list")
         return redirect(request.META.get("HTTP_REFERER", "specific_thread"))
@@ -592,7 +575,7 @@ class ReplyCommentView(CreateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         comment_id = self.kwargs.get("pk")  # Aquí se corrige 'comment_id' por 'pk'
-        parent_comment = get_object_or_404(Comment, pk=comment_id)
+        parent_comment = get_object_or_404(Comment.objects.top_level(), pk=comment_id)
         context["parent_comment"] = parent_comment
         replies = CommentReply.objects.filter(parent_comment=parent_comment)
         context["replies"] = replies
@@ -607,7 +590,7 @@ class ReplyCommentView(CreateView):
 
         parent_reply_id = self.kwargs.get("parent_reply_id")  # Nuevo
 
-        parent_comment = get_object_or_404(Comment, pk=parent_comment_id)
+        parent_comment = get_object_or_404(Comment.objects.top_level(), pk=parent_comment_id)
 
         if parent_reply_id:
             parent_reply = get_object_or_404(CommentReply, pk=parent_reply_id)
@@ -649,7 +632,7 @@ class UpdateReply(UpdateView):
         return reverse_lazy("thread_detail", kwargs={"pk": thread_id})
 
 
-class DeleteReply(DeleteView):
+class DeleteReply(SubtreeDeleteMixin, DeleteView):
     """
     View for deleting a specific reply
     """
@@ -669,45 +652,11 @@ def vote_reply(request, pk):  # pylint: disable=unused-argument
     if request.method == "POST":
         reply_id = request.POST.get("reply_id")
         vote_type = request.POST.get("vote_type")
-        user = User.objects.get(
-            id=request.user.id
-        )  # request.user (Add this when login is implemented)
-        reply = CommentReply.objects.get(id=reply_id)  # pylint: disable=no-member
+        reply = get_object_or_404(CommentReply, id=reply_id)
 
-        # Check if the user has already voted this reply
-        existing_vote = None
-        try:
-            existing_vote = Vote.objects.get(  # pylint: disable=no-member
-                user=user, reply=reply
-            )
-        except ObjectDoesNotExist:
-            # If the user has not voted previously, create a new vote
-            Vote.objects.create(  # pylint: disable=no-member
-                user=user, reply=reply, vote_type=vote_type
-            )
-
-        if existing_vote:  # Any object is considered True
-            if existing_vote.vote_type == vote_type:
-                # If the user votes the same as their previous vote, delete the vote
-                existing_vote.delete()
-            else:
-                # If the user changes their vote, update the existing vote
-                existing_vote.vote_type = vote_type
-                existing_vote.save()
-
-        # Update likes and dislikes counts
-        likes = Vote.objects.filter(  # pylint: disable=no-member
-            reply=reply, vote_type="like"
-        ).count()
-        dislikes = Vote.objects.filter(  # pylint: disable=no-member
-            reply=reply, vote_type="dislike"
-        ).count()
-
-        # Update reply with the num_likes and num_dislikes without updating the updated_at field
-        CommentReply.objects.filter(id=reply_id).update(  # pylint: disable=no-member
-            num_likes=likes,
-            num_dislikes=dislikes,
-        )
+        # Create, switch or remove (same vote twice) the vote of the user
+        if vote_type in VOTE_TYPES:
+            toggle_vote(request.user, reply, vote_type)
 
         # Redirect back to the previous page it comes from or to a default page
         return redirect(request.META.get("HTTP_REFERER", "specific_thread"))
@@ -737,10 +686,9 @@ class SearchResultsView(ListView):
         if not query.strip():
             return Thread.objects.none()
         else:
-            threads = Thread.objects.filter(
-                title__icontains=query
-            ) | Thread.objects.filter(body__icontains=query)
-            return threads
+            # Most relevant first unless another order is asked for
+            order_by = self.request.GET.get("order_by", "relevance")
+            return search_threads(query, order_by).select_related("author", "magazine")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
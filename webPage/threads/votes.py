@@ -0,0 +1,181 @@
+"""
+    This module contains the vote service shared by the API and HTML views
+
+    Likes and dislikes of threads, comments and replies (and boosts) are
+    written here, and the num_likes / num_dislikes / num_points counters move
+    by atomic deltas in the same transaction instead of being recounted. The
+    hot and top of the period scores of a thread follow (threads.ranking).
+
+    The unique (user, target) constraints of Vote and Boost make the writes
+    idempotent: a row is inserted or ignored, and a counter only moves when a
+    row was really inserted, switched or deleted by this request.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import Thread, Comment, Vote, Boost
+from .ranking import BOOST_WEIGHT, add_period_score, refresh_hot_scores, top_score
+from .response_cache import bump_versions, thread_scope
+
+VOTE_TYPES = ("like", "dislike")
+
+# Vote type -> counter column of the voted object
+VOTE_COUNTERS = {"like": "num_likes", "dislike": "num_dislikes"}
+
+
+def insert_or_ignore(model, defaults=None, **lookup):
+    """
+    Insert a row unless one with the same unique lookup already exists
+
+    Unlike get_or_create the insert is tried first, so two concurrent
+    requests can not both create it. Returns the (obj, created) pair.
+    """
+    try:
+        with transaction.atomic():
+            return model._default_manager.create(**lookup, **(defaults or {})), True
+    except IntegrityError:
+        try:
+            return model._default_manager.get(**lookup), False
+        except model.DoesNotExist:
+            # Not the unique constraint of the lookup
+            pass
+        raise
+
+
+def get_vote_field(target):
+    """
+    Return the name of the Vote foreign key that points to the target
+    """
+    if isinstance(target, Thread):
+        return "thread"
+    if isinstance(target, Comment):
+        # The replies are comments too
+        return "comment"
+    raise TypeError(f"Can not vote a {type(target).__name__}")
+
+
+def move_vote_counters(target, deltas):
+    """
+    Apply {vote_type: delta} to the counters of the target with one UPDATE
+    """
+    changes = {
+        VOTE_COUNTERS[vote_type]: F(VOTE_COUNTERS[vote_type]) + delta
+        for vote_type, delta in deltas.items()
+        if delta
+    }
+    if changes:
+        # update() does not touch updated_at
+        type(target).objects.filter(pk=target.pk).update(**changes)
+        if isinstance(target, Thread):
+            refresh_hot_scores([target.pk])
+            add_period_score(
+                target.pk, top_score(deltas.get("like", 0), deltas.get("dislike", 0), 0)
+            )
+        else:
+            # The counters are in the cached comment trees of the thread
+            bump_versions(thread_scope(target.thread_id))
+
+
+def cast_vote(user, target, vote_type):
+    """
+    Set the vote of the user on the target to vote_type
+
+    A previous vote of the other type is switched in place. Returns the
+    (vote, changed) pair, changed is False if the user already had this vote.
+    """
+    if vote_type not in VOTE_TYPES:
+        raise ValueError(f"Unknown vote type: {vote_type}")
+    field = get_vote_field(target)
+    lookup = {"user": user, field: target}
+    previous = next(other for other in VOTE_TYPES if other != vote_type)
+
+    with transaction.atomic():
+        # Two tries: a concurrent request may insert the other vote type
+        # between the switch and the insert
+        for _ in range(2):
+            # Conditional switch, only the request that changes the row
+            # moves the counters
+            switched = Vote.objects.filter(  # pylint: disable=no-member
+                vote_type=previous, **lookup
+            ).update(vote_type=vote_type)
+            if switched:
+                move_vote_counters(target, {previous: -1, vote_type: 1})
+                return Vote.objects.get(**lookup), True  # pylint: disable=no-member
+
+            vote, created = insert_or_ignore(
+                Vote, defaults={"vote_type": vote_type}, **lookup
+            )
+            if created:
+                move_vote_counters(target, {vote_type: 1})
+                return vote, True
+            if vote.vote_type == vote_type:
+                return vote, False
+        return vote, False
+
+
+def remove_vote(user, target, vote_type):
+    """
+    Remove the vote_type vote of the user on the target
+
+    Returns False if the user did not have that vote.
+    """
+    field = get_vote_field(target)
+
+    with transaction.atomic():
+        deleted, _ = Vote.objects.filter(  # pylint: disable=no-member
+            user=user, vote_type=vote_type, **{field: target}
+        ).delete()
+        move_vote_counters(target, {vote_type: -deleted})
+    return bool(deleted)
+
+
+def toggle_vote(user, target, vote_type):
+    """
+    HTML vote button: voting the same twice removes the vote, otherwise it is
+    created or switched
+    """
+    if not remove_vote(user, target, vote_type):
+        cast_vote(user, target, vote_type)
+
+
+def add_boost(user, thread):
+    """
+    Boost the thread, returns the (boost, created) pair
+    """
+    with transaction.atomic():
+        boost, created = insert_or_ignore(Boost, user=user, thread=thread)
+        if created:
+            # update() does not touch updated_at
+            Thread.objects.filter(pk=thread.pk).update(  # pylint: disable=no-member
+                num_points=F("num_points") + 1
+            )
+            refresh_hot_scores([thread.pk])
+            add_period_score(thread.pk, BOOST_WEIGHT)
+    return boost, created
+
+
+def remove_boost(user, thread):
+    """
+    Remove the boost of the user on the thread
+
+    Returns False if the user had not boosted it.
+    """
+    with transaction.atomic():
+        deleted, _ = Boost.objects.filter(  # pylint: disable=no-member
+            user=user, thread=thread
+        ).delete()
+        if deleted:
+            Thread.objects.filter(pk=thread.pk).update(  # pylint: disable=no-member
+                num_points=F("num_points") - deleted
+            )
+            refresh_hot_scores([thread.pk])
+            add_period_score(thread.pk, -BOOST_WEIGHT * deleted)
+    return bool(deleted)
+
+
+def toggle_boost(user, thread):
+    """
+    HTML boost button: boosting twice removes the boost
+    """
+    if not remove_boost(user, thread):
+        add_boost(user, thread)
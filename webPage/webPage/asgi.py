@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webPage.settings')
 
 application = get_asgi_application()
+
+# Only the server processes write their request metrics to METRICS_DIR
+from webPage.metrics import REGISTRY  # pylint: disable=wrong-import-position
+
+REGISTRY.start_flushing()
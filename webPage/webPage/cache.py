@@ -0,0 +1,100 @@
+"""
+    Local memory cache with a memory bound
+
+    LocMemCache keeps its entries in least recently used order but only
+    bounds their number (MAX_ENTRIES), and culls a third of them when it is
+    full. The cached comment trees (threads/tree_cache.py) are large and of
+    very different sizes, so BoundedLocMemCache also bounds the bytes of
+    the pickled values (MAX_BYTES in OPTIONS) and evicts the least recently
+    used entries, one at a time, until the new one fits.
+
+    Like LocMemCache it is the memory of one process: with several workers
+    use a shared backend (Redis, Memcached) for the invalidations.
+"""
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Bytes of the values of every named cache, like the entries of LocMemCache
+_sizes = {}
+
+
+class CacheSizes:
+    """
+    Size of every value of a cache and their total
+    """
+
+    def __init__(self):
+        self.sizes = {}
+        self.total = 0
+
+    def set(self, key, size):
+        self.total += size - self.sizes.get(key, 0)
+        self.sizes[key] = size
+
+    def remove(self, key):
+        self.total -= self.sizes.pop(key, 0)
+
+    def clear(self):
+        self.sizes.clear()
+        self.total = 0
+
+
+class BoundedLocMemCache(LocMemCache):
+    """
+    LocMemCache bounded by the bytes of its values, least recently used first out
+
+    A value larger than MAX_BYTES alone is not stored, as memcached does
+    with the values over its item size.
+    """
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        options = params.get("OPTIONS", {})
+        self._max_bytes = int(options.get("MAX_BYTES", DEFAULT_MAX_BYTES))
+        self._sizes = _sizes.setdefault(name, CacheSizes())
+
+    def _set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        if len(value) > self._max_bytes:
+            self._delete(key)
+            return
+        super()._set(key, value, timeout)
+        self._sizes.set(key, len(value))
+        # The new entry is the most recently used one, the last to go
+        while self._sizes.total > self._max_bytes:
+            self._pop_least_recent()
+
+    def incr(self, key, delta=1, version=None):
+        new_value = super().incr(key, delta, version)
+        key = self.make_and_validate_key(key, version=version)
+        with self._lock:
+            if key in self._cache:
+                self._sizes.set(key, len(self._cache[key]))
+        return new_value
+
+    def _pop_least_recent(self):
+        key, _ = self._cache.popitem()
+        del self._expire_info[key]
+        self._sizes.remove(key)
+
+    def _cull(self):
+        if self._cull_frequency == 0:
+            self._clear()
+        else:
+            for _ in range(len(self._cache) // self._cull_frequency):
+                self._pop_least_recent()
+
+    def _delete(self, key):
+        self._sizes.remove(key)
+        return super()._delete(key)
+
+    def _clear(self):
+        self._cache.clear()
+        self._expire_info.clear()
+        self._sizes.clear()
+
+    def clear(self):
+        with self._lock:
+            self._clear()
@@ -0,0 +1,24 @@
+"""
+    SQLite backend that writes the pending counter deltas before COMMIT
+
+    threads.counters buffers the counter deltas of a transaction. Written
+    by an on_commit callback, they would commit separately from the rows
+    they count: readers could see a new comment with the old count, and a
+    crash between the two commits would lose the deltas. This backend
+    writes them inside the transaction, right before it commits.
+"""
+
+from django.db.backends.sqlite3 import base
+
+from threads.counters import flush_pending_buffers
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def commit(self):
+        try:
+            flush_pending_buffers(self)
+        except Exception:
+            # Nothing of the transaction is committed without its counters
+            self.rollback()
+            raise
+        super().commit()
@@ -0,0 +1,391 @@
+"""
+    Request metrics in the Prometheus text format
+
+    MetricsMiddleware records, per resolved URL name (threads_api,
+    comments_api...), the requests, latency, SQL queries, SQL time and
+    response size. The samples are kept in memory by every worker process
+    and, in the server processes (wsgi.py, asgi.py), written every
+    METRICS_FLUSH_INTERVAL seconds to their own file in METRICS_DIR. The
+    /metrics view adds up the files of the live processes, so the totals do
+    not depend on the worker that answers the scrape. A process removes its
+    file when it exits and the files of the processes that died are
+    removed by the scrape: their counters leave the totals, which
+    Prometheus reads as a counter reset.
+
+    /metrics answers the addresses of METRICS_ALLOWED_IPS and the requests
+    with the METRICS_TOKEN bearer token, a 403 to the rest.
+
+    Other modules can declare their own Counter or Histogram, they are
+    exposed by the same view. The slow queries are logged by slow_queries.
+"""
+
+import atexit
+import bisect
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import slow_queries
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+class MetricsRegistry:
+    """
+    Samples of this process: {(metric name, label values): value}
+
+    A counter value is a number, a histogram value is the list of the
+    per-bucket counts (the last one is +Inf) followed by the sum.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        # Only the server processes write their samples (start_flushing())
+        self.flushing = False
+        self.reset()
+        # gunicorn --preload forks the workers from a loaded master
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.file_name = f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"
+        self.next_flush = 0
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add(self, name, labels, amount):
+        with self.lock:
+            self.values[(name, labels)] = self.values.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, bucket, value, buckets):
+        with self.lock:
+            counts = self.values.get((name, labels))
+            if counts is None:
+                counts = self.values[(name, labels)] = [0] * (buckets + 2)
+            counts[bucket] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.values.items()
+            ]
+
+    def get_directory(self):
+        directory = getattr(settings, "METRICS_DIR", None)
+        return Path(directory) if directory else None
+
+    def start_flushing(self):
+        """
+        Write the samples of this process to METRICS_DIR from now on
+
+        Called by the WSGI and ASGI applications: the manage.py commands
+        (test, benchmark...) keep their samples in memory.
+        """
+        if self.flushing:
+            return
+        self.flushing = True
+        atexit.register(self.remove_file)
+        self.prune()
+
+    def maybe_flush(self):
+        if self.flushing and time.monotonic() >= self.next_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the samples of this process to its file in METRICS_DIR
+        """
+        self.next_flush = time.monotonic() + getattr(settings, "METRICS_FLUSH_INTERVAL", 5)
+        directory = self.get_directory()
+        if directory is None or not self.values:
+            return
+        try:
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / self.file_name
+            temporary = path.with_suffix(".tmp")
+            temporary.write_text(json.dumps(self.snapshot()))
+            # The scrape never reads a half written file
+            os.replace(temporary, path)
+        except OSError:
+            pass
+
+    def remove_file(self):
+        directory = self.get_directory()
+        if directory is not None:
+            try:
+                (directory / self.file_name).unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def read_files(self):
+        """
+        Return the snapshots in the files of the other live processes and
+        remove the files of the dead ones
+        """
+        snapshots = []
+        for path in self.get_directory().glob("*-*.*"):
+            pid = path.name.split("-", 1)[0]
+            if not pid.isdigit() or path.suffix not in (".json", ".tmp"):
+                continue
+            if not is_process_alive(int(pid)):
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+                continue
+            if path.suffix != ".json" or path.name == self.file_name:
+                # Our samples are read from memory
+                continue
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                # Removed or being replaced
+                continue
+        return snapshots
+
+    def prune(self):
+        """
+        Remove the files of the processes that died
+        """
+        if self.get_directory() is not None:
+            try:
+                self.read_files()
+            except OSError:
+                pass
+
+    def collect(self):
+        """
+        Return the samples of every live process added up
+        """
+        snapshots = [self.snapshot()]
+        if self.get_directory() is not None:
+            try:
+                snapshots += self.read_files()
+            except OSError:
+                # No METRICS_DIR yet
+                pass
+
+        totals = {}
+        for snapshot in snapshots:
+            for name, labels, value in snapshot:
+                key = (name, tuple(labels))
+                if isinstance(value, list):
+                    previous = totals.get(key, [0] * len(value))
+                    totals[key] = [a + b for a, b in zip(previous, value)]
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def render(self):
+        """
+        Return the text exposition of every metric
+        """
+        samples = {}
+        for (name, labels), value in sorted(self.collect().items()):
+            samples.setdefault(name, []).append((labels, value))
+        lines = []
+        for name, metric in sorted(self.metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in samples.get(name, []):
+                lines.extend(metric.render(labels, value))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def is_process_alive(pid):
+    if os.name != "posix":
+        # os.kill() would end the process
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Alive, owned by another user
+        return True
+    return True
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Total that only goes up, e.g. requests
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        self.registry.add(self.name, labels, amount)
+
+    def render(self, labels, value):
+        return [f"{self.name}{format_labels(self.labelnames, labels)} {format_number(value)}"]
+
+
+class Histogram:
+    """
+    Distribution of the observed values in cumulative buckets
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.registry = registry
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        bucket = bisect.bisect_left(self.buckets, value)
+        self.registry.observe(self.name, labels, bucket, value, len(self.buckets))
+
+    def render(self, labels, value):
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), value[:-1]):
+            cumulative += count
+            le = bound if bound == "+Inf" else format_number(bound)
+            lines.append(f"{self.name}_bucket{format_labels(names, labels + (le,))} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_number(value[-1])}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REQUESTS = Counter(
+    "http_requests_total", "Requests by URL name, method and status", ("view", "method", "status")
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to answer the request", ("view",), DURATION_BUCKETS
+)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL queries run by the request", ("view",), QUERY_BUCKETS
+)
+REQUEST_DB_DURATION = Histogram(
+    "http_request_db_duration_seconds", "Time spent in SQL queries by the request", ("view",), DURATION_BUCKETS
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response body", ("view",), SIZE_BUCKETS
+)
+
+
+class QueryStats:
+    """
+    Execute wrapper that counts the queries of a request and their time,
+    and logs the slow ones
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.count = 0
+        self.seconds = 0.0
+        self.slow_threshold = slow_queries.get_threshold()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.seconds += duration
+            if self.slow_threshold is not None and duration >= self.slow_threshold:
+                slow_queries.log_slow_query(
+                    context["connection"], sql, params, many, duration, get_view_label(self.request)
+                )
+
+
+def get_view_label(request):
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        # 404s and requests answered by a middleware
+        return "<unresolved>"
+    return match.url_name or match.route or match.view_name
+
+
+class MetricsMiddleware:
+    """
+    Record the metrics of every request, it should be the first middleware
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats(request)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        view = get_view_label(request)
+        REQUESTS.inc(view, request.method, str(response.status_code))
+        REQUEST_DURATION.observe(duration, view)
+        REQUEST_QUERIES.observe(stats.count, view)
+        REQUEST_DB_DURATION.observe(stats.seconds, view)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view)
+        REGISTRY.maybe_flush()
+        return response
+
+
+def is_scrape_allowed(request):
+    if request.META.get("REMOTE_ADDR") in getattr(settings, "METRICS_ALLOWED_IPS", ()):
+        return True
+    token = getattr(settings, "METRICS_TOKEN", None)
+    if not token:
+        return False
+    authorization = request.META.get("HTTP_AUTHORIZATION", "")
+    return hmac.compare_digest(authorization.encode(), f"Bearer {token}".encode())
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint
+    """
+    if not is_scrape_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 
 # Import django storages
 from storages.backends.s3boto3 import S3Boto3Storage
@@ -81,6 +82,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "webPage.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -118,7 +120,8 @@ WSGI_APPLICATION = "webPage.wsgi.application"
 
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        # SQLite, plus the counter deltas written before COMMIT (webPage/db)
+        "ENGINE": "webPage.db",
         "NAME": BASE_DIR / "db.sqlite3",
     }
 }
@@ -204,6 +207,26 @@ AUTH_USER_MODEL = "auth.User"
 MEDIA_ROOT = "media/"
 MEDIA_URL = "media/"
 
+# Request metrics (/metrics): every worker process writes its totals to
+# this directory every METRICS_FLUSH_INTERVAL seconds
+METRICS_DIR = os.environ.get(
+    "METRICS_DIR", os.path.join(tempfile.gettempdir(), "kbin-metrics")
+)
+METRICS_FLUSH_INTERVAL = 5
+# Who can scrape /metrics: these addresses (REMOTE_ADDR, the proxy behind
+# one) or the requests with "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_ALLOWED_IPS = [
+    ip for ip in os.environ.get("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip
+]
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Slow query log (webPage/slow_queries.py), summarized by
+# manage.py slow_queries. None disables it. Every worker appends to the
+# file, rotate it with logrotate (the processes reopen it once it moves).
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_SAMPLE_RATE = 1.0
+SLOW_QUERY_LOG_FILE = os.environ.get("SLOW_QUERY_LOG_FILE")
+
 
 # AWS S3 settings
 AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
@@ -241,3 +264,36 @@ LOGIN_URL = "google_login"
 
 
 CORS_ALLOW_ALL_ORIGINS = True
+
+# The local memory of every process, bounded by the bytes of the values and
+# least recently used first out (webPage/cache.py). With several workers use
+# a shared backend (Redis, Memcached) so the invalidations reach all of them.
+CACHES = {
+    "default": {
+        "BACKEND": "webPage.cache.BoundedLocMemCache",
+        "OPTIONS": {
+            # The bytes are the bound, not the number of entries
+            "MAX_ENTRIES": 100000,
+            "MAX_BYTES": 64 * 1024 * 1024,
+        },
+    }
+}
+
+# Cache of the anonymous thread lists (threads/response_cache.py), in
+# seconds, 0 disables it.
+API_CACHE_TIMEOUT = 30
+
+# Subscribed feed (threads/feed.py): users subscribed to more magazines read
+# it merged from the threads instead of having their own copy, which is
+# built with the newest FEED_BACKFILL threads of their magazines.
+FEED_FANOUT_MAX_SUBSCRIPTIONS = 100
+FEED_BACKFILL = 500
+
+# Paginated comment trees (threads/comment_pages.py): every comment or reply
+# shows up to COMMENT_TREE_BREADTH replies, COMMENT_TREE_DEPTH levels down,
+# the rest is loaded with the more_replies cursor of the node.
+COMMENT_TREE_BREADTH = 10
+COMMENT_TREE_DEPTH = 5
+# Cache of their pages (threads/tree_cache.py), in seconds, 0 disables it.
+# Every change of the comments of a thread invalidates its pages.
+COMMENT_TREE_CACHE_TIMEOUT = 300
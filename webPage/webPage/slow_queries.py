@@ -0,0 +1,198 @@
+"""
+    Slow query log
+
+    The queries of a request slower than SLOW_QUERY_THRESHOLD_MS are logged
+    (a SLOW_QUERY_SAMPLE_RATE share of them) as JSON lines in
+    SLOW_QUERY_LOG_FILE, unset by default. Every entry has the normalized SQL and its
+    fingerprint, the parameters, the URL name and project line that ran it,
+    and the EXPLAIN (QUERY PLAN) of the statement, captured once per
+    fingerprint every PLAN_TTL seconds.
+
+    Every worker process appends to the same file, so it is rotated
+    outside (logrotate, with the rotated files named <file>.1, <file>.2...):
+    the WatchedFileHandler of each process opens the new file when the old
+    one is moved. The queries are timed by MetricsMiddleware,
+    ``manage.py slow_queries`` aggregates the log.
+"""
+
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+import traceback
+from logging.handlers import WatchedFileHandler
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+# Seconds a captured plan is reused for the same fingerprint
+PLAN_TTL = 600
+MAX_PARAM_LENGTH = 100
+MAX_PARAMS = 20
+
+PROJECT_DIR = Path(settings.BASE_DIR).resolve()
+# Wraps every request, never the origin of a query
+IGNORED_FILES = {PROJECT_DIR / "webPage" / "metrics.py"}
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST_RE = re.compile(r"\((?:\s*\?\s*,)*\s*\?\s*\)")
+_SPACES_RE = re.compile(r"\s+")
+
+_plans = {}
+_plans_lock = threading.Lock()
+_handler = None
+_handler_lock = threading.Lock()
+
+logger = logging.getLogger("webPage.slow_queries")
+logger.propagate = False
+
+
+def get_threshold():
+    """
+    Return the threshold in seconds, None if the log is disabled
+    """
+    threshold = getattr(settings, "SLOW_QUERY_THRESHOLD_MS", None)
+    if threshold is None or not getattr(settings, "SLOW_QUERY_LOG_FILE", None):
+        return None
+    return threshold / 1000
+
+
+def normalize_sql(sql):
+    """
+    Replace the literals and placeholders by ? so the same query with other
+    values (or IN lists of other lengths) has the same text
+    """
+    sql = sql.replace("%s", "?")
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _PLACEHOLDER_LIST_RE.sub("(...)", sql)
+    return _SPACES_RE.sub(" ", sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()[:12]
+
+
+def format_params(params):
+    if params is None:
+        return None
+    values = [
+        value if isinstance(value, (int, float, bool, type(None))) else str(value)[:MAX_PARAM_LENGTH]
+        for value in params[:MAX_PARAMS]
+    ]
+    if len(params) > MAX_PARAMS:
+        values.append(f"... {len(params) - MAX_PARAMS} more")
+    return values
+
+
+def find_call_site():
+    stack = traceback.extract_stack()
+    # Skip the execute wrappers (this log, the metrics, the benchmark...)
+    for index, frame in enumerate(stack):
+        if frame.name == "_execute_with_wrappers":
+            stack = stack[:index]
+            break
+    for frame in reversed(stack):
+        path = Path(frame.filename).resolve()
+        if PROJECT_DIR in path.parents and path not in IGNORED_FILES:
+            return f"{path.relative_to(PROJECT_DIR)}:{frame.lineno} in {frame.name}"
+    return None
+
+
+def explain(connection, sql, params, key):
+    """
+    Return the plan of a SELECT as a list of lines, reused for PLAN_TTL
+    """
+    now = time.monotonic()
+    with _plans_lock:
+        cached = _plans.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    try:
+        with connection.cursor() as cursor:
+            # The database cursor: not timed, counted nor logged again
+            cursor.cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params or ())
+            rows = cursor.cursor.fetchall()
+        if connection.vendor == "sqlite":
+            # id, parent, notused, detail
+            plan = [row[-1] for row in rows]
+        else:
+            plan = [" ".join(str(column) for column in row) for row in rows]
+    except DatabaseError as error:
+        plan = [f"EXPLAIN failed: {error}"]
+    with _plans_lock:
+        if len(_plans) > 1000:
+            _plans.clear()
+        _plans[key] = (now + PLAN_TTL, plan)
+    return plan
+
+
+def get_handler():
+    global _handler  # pylint: disable=global-statement
+    with _handler_lock:
+        path = Path(settings.SLOW_QUERY_LOG_FILE)
+        if _handler is None or Path(_handler.baseFilename) != path.resolve():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if _handler is not None:
+                logger.removeHandler(_handler)
+                _handler.close()
+            _handler = WatchedFileHandler(path, encoding="utf-8")
+            logger.addHandler(_handler)
+        return _handler
+
+
+def log_slow_query(connection, sql, params, many, duration, view):
+    """
+    Write the entry of a query that took longer than the threshold
+    """
+    if random.random() >= getattr(settings, "SLOW_QUERY_SAMPLE_RATE", 1.0):
+        return
+    normalized = normalize_sql(sql)
+    key = fingerprint(normalized)
+    entry = {
+        "time": timezone.now().isoformat(timespec="milliseconds"),
+        "duration_ms": round(duration * 1000, 2),
+        "database": connection.alias,
+        "fingerprint": key,
+        "sql": normalized,
+        "params": None if many else format_params(params),
+        "view": view,
+        "call_site": find_call_site(),
+        "plan": None if many else explain(connection, sql, params, (connection.alias, key)),
+    }
+    try:
+        get_handler()
+        logger.warning(json.dumps(entry, default=str))
+    except OSError:
+        pass
+
+
+def read_entries(path):
+    """
+    Yield the entries of the log and its rotated files, oldest file first
+    """
+    path = Path(path)
+    # Compressed rotated files are skipped
+    backups = sorted(
+        (backup for backup in path.parent.glob(path.name + ".*") if backup.suffix[1:].isdigit()),
+        key=lambda backup: int(backup.suffix[1:]),
+        reverse=True,
+    )
+    for file in backups + [path]:
+        try:
+            with open(file, encoding="utf-8") as lines:
+                for line in lines:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, SimpleTestCase, override_settings
+
+from magazine.models import Magazine
+from threads.models import Thread
+from .cache import BoundedLocMemCache
+from .metrics import REGISTRY
+from .slow_queries import normalize_sql, read_entries
+
+
+class MetricsTest(TestCase):
+    """
+    /metrics exposes the samples of MetricsMiddleware of every process
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(username="author", password="pass")
+        magazine = Magazine.objects.create(name="magazine", title="Magazine", author=author)
+        Thread.objects.create(title="Thread", body="Body", author=author, magazine=magazine)
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        settings = override_settings(METRICS_DIR=self.directory, API_CACHE_TIMEOUT=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        REGISTRY.reset()
+        self.addCleanup(REGISTRY.reset)
+
+    def get_samples(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_request_metrics_per_url_name(self):
+        for _ in range(3):
+            self.client.get("/api/threads/")
+        self.client.get("/api/threads/0/")
+
+        samples = self.get_samples()
+        self.assertEqual(samples['http_requests_total{view="threads_api",method="GET",status="200"}'], 3)
+        self.assertEqual(
+            samples['http_requests_total{view="thread_detail_api",method="GET",status="404"}'], 1
+        )
+        self.assertEqual(samples['http_request_duration_seconds_count{view="threads_api"}'], 3)
+        self.assertEqual(samples['http_request_duration_seconds_bucket{view="threads_api",le="+Inf"}'], 3)
+        # One query per list (anonymous)
+        self.assertEqual(samples['http_request_db_queries_sum{view="threads_api"}'], 3)
+        self.assertEqual(samples['http_request_db_queries_bucket{view="threads_api",le="1"}'], 3)
+        self.assertEqual(samples['http_request_db_queries_bucket{view="threads_api",le="0"}'], 0)
+        self.assertGreater(samples['http_request_db_duration_seconds_sum{view="threads_api"}'], 0)
+        self.assertGreater(samples['http_response_size_bytes_sum{view="threads_api"}'], 0)
+
+    def test_unresolved_urls_share_a_label(self):
+        self.client.get("/does-not-exist/")
+        samples = self.get_samples()
+        self.assertEqual(samples['http_requests_total{view="<unresolved>",method="GET",status="404"}'], 1)
+
+    def test_samples_of_other_processes_are_added(self):
+        self.client.get("/api/threads/")
+        buckets = [0] * (len(REGISTRY.metrics["http_request_db_queries"].buckets) + 1)
+        buckets[2] = 4
+        with open(f"{self.directory}/{os.getppid()}-other.json", "w", encoding="utf-8") as file:
+            json.dump(
+                [
+                    ["http_requests_total", ["threads_api", "GET", "200"], 4],
+                    ["http_request_db_queries", ["threads_api"], buckets + [8]],
+                ],
+                file,
+            )
+
+        samples = self.get_samples()
+        self.assertEqual(samples['http_requests_total{view="threads_api",method="GET",status="200"}'], 5)
+        self.assertEqual(samples['http_request_db_queries_sum{view="threads_api"}'], 9)
+        self.assertEqual(samples['http_request_db_queries_count{view="threads_api"}'], 5)
+
+    def test_files_of_dead_processes_are_removed(self):
+        with subprocess.Popen([sys.executable, "-c", "pass"]) as process:
+            process.wait()
+        dead = Path(self.directory) / f"{process.pid}-dead.json"
+        dead.write_text(json.dumps([["http_requests_total", ["threads_api", "GET", "200"], 4]]))
+        self.client.get("/api/threads/")
+
+        samples = self.get_samples()
+        self.assertEqual(samples['http_requests_total{view="threads_api",method="GET",status="200"}'], 1)
+        self.assertFalse(dead.exists())
+
+    def test_only_server_processes_write_a_file(self):
+        self.client.get("/api/threads/")
+        REGISTRY.maybe_flush()
+        self.assertEqual(os.listdir(self.directory), [])
+
+        REGISTRY.flushing = True
+        self.addCleanup(setattr, REGISTRY, "flushing", False)
+        REGISTRY.maybe_flush()
+        self.assertEqual(os.listdir(self.directory), [REGISTRY.file_name])
+        REGISTRY.remove_file()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.1"], METRICS_TOKEN="secret")
+    def test_scrape_access(self):
+        self.assertEqual(self.client.get("/metrics", REMOTE_ADDR="10.0.0.1").status_code, 200)
+        self.assertEqual(self.client.get("/metrics").status_code, 403)
+        self.assertEqual(
+            self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer other").status_code, 403
+        )
+        self.assertEqual(
+            self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer secret").status_code, 200
+        )
+        with override_settings(METRICS_TOKEN=None):
+            self.assertEqual(self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+    def test_label_values_are_escaped(self):
+        REGISTRY.metrics["http_requests_total"].inc('a"b\\c', "GET", "200")
+        response = self.client.get("/metrics")
+        self.assertTrue(
+            re.search(r'view="a\\"b\\\\c"', response.content.decode()), response.content
+        )
+
+
+class SlowQueryLogTest(TestCase):
+    """
+    Queries over the threshold are logged with their plan and summarized
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        MetricsTest.setUpTestData()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log_file = Path(directory.name) / "slow.log"
+        # Every query is slow
+        settings = override_settings(
+            SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_LOG_FILE=str(self.log_file), API_CACHE_TIMEOUT=0
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def summarize(self, *args):
+        output = StringIO()
+        call_command("slow_queries", "--json", *args, stdout=output)
+        return json.loads(output.getvalue())
+
+    def test_entries_have_the_plan_and_origin(self):
+        self.client.get("/api/threads/?order_by=points")
+        self.client.get("/api/threads/?order_by=points")
+
+        groups = self.summarize()
+        self.assertEqual(len(groups), 1)
+        group = groups[0]
+        self.assertEqual(group["count"], 2)
+        self.assertEqual(group["views"], {"threads_api": 2})
+        self.assertTrue(group["call_sites"], group)
+        self.assertTrue(all(site.startswith("threads/") for site in group["call_sites"]), group)
+        self.assertIn('FROM "threads_thread"', group["sql"])
+        self.assertTrue(any("threads_thread" in line for line in group["plan"]), group["plan"])
+
+    def test_sampling(self):
+        with override_settings(SLOW_QUERY_SAMPLE_RATE=0):
+            self.client.get("/api/threads/")
+        self.assertEqual(self.summarize(), [])
+
+    def test_rotated_files_are_read(self):
+        self.client.get("/api/threads/")
+        # Moved by logrotate, the handler opens a new file
+        self.log_file.rename(self.log_file.with_name("slow.log.1"))
+        self.log_file.with_name("slow.log.2.gz").write_bytes(b"\x1f\x8b")
+        for _ in range(2):
+            self.client.get("/api/threads/")
+        self.assertTrue(self.log_file.exists())
+        self.assertEqual(len(list(read_entries(self.log_file))), 3)
+
+
+class NormalizeSQLTest(SimpleTestCase):
+    def test_literals_and_lists(self):
+        self.assertEqual(
+            normalize_sql(
+                "SELECT  \"t\".\"id\" FROM \"t2\" WHERE \"t\".\"id\" IN (%s, %s, %s)"
+                " AND name = 'x''y' LIMIT 25"
+            ),
+            'SELECT "t"."id" FROM "t2" WHERE "t"."id" IN (...) AND name = ? LIMIT ?',
+        )
+        self.assertEqual(normalize_sql("WHERE id IN (%s)"), normalize_sql("WHERE id IN (%s, %s)"))
+
+
+class BoundedLocMemCacheTest(SimpleTestCase):
+    """
+    The local memory cache evicts the least recently used entries past MAX_BYTES
+    """
+
+    def setUp(self):
+        self.cache = BoundedLocMemCache("bounded-test", {"OPTIONS": {"MAX_BYTES": 1000}})
+        self.addCleanup(self.cache.clear)
+
+    def test_least_recently_used_first_out(self):
+        for key in ("a", "b", "c"):
+            self.cache.set(key, "x" * 300)
+        self.assertEqual(self.cache.get("a"), "x" * 300)
+        # "b" is the least recently used one now
+        self.cache.set("d", "x" * 300)
+        self.assertEqual([key for key in "abcd" if self.cache.has_key(key)], ["a", "c", "d"])
+        self.assertLessEqual(self.cache._sizes.total, 1000)
+
+        self.cache.delete("a")
+        self.cache.set("c", "y")
+        self.cache.set("e", "x" * 700)
+        self.assertEqual([key for key in "cde" if self.cache.has_key(key)], ["c", "e"])
+
+    def test_value_larger_than_the_bound(self):
+        self.cache.set("a", "x" * 300)
+        self.cache.set("b", "x" * 2000)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "x" * 300)
+        self.assertFalse(self.cache.add("b", "x" * 2000) and self.cache.has_key("b"))
+
+    def test_incr_and_clear(self):
+        self.cache.set("counter", 1)
+        size = self.cache._sizes.total
+        self.assertEqual(self.cache.incr("counter", 2**40), 2**40 + 1)
+        self.assertGreater(self.cache._sizes.total, size)
+        self.cache.clear()
+        self.assertEqual(self.cache._sizes.total, 0)
@@ -21,6 +21,7 @@ from threads import urls as urlThreads
 from magazine import urls as urlMagazine
 from drf_yasg import openapi
 from drf_yasg.views import get_schema_view
+from .metrics import metrics
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -48,4 +49,5 @@ urlpatterns = [
         name="schema-swagger-ui",
     ),
     path("api-auth/", include("rest_framework.urls")),
+    path("metrics", metrics, name="metrics"),
 ]
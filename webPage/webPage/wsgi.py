@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webPage.settings')
 
 application = get_wsgi_application()
+
+# Only the server processes write their request metrics to METRICS_DIR
+from webPage.metrics import REGISTRY  # pylint: disable=wrong-import-position
+
+REGISTRY.start_flushing()